@@ -1,16 +1,25 @@
 ﻿import os
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, send_from_directory, render_template_string
+from flask import Flask, request, jsonify, send_from_directory, send_file, render_template_string
 import requests
 from pydub import AudioSegment
 from openai import AsyncAzureOpenAI
 
 from src.enums import OnPremiseMode
-from src.voiceprint_library_service import search_voiceprint, insert_voiceprint
-from src.azure_service import azure_transcription, azure_extract_speaker_clip, azure_match_speaker_voiceprint, azure_upload_media_and_get_sas_url, azure_upload_file_and_get_sas_url
-from src.fanolab_service import fanolab_submit_transcription, fanolab_transcription, fanolab_extract_speaker_clip, fanolab_match_speaker_voiceprint
+from src.voiceprint_library_service import find_voiceprint_matches, insert_voiceprint, async_search_voiceprint
+from src.azure_service import azure_transcription, azure_extract_speaker_clip, azure_match_speaker_voiceprint, azure_upload_media_and_get_sas_url
+from src.azure_webhook_service import azure_transcription_webhook, register_azure_transcription_job, get_azure_transcription_job_status
+from src.fanolab_service import fanolab_submit_transcription, async_fanolab_submit_transcription, fanolab_transcription, fanolab_extract_speaker_clip, fanolab_match_speaker_voiceprint, is_fanolab_operation_done
+from src.deferred_blob_deletion_service import start_deferred_blob_deletion
+from src.voiceprint_reembed_service import reembed_voiceprint_library, get_reembed_job
+from src.voiceprint_bundle_service import export_voiceprint_library, import_voiceprint_library
 from src.tflow_service import get_meeting_minutes, get_project_list, get_project_memory, get_dashboard
-from src.blob_storage_service import minio_upload_and_share, minio_delete_blob
+from src.blob_store import get_blob_store, LocalBlobStore, MEDIA_CONTAINER, LOCAL_BLOB_ROUTE
+from src.direct_upload_service import start_direct_upload, complete_direct_upload, abort_direct_upload
+from src.upload_session_service import (
+    create_upload_session, get_upload_session, put_upload_chunk, finalize_upload_session, expire_upload_sessions
+)
+from src.http_client import get_http_stats
 import uuid
 from datetime import timedelta
 
@@ -20,6 +29,16 @@ app = Flask(__name__)
 
 # On cloud or on premises
 ON_PREMISES_MODE = os.getenv("ON_PREMISES_MODE")
+# asyncpg pool size, set only when served from a single event loop (ASGI); 0 keeps the sync database path
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "0"))
+
+def start_background_jobs():
+    """
+    Start this process's background schedulers: deleting temporary blobs, e.g. Fanolab submission audio once its
+    operation is done, and aborting the uploads of expired upload sessions. Called per worker by the post_worker_init hook in gunicorn.conf.py and by `python app.py`,
+    not on import, so scripts, migrations and tests importing app.py do not start threads.
+    """
+    start_deferred_blob_deletion(operation_done=is_fanolab_operation_done, sweeps=(expire_upload_sessions,))
 
 # HTML template for the frontend
 UPLOAD_TEMPLATE = """
@@ -125,7 +144,7 @@ UPLOAD_TEMPLATE = """
         <h1>Meeting Minutes Upload (wav or mp4 only)</h1>
         
         <div class="upload-section">
-            <form id="uploadForm" enctype="multipart/form-data">
+            <form id="uploadForm">
                 <input type="file" id="fileInput" accept=".mp4,.wav" required>
                 <button type="submit" id="uploadButton">Upload File</button>
             </form>
@@ -204,27 +223,106 @@ UPLOAD_TEMPLATE = """
             }
 
             setLoading(true);
-            const formData = new FormData();
-            formData.append('file', file);
-
             try {
-                const response = await fetch('/upload/file', {
-                    method: 'POST',
-                    body: formData
-                });
-                const data = await response.json();
-                
-                if (response.ok) {
-                    showResult('', false, data.sas_url);
-                } else {
-                    showResult(data.error || 'Upload failed', true);
-                }
+                const sasUrl = await uploadResumable(file);
+                showResult('', false, sasUrl);
             } catch (error) {
-                showResult('Error uploading file', true);
+                showResult(error.message || 'Error uploading file', true);
             } finally {
                 setLoading(false);
             }
         });
+
+        async function postJson(url, body) {
+            const response = await fetch(url, {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify(body)
+            });
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || 'Upload failed');
+            }
+            return data;
+        }
+
+        async function putChunk(sessionId, offset, blob) {
+            // Retry a failed chunk a few times, the other chunks keep going
+            for (let attempt = 1; ; attempt++) {
+                try {
+                    const response = await fetch(`/upload/sessions/${sessionId}?offset=${offset}`, {method: 'PUT', body: blob});
+                    if (response.ok) {
+                        return;
+                    }
+                    if (attempt >= 3 || response.status < 500) {
+                        throw new Error(`Chunk upload failed with status ${response.status}`);
+                    }
+                } catch (error) {
+                    if (attempt >= 3) {
+                        throw error;
+                    }
+                }
+                await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+            }
+        }
+
+        async function uploadResumable(file) {
+            // Chunks are sent in parallel to a resumable upload session. The session of the file is remembered,
+            // so after a dropped connection or a reload, uploading the same file again only sends the missing chunks
+            const sessionKey = `upload-session:${file.name}:${file.size}:${file.lastModified}`;
+            const uploadStatus = document.getElementById('uploadStatus');
+            let upload = null;
+            const savedSessionId = localStorage.getItem(sessionKey);
+            if (savedSessionId) {
+                const response = await fetch(`/upload/sessions/${savedSessionId}`);
+                if (response.ok) {
+                    upload = await response.json();
+                    if (upload.status === 'completed') {
+                        localStorage.removeItem(sessionKey);
+                        return upload.sas_url;
+                    }
+                    if (upload.status !== 'uploading') {
+                        upload = null;
+                    }
+                }
+            }
+            if (!upload) {
+                upload = await postJson('/upload/sessions', {filename: file.name, size: file.size});
+                localStorage.setItem(sessionKey, upload.session_id);
+            }
+
+            const pendingOffsets = upload.missing_offsets.slice();
+            let uploadedBytes = upload.received_bytes;
+            let failed = false;
+
+            async function sendChunks() {
+                while (pendingOffsets.length && !failed) {
+                    const offset = pendingOffsets.shift();
+                    const blob = file.slice(offset, Math.min(offset + upload.chunk_size, file.size));
+                    try {
+                        await putChunk(upload.session_id, offset, blob);
+                    } catch (error) {
+                        failed = true;  // Stop the other workers
+                        throw error;
+                    }
+                    uploadedBytes += blob.size;
+                    uploadStatus.textContent = `Uploading... ${Math.floor(uploadedBytes * 100 / file.size)}%`;
+                }
+            }
+
+            uploadStatus.textContent = `Uploading... ${Math.floor(uploadedBytes * 100 / file.size)}%`;
+            try {
+                const workers = Math.max(1, Math.min(upload.concurrency, pendingOffsets.length));
+                await Promise.all(Array.from({length: workers}, sendChunks));
+            } catch (error) {
+                throw new Error(`${error.message}. Upload the same file again to resume.`);
+            }
+
+            uploadStatus.textContent = 'Finishing upload...';
+            const result = await postJson(`/upload/sessions/${upload.session_id}/finalize`, {});
+            localStorage.removeItem(sessionKey);
+            return result.sas_url;
+        }
     </script>
 </body>
 </html>
@@ -257,7 +355,7 @@ FANO_EXTRACT_TEMPLATE = """
             border-radius: 4px;
             text-align: center;
         }
-        input[type="text"] {
+        input[type="text"], select {
             width: 100%;
             padding: 8px;
             margin: 8px 0;
@@ -323,6 +421,11 @@ FANO_EXTRACT_TEMPLATE = """
             <form id="fanoExtractForm">
                 <input type="text" id="sourceUrlInput" placeholder="Meeting Url" required>
                 <input type="text" id="fanolabIdInput" placeholder="Fanolab ID" required>
+                <select id="clipFormatSelect">
+                    <option value="wav">WAV (uncompressed)</option>
+                    <option value="flac">FLAC (lossless, smaller)</option>
+                    <option value="opus">Opus (smallest)</option>
+                </select>
                 <button type="submit" id="fanoExtractButton">Extract Speaker Clips</button>
             </form>
             <div class="spinner" id="spinner"></div>
@@ -361,17 +464,20 @@ FANO_EXTRACT_TEMPLATE = """
             const status = document.getElementById('uploadStatus');
             const sourceUrlInput = document.getElementById('sourceUrlInput');
             const fanolabIdInput = document.getElementById('fanolabIdInput');
+            const clipFormatSelect = document.getElementById('clipFormatSelect');
             if (isLoading) {
                 spinner.style.display = 'block';
                 button.disabled = true;
                 sourceUrlInput.disabled = true;
                 fanolabIdInput.disabled = true;
+                clipFormatSelect.disabled = true;
                 status.textContent = 'Processing...';
             } else {
                 spinner.style.display = 'none';
                 button.disabled = false;
                 sourceUrlInput.disabled = false;
                 fanolabIdInput.disabled = false;
+                clipFormatSelect.disabled = false;
                 status.textContent = '';
             }
         }
@@ -380,6 +486,7 @@ FANO_EXTRACT_TEMPLATE = """
             e.preventDefault();
             const sourceUrl = document.getElementById('sourceUrlInput').value.trim();
             const fanolabId = document.getElementById('fanolabIdInput').value.trim();
+            const clipFormat = document.getElementById('clipFormatSelect').value;
             if (!sourceUrl || !fanolabId) {
                 showResult('Please provide both Source URL and Fanolab ID', true);
                 return;
@@ -389,7 +496,7 @@ FANO_EXTRACT_TEMPLATE = """
                 const response = await fetch('/upload/fano_extract_speaker_clip', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ source_url: sourceUrl, fanolab_id: fanolabId })
+                    body: JSON.stringify({ source_url: sourceUrl, fanolab_id: fanolabId, format: clipFormat })
                 });
                 const data = await response.json();
                 if (response.ok && data.download_url) {
@@ -442,36 +549,14 @@ def upload_file():
             # Generate blob name
             blob_name = f"media/{unique_id}.{file_type}"
 
-            # Upload with 1-year expiry
-            # Upload to Azure
-            if ON_PREMISES_MODE == OnPremiseMode.ON_CLOUD.value:
-                sas_url = azure_upload_file_and_get_sas_url(
-                    file_path=temp_filepath,
-                    blob_name=blob_name,
-                    expiry_date=timedelta(days=365)
-                )
-
-                if not sas_url:
-                    return jsonify({"error": "Failed to upload file to Azure"}), 500
-
-                return jsonify({"sas_url": sas_url})
-
-            # Upload to MinIO
-            elif ON_PREMISES_MODE == OnPremiseMode.ON_PREMISES.value:
-                sas_url = minio_upload_and_share(
-                    file_path=temp_filepath,
-                    bucket="meeting-minutes",
-                    blob_name=blob_name,
-                    expiry_date=timedelta(days=7)
-                )
-
-                if not sas_url:
-                    return jsonify({"error": "Failed to upload file to MinIO Storage"}), 500
-
-                return jsonify({"sas_url": sas_url})
-            # Incorrect env variable
-            else:
-                return jsonify({"error": "Failed to upload file to Blob Storage: Incorrect env variable"}), 500
+            # Upload with 1-year expiry (MinIO caps presigned URLs at 7 days)
+            try:
+                sas_url = get_blob_store().put_file_and_presign(MEDIA_CONTAINER, blob_name, temp_filepath, expiry=timedelta(days=365))
+            except Exception as e:
+                print(f"An error occurred while uploading the file: {e}")
+                return jsonify({"error": "Failed to upload file to Blob Storage"}), 500
+
+            return jsonify({"sas_url": sas_url})
         finally:
             # Clean up temporary file
             if os.path.exists(temp_filepath):
@@ -480,6 +565,88 @@ def upload_file():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route(f'{LOCAL_BLOB_ROUTE}/<container>/<path:blob_name>', methods=['GET'])
+def get_local_blob(container, blob_name):
+    # Presigned URLs of the local blob store; conditional responses give Range support like Azure and MinIO
+    store = get_blob_store()
+    if not isinstance(store, LocalBlobStore):
+        return jsonify({"error": "Not found"}), 404
+    if not store.verify(container, blob_name, request.args.get("expires", ""), request.args.get("signature", "")):
+        return jsonify({"error": "Invalid or expired signature"}), 403
+    try:
+        path = store.path(container, blob_name)
+    except ValueError:
+        return jsonify({"error": "Not found"}), 404
+    if not os.path.isfile(path):
+        return jsonify({"error": "Not found"}), 404
+    return send_file(path, conditional=True)
+
+@app.route(f'{LOCAL_BLOB_ROUTE}/<container>/<path:blob_name>', methods=['PUT'])
+def put_local_blob_part(container, blob_name):
+    # Presigned part URLs of multipart uploads to the local blob store
+    store = get_blob_store()
+    if not isinstance(store, LocalBlobStore):
+        return jsonify({"error": "Not found"}), 404
+    upload_id = request.args.get("upload_id", "")
+    part_number = request.args.get("part_number", "")
+    if not store.verify(container, blob_name, request.args.get("expires", ""), request.args.get("signature", ""),
+                        "PUT", upload_id, part_number):
+        return jsonify({"error": "Invalid or expired signature"}), 403
+    try:
+        store.put_part(container, blob_name, upload_id, int(part_number), request.stream)
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 404
+    return "", 200
+
+@app.route('/upload/direct', methods=['POST'])
+def upload_direct_api():
+    try:
+        return start_direct_upload(request)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/upload/direct/complete', methods=['POST'])
+def upload_direct_complete_api():
+    try:
+        return complete_direct_upload(request)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/upload/direct/abort', methods=['POST'])
+def upload_direct_abort_api():
+    try:
+        return abort_direct_upload(request)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/upload/sessions', methods=['POST'])
+def upload_session_create_api():
+    try:
+        return create_upload_session(request)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/upload/sessions/<session_id>', methods=['GET'])
+def upload_session_status_api(session_id):
+    try:
+        return get_upload_session(session_id)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/upload/sessions/<session_id>', methods=['PUT'])
+def upload_session_chunk_api(session_id):
+    try:
+        return put_upload_chunk(request, session_id)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/upload/sessions/<session_id>/finalize', methods=['POST'])
+def upload_session_finalize_api(session_id):
+    try:
+        return finalize_upload_session(session_id)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # @app.route('/upload/url', methods=['POST'])
 # def upload_url():
 #     return azure_upload_media_and_get_sas_url(request)
@@ -492,7 +659,27 @@ def azure_transcription_api():
     except Exception as e:
         return jsonify({"error": str(e)})
 
-@app.route('/fanolab_submit_transcription', methods=['POST'])
+@app.route('/azure_transcription/webhook', methods=['POST'])
+def azure_transcription_webhook_api():
+    try:
+        return azure_transcription_webhook(request)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/azure_transcription/jobs', methods=['POST'])
+def azure_transcription_job_register_api():
+    try:
+        return register_azure_transcription_job(request)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/azure_transcription/jobs/<transcription_id>', methods=['GET'])
+def azure_transcription_job_status_api(transcription_id):
+    try:
+        return get_azure_transcription_job_status(transcription_id)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 def fanolab_submit_transcription_api():
     try:
         result = fanolab_submit_transcription(request)
@@ -500,6 +687,19 @@ def fanolab_submit_transcription_api():
     except Exception as e:
         return jsonify({"error": str(e)})
 
+async def async_fanolab_submit_transcription_api():
+    try:
+        result = await async_fanolab_submit_transcription(request)
+        return result
+    except Exception as e:
+        return jsonify({"error": str(e)})
+
+# As /search_voiceprint, the quota is charged on the async engine only when one event loop serves every request
+if ASYNC_DB_POOL_SIZE > 0:
+    app.add_url_rule('/fanolab_submit_transcription', view_func=async_fanolab_submit_transcription_api, methods=['POST'])
+else:
+    app.add_url_rule('/fanolab_submit_transcription', view_func=fanolab_submit_transcription_api, methods=['POST'])
+
 @app.route('/fanolab_transcription', methods=['POST'])
 def fanolab_transcription_api():
     try:
@@ -532,13 +732,80 @@ def insert_voiceprint_api():
     except Exception as e:
         return jsonify({'error': str(e)})
 
-@app.route('/search_voiceprint', methods=['POST'])
+def _search_voiceprint_options(data: dict) -> dict:
+    return {
+        "limit": data.get('limit'),
+        "confidence_threshold": data.get('confidence_threshold'),
+        "ef_search": data.get('ef_search'),
+        "probes": data.get('probes'),
+        "iterative_scan": data.get('iterative_scan'),
+        "exact_rerank": data.get('exact_rerank'),
+        # JSON booleans, or "true" / "1" as strings; "false" must not count as set
+        "include_stats": str(data.get('include_stats', False)).lower() in ("true", "1"),
+        "explain": str(data.get('explain', False)).lower() in ("true", "1"),
+    }
+
 def search_voiceprint_api():
     try:
         data = request.json
         if not data or 'path' not in data or 'application_owner' not in data:
             return jsonify({'error': 'Both path and application_owner are required'}), 400
-        result = search_voiceprint(data.get('path'), data.get('application_owner'))
+        result = find_voiceprint_matches(data.get('path'), data.get('application_owner'), **_search_voiceprint_options(data))
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f"Search error: {str(e)}"}), 500
+
+async def async_search_voiceprint_api():
+    try:
+        data = request.json
+        if not data or 'path' not in data or 'application_owner' not in data:
+            return jsonify({'error': 'Both path and application_owner are required'}), 400
+        result = await async_search_voiceprint(data.get('path'), data.get('application_owner'), **_search_voiceprint_options(data))
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f"Search error: {str(e)}"}), 500
+
+# The async path only pays off when one event loop serves every request (an ASGI server with ASYNC_DB_POOL_SIZE set).
+# Under WSGI Flask runs each async view in a new loop on a worker thread, where it would open a connection per request
+if ASYNC_DB_POOL_SIZE > 0:
+    app.add_url_rule('/search_voiceprint', view_func=async_search_voiceprint_api, methods=['POST'])
+else:
+    app.add_url_rule('/search_voiceprint', view_func=search_voiceprint_api, methods=['POST'])
+
+@app.route('/voiceprint/reembed', methods=['POST'])
+def voiceprint_reembed_api():
+    try:
+        result = reembed_voiceprint_library(request)
+        return result
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/voiceprint/reembed/<int:job_id>', methods=['GET'])
+def voiceprint_reembed_status_api(job_id):
+    try:
+        result = get_reembed_job(job_id)
+        if result is None:
+            return jsonify({'error': 'Re-embedding job not found'}), 404
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/voiceprint/export', methods=['POST'])
+def voiceprint_export_api():
+    try:
+        result = export_voiceprint_library(request)
+        return result
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/voiceprint/import', methods=['POST'])
+def voiceprint_import_api():
+    try:
+        result = import_voiceprint_library(request)
         return result
     except Exception as e:
         return jsonify({'error': str(e)})
@@ -614,6 +881,13 @@ def upload_fano_extract_speaker_clip():
     except Exception as e:
         return jsonify({'error': str(e)})
 
+@app.route('/metrics/http', methods=['GET'])
+def http_metrics_api():
+    try:
+        return jsonify(get_http_stats())
+    except Exception as e:
+        return jsonify({"error": str(e)})
+
 # @app.route('/minio_upload_blob', methods=['POST'])
 # def minio_upload_blob_api():
 #     try:
@@ -629,4 +903,5 @@ def upload_fano_extract_speaker_clip():
 
 if __name__ == '__main__':
     # app.run(debug=True)
+    start_background_jobs()
     app.run(debug=True, use_debugger=False, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,8 @@
+# Read by gunicorn from the working directory, see GUNICORN_CMD_ARGS in the Dockerfile for the worker settings
+
+
+def post_worker_init(worker):
+    """Start the background schedulers once the worker loaded the app, they are not started on import."""
+    from app import start_background_jobs
+
+    start_background_jobs()
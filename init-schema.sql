@@ -26,6 +26,158 @@ create table public.voiceprint_library
     department    varchar(255),
     position      varchar(255),
     embedding     vector(256),
+    model_version varchar(64)                   not null,
     metadata_json jsonb     default '{}'::jsonb not null,
     created_dt    timestamp default CURRENT_TIMESTAMP
-); 
\ No newline at end of file
+);
+
+create index voiceprint_library_owner_version_idx
+    on public.voiceprint_library ((metadata_json ->> 'application_owner'), model_version);
+
+-- Re-embedded copies, by the voiceprint they were made from
+create index voiceprint_library_source_version_idx
+    on public.voiceprint_library ((metadata_json ->> 'source_sys_id'), model_version)
+    where metadata_json ? 'source_sys_id';
+
+-- For half precision storage, see migrations/003_voiceprint_halfvec.sql
+create index voiceprint_library_embedding_hnsw_idx
+    on public.voiceprint_library using hnsw (embedding vector_cosine_ops);
+
+create table public.voiceprint_reembed_job
+(
+    sys_id               serial
+        primary key,
+    source_model_version varchar(64)                  not null,
+    target_model_version varchar(64)                  not null,
+    status               varchar(32) default 'pending' not null,
+    batch_size           integer     default 50        not null,
+    last_sys_id          integer     default 0         not null,
+    total_count          integer     default 0         not null,
+    processed_count      integer     default 0         not null,
+    skipped_count        integer     default 0         not null,
+    failed_count         integer     default 0         not null,
+    failed_sys_ids       jsonb       default '[]'::jsonb not null,
+    elapsed_seconds      double precision default 0    not null,
+    error_message        text,
+    heartbeat_dt         timestamp,
+    created_dt           timestamp   default CURRENT_TIMESTAMP,
+    completed_dt         timestamp
+);
+
+create table public.transcription_result
+(
+    sys_id               serial
+        primary key,
+    provider             varchar(32)                      not null,
+    job_id               varchar(255)                     not null,
+    source_key           text                             not null,
+    application_owner    varchar(255)                     not null,
+    status               varchar(32) default 'processing' not null,
+    confidence_threshold double precision,
+    total_duration       double precision,
+    charged_hours        double precision default 0       not null,
+    result_json          jsonb,
+    heartbeat_dt         timestamp,
+    created_dt           timestamp   default CURRENT_TIMESTAMP,
+    completed_dt         timestamp,
+    unique (provider, job_id, source_key, application_owner)
+);
+
+create table public.azure_transcription_job
+(
+    sys_id               serial
+        primary key,
+    transcription_id     varchar(255)                     not null
+        unique,
+    transcription_url    text                             not null,
+    application_owner    varchar(255),
+    confidence_threshold double precision,
+    status               varchar(32) default 'NotStarted' not null,
+    processing_status    varchar(32) default 'pending'    not null,
+    content_url_list     jsonb,
+    sys_ids              jsonb,
+    error_message        text,
+    status_dt            timestamp,
+    created_dt           timestamp   default CURRENT_TIMESTAMP,
+    updated_dt           timestamp,
+    completed_dt         timestamp
+);
+
+create table public.deferred_blob_deletion
+(
+    sys_id        serial
+        primary key,
+    storage       varchar(16)                   not null,
+    bucket        varchar(255),
+    blob_name     text                          not null,
+    operation_id  varchar(255),
+    status        varchar(16) default 'pending' not null,
+    attempts      integer     default 0         not null,
+    error_message text,
+    delete_after  timestamp                     not null,
+    next_check_dt timestamp,
+    created_dt    timestamp   default CURRENT_TIMESTAMP,
+    deleted_dt    timestamp
+);
+
+create index deferred_blob_deletion_pending_idx
+    on public.deferred_blob_deletion (next_check_dt)
+    where status = 'pending';
+
+create table public.fanolab_operation_cache
+(
+    sys_id       serial
+        primary key,
+    fanolab_id   varchar(255) not null
+        unique,
+    payload      bytea        not null,
+    payload_size integer      not null,
+    created_dt   timestamp default CURRENT_TIMESTAMP
+);
+
+create table public.fanolab_chunked_job
+(
+    sys_id           serial
+        primary key,
+    job_id           varchar(255)     not null
+        unique,
+    source_url       text             not null,
+    sample_rate      integer          not null,
+    duration_seconds double precision not null,
+    chunks           jsonb            not null,
+    audio_store      varchar(16),
+    audio_blob       text,
+    created_dt       timestamp default CURRENT_TIMESTAMP
+);
+
+create table public.fanolab_offset_map
+(
+    sys_id             serial
+        primary key,
+    fanolab_id         varchar(255)     not null
+        unique,
+    offset_map         jsonb            not null,
+    original_duration  double precision not null,
+    submitted_duration double precision not null,
+    created_dt         timestamp default CURRENT_TIMESTAMP
+);
+
+create table public.upload_session
+(
+    sys_id       serial
+        primary key,
+    session_id   varchar(64)  not null
+        unique,
+    store        varchar(16)  not null,
+    container    varchar(255) not null,
+    blob_name    text         not null,
+    upload_id    text         not null,
+    filename     text,
+    size         bigint       not null,
+    chunk_size   bigint       not null,
+    status       varchar(16)  not null default 'uploading',
+    created_dt   timestamp default CURRENT_TIMESTAMP,
+    updated_dt   timestamp,
+    expires_dt   timestamp    not null,
+    completed_dt timestamp
+);
@@ -0,0 +1,35 @@
+-- Record which encoder produced each voiceprint embedding, and track re-embedding jobs.
+-- Existing embeddings were all produced by resemblyzer 0.1.4.
+
+ALTER TABLE public.voiceprint_library
+    ADD COLUMN IF NOT EXISTS model_version varchar(64);
+
+UPDATE public.voiceprint_library
+SET model_version = 'resemblyzer-0.1.4'
+WHERE model_version IS NULL;
+
+ALTER TABLE public.voiceprint_library
+    ALTER COLUMN model_version SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS voiceprint_library_owner_version_idx
+    ON public.voiceprint_library ((metadata_json ->> 'application_owner'), model_version);
+
+create table if not exists public.voiceprint_reembed_job
+(
+    sys_id               serial
+        primary key,
+    source_model_version varchar(64)                  not null,
+    target_model_version varchar(64)                  not null,
+    status               varchar(32) default 'pending' not null,
+    batch_size           integer     default 50        not null,
+    last_sys_id          integer     default 0         not null,
+    total_count          integer     default 0         not null,
+    processed_count      integer     default 0         not null,
+    skipped_count        integer     default 0         not null,
+    failed_count         integer     default 0         not null,
+    elapsed_seconds      double precision default 0    not null,
+    error_message        text,
+    heartbeat_dt         timestamp,
+    created_dt           timestamp   default CURRENT_TIMESTAMP,
+    completed_dt         timestamp
+);
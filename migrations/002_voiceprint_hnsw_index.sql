@@ -0,0 +1,4 @@
+-- Approximate nearest neighbour index for voiceprint search (cosine distance, float32 storage).
+
+CREATE INDEX IF NOT EXISTS voiceprint_library_embedding_hnsw_idx
+    ON public.voiceprint_library USING hnsw (embedding vector_cosine_ops);
@@ -0,0 +1,16 @@
+-- Optional: store voiceprint embeddings in half precision (pgvector >= 0.7).
+-- Halves the table and HNSW index footprint. Run tools/voiceprint_precision_benchmark.py first to check
+-- ranking agreement on your data, then set VOICEPRINT_EMBEDDING_PRECISION=float16 and restart the backend.
+-- Revert with 003_voiceprint_halfvec_revert.sql.
+
+BEGIN;
+
+DROP INDEX IF EXISTS public.voiceprint_library_embedding_hnsw_idx;
+
+ALTER TABLE public.voiceprint_library
+    ALTER COLUMN embedding TYPE halfvec(256) USING embedding::halfvec(256);
+
+CREATE INDEX voiceprint_library_embedding_hnsw_idx
+    ON public.voiceprint_library USING hnsw (embedding halfvec_cosine_ops);
+
+COMMIT;
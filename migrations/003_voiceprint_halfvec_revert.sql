@@ -0,0 +1,14 @@
+-- Back to float32 voiceprint embeddings, set VOICEPRINT_EMBEDDING_PRECISION=float32 afterwards.
+-- Values keep the precision they were rounded to while stored as halfvec.
+
+BEGIN;
+
+DROP INDEX IF EXISTS public.voiceprint_library_embedding_hnsw_idx;
+
+ALTER TABLE public.voiceprint_library
+    ALTER COLUMN embedding TYPE vector(256) USING embedding::vector(256);
+
+CREATE INDEX voiceprint_library_embedding_hnsw_idx
+    ON public.voiceprint_library USING hnsw (embedding vector_cosine_ops);
+
+COMMIT;
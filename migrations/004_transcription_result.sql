@@ -0,0 +1,21 @@
+-- Persist completed Azure / Fanolab transcription results, so polls of a finished job are served from
+-- Postgres and quota is charged once per transcribed file.
+
+create table if not exists public.transcription_result
+(
+    sys_id               serial
+        primary key,
+    provider             varchar(32)                      not null,
+    job_id               varchar(255)                     not null,
+    source_key           text                             not null,
+    application_owner    varchar(255)                     not null,
+    status               varchar(32) default 'processing' not null,
+    confidence_threshold double precision,
+    total_duration       double precision,
+    charged_hours        double precision default 0       not null,
+    result_json          jsonb,
+    heartbeat_dt         timestamp,
+    created_dt           timestamp   default CURRENT_TIMESTAMP,
+    completed_dt         timestamp,
+    unique (provider, job_id, source_key, application_owner)
+);
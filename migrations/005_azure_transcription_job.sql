@@ -0,0 +1,21 @@
+-- Local state of Azure batch transcriptions, updated by the Azure Speech webhook (/azure_transcription/webhook).
+
+create table if not exists public.azure_transcription_job
+(
+    sys_id               serial
+        primary key,
+    transcription_id     varchar(255)                     not null
+        unique,
+    transcription_url    text                             not null,
+    application_owner    varchar(255),
+    confidence_threshold double precision,
+    status               varchar(32) default 'NotStarted' not null,
+    processing_status    varchar(32) default 'pending'    not null,
+    content_url_list     jsonb,
+    sys_ids              jsonb,
+    error_message        text,
+    status_dt            timestamp,
+    created_dt           timestamp   default CURRENT_TIMESTAMP,
+    updated_dt           timestamp,
+    completed_dt         timestamp
+);
@@ -0,0 +1,7 @@
+-- content_url_list now holds the transcription files only, classified by kind across every page of the files listing.
+-- Lists stored before also hold the transcription report and may be truncated to the first page; clear them so the
+-- next poll or webhook lists the files again.
+
+update public.azure_transcription_job
+set content_url_list = null
+where content_url_list is not null;
@@ -0,0 +1,23 @@
+-- Temporary blobs (e.g. the audio uploaded for a Fanolab submission) are deleted in the background once their
+-- consumer is done with them or their TTL passes, instead of after a sleep in the request thread.
+
+create table if not exists public.deferred_blob_deletion
+(
+    sys_id        serial
+        primary key,
+    storage       varchar(16)                   not null,
+    bucket        varchar(255),
+    blob_name     text                          not null,
+    operation_id  varchar(255),
+    status        varchar(16) default 'pending' not null,
+    attempts      integer     default 0         not null,
+    error_message text,
+    delete_after  timestamp                     not null,
+    next_check_dt timestamp,
+    created_dt    timestamp   default CURRENT_TIMESTAMP,
+    deleted_dt    timestamp
+);
+
+create index if not exists deferred_blob_deletion_pending_idx
+    on public.deferred_blob_deletion (next_check_dt)
+    where status = 'pending';
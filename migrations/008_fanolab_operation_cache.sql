@@ -0,0 +1,13 @@
+-- Payloads of done Fanolab operations, zlib compressed. Done operations never change, so polls, speaker clip
+-- extraction and voiceprint matching read them from here instead of asking Fanolab again.
+
+create table if not exists public.fanolab_operation_cache
+(
+    sys_id       serial
+        primary key,
+    fanolab_id   varchar(255) not null
+        unique,
+    payload      bytea        not null,
+    payload_size integer      not null,
+    created_dt   timestamp default CURRENT_TIMESTAMP
+);
@@ -0,0 +1,15 @@
+-- Long recordings submitted to Fanolab in chunked mode: one Fanolab operation per overlapping chunk, stitched
+-- back onto one timeline with global speakers once every chunk is done.
+
+create table if not exists public.fanolab_chunked_job
+(
+    sys_id           serial
+        primary key,
+    job_id           varchar(255)     not null
+        unique,
+    source_url       text             not null,
+    sample_rate      integer          not null,
+    duration_seconds double precision not null,
+    chunks           jsonb            not null,
+    created_dt       timestamp default CURRENT_TIMESTAMP
+);
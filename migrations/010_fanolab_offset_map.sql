@@ -0,0 +1,14 @@
+-- Fanolab submissions with their long silences removed: the spans of the original recording that were kept,
+-- so results are mapped back onto the original timeline.
+
+create table if not exists public.fanolab_offset_map
+(
+    sys_id             serial
+        primary key,
+    fanolab_id         varchar(255)     not null
+        unique,
+    offset_map         jsonb            not null,
+    original_duration  double precision not null,
+    submitted_duration double precision not null,
+    created_dt         timestamp default CURRENT_TIMESTAMP
+);
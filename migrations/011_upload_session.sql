@@ -0,0 +1,22 @@
+-- Resumable uploads of large recordings: chunks of a session are streamed into one multipart upload of the blob
+-- store, so a dropped connection only resends the chunks that did not arrive.
+
+create table if not exists public.upload_session
+(
+    sys_id       serial
+        primary key,
+    session_id   varchar(64)  not null
+        unique,
+    store        varchar(16)  not null,
+    container    varchar(255) not null,
+    blob_name    text         not null,
+    upload_id    text         not null,
+    filename     text,
+    size         bigint       not null,
+    chunk_size   bigint       not null,
+    status       varchar(16)  not null default 'uploading',
+    created_dt   timestamp default CURRENT_TIMESTAMP,
+    updated_dt   timestamp,
+    expires_dt   timestamp    not null,
+    completed_dt timestamp
+);
@@ -0,0 +1,8 @@
+-- Chunked Fanolab jobs keep the converted recording in blob storage from submission until they are stitched,
+-- so speakers are reconciled without downloading the source again through a URL that may have expired.
+
+alter table public.fanolab_chunked_job
+    add column if not exists audio_store varchar(16);
+
+alter table public.fanolab_chunked_job
+    add column if not exists audio_blob text;
@@ -0,0 +1,9 @@
+-- Re-embedding jobs skip voiceprints that already have a copy in the target model version, found by the
+-- source_sys_id of the copy, and keep the voiceprints that failed so the next run of the job retries them.
+
+CREATE INDEX IF NOT EXISTS voiceprint_library_source_version_idx
+    ON public.voiceprint_library ((metadata_json ->> 'source_sys_id'), model_version)
+    WHERE metadata_json ? 'source_sys_id';
+
+ALTER TABLE public.voiceprint_reembed_job
+    ADD COLUMN IF NOT EXISTS failed_sys_ids jsonb DEFAULT '[]'::jsonb NOT NULL;
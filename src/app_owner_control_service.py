@@ -1,13 +1,14 @@
 import os
 from dotenv import load_dotenv
 from typing import Optional
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+import time
 
 from src.enums import OnPremiseMode
 from src.models import AppOwnerControl
-from src.db_config import get_database_url
+from src.db_config import get_database_url, get_async_session
 
 
 # Load environment variables
@@ -59,6 +60,131 @@ def check_quota(application_owner: str, duration_hours: float, is_update_hours:
     finally:
         session.close()
 
+async def async_check_quota(application_owner: str, duration_hours: float, is_update_hours: bool = True) -> tuple[bool, str]:
+    """
+    Async version of check_quota for `async def` handlers, the thread is released while waiting on Postgres.
+    The application owner row is locked until the usage hours are committed, so concurrent charges add up.
+
+    Args:
+        application_owner: The name of the application owner
+        duration_hours: The duration of the transcription in hours
+        is_update_hours: Whether the durations hours should be added to the existing usage hours
+
+    Returns:
+        tuple: (is_allowed: bool, message: str)
+    """
+    async with get_async_session() as async_session:
+        try:
+            result = await async_session.execute(
+                select(AppOwnerControl).where(
+                    AppOwnerControl.name == application_owner,
+                    AppOwnerControl.valid_to >= datetime.now().date()
+                ).with_for_update()
+            )
+            app_owner = result.scalars().first()
+
+            if not app_owner:
+                return False, "Application owner not found or subscription expired"
+
+            # Check if there's enough quota
+            if app_owner.usage_hours + duration_hours > app_owner.quota_hours:
+                return False, "Insufficient quota hours"
+
+            # Update usage hours with 2 decimal places
+            if is_update_hours:
+                app_owner.usage_hours = round(app_owner.usage_hours + duration_hours, 2)
+                await async_session.commit()
+
+            return True, "Quota check passed"
+
+        except Exception as e:
+            await async_session.rollback()
+            return False, f"Error checking quota: {str(e)}"
+
+
+def refund_quota(application_owner: str, duration_hours: float) -> None:
+    """Give back hours check_quota charged for work that was not done, e.g. a submission that failed."""
+    with Session() as db_session:
+        app_owner = db_session.execute(
+            select(AppOwnerControl).where(AppOwnerControl.name == application_owner).with_for_update()
+        ).scalars().first()
+        if app_owner:
+            app_owner.usage_hours = round(max(0, app_owner.usage_hours - duration_hours), 2)
+            db_session.commit()
+
+
+def charge_quota(db_session, application_owner: str, duration_hours: float) -> tuple[bool, str]:
+    """
+    check_quota inside the caller's transaction: the application owner row is locked, and the usage hours are
+    only committed together with the caller's other changes.
+
+    Returns:
+        tuple: (is_allowed: bool, message: str)
+    """
+    app_owner = db_session.execute(
+        select(AppOwnerControl).where(
+            AppOwnerControl.name == application_owner,
+            AppOwnerControl.valid_to >= datetime.now().date()
+        ).with_for_update()
+    ).scalars().first()
+
+    if not app_owner:
+        return False, "Application owner not found or subscription expired"
+    if app_owner.usage_hours + duration_hours > app_owner.quota_hours:
+        return False, "Insufficient quota hours"
+
+    app_owner.usage_hours = round(app_owner.usage_hours + duration_hours, 2)
+    return True, "Quota check passed"
+
+# Per tenant voiceprint search settings rarely change, keep them for a minute instead of querying on every search
+SEARCH_SETTINGS_TTL_SECONDS = 60
+_search_settings_cache: dict[str, tuple[float, dict]] = {}
+
+def _cached_search_settings(application_owner: str) -> Optional[dict]:
+    cached = _search_settings_cache.get(application_owner)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+def _cache_search_settings(application_owner: str, metadata_json: Optional[dict]) -> dict:
+    settings = dict((metadata_json or {}).get("voiceprint_search") or {})
+    _search_settings_cache[application_owner] = (time.monotonic() + SEARCH_SETTINGS_TTL_SECONDS, settings)
+    return settings
+
+def get_voiceprint_search_settings(application_owner: str) -> dict:
+    """
+    Tenant defaults for voiceprint search, stored in the app owner's metadata_json, e.g.
+    {"voiceprint_search": {"limit": 3, "confidence_threshold": 0.8, "ef_search": 100, "exact_rerank": true}}
+
+    Args:
+        application_owner: The name of the application owner
+
+    Returns:
+        dict: The tenant's search settings, empty when none are configured
+    """
+    settings = _cached_search_settings(application_owner)
+    if settings is not None:
+        return settings
+
+    with Session() as settings_session:
+        metadata_json = settings_session.execute(
+            select(AppOwnerControl.metadata_json).where(AppOwnerControl.name == application_owner)
+        ).scalar()
+    return _cache_search_settings(application_owner, metadata_json)
+
+async def async_get_voiceprint_search_settings(application_owner: str) -> dict:
+    """Async version of get_voiceprint_search_settings."""
+    settings = _cached_search_settings(application_owner)
+    if settings is not None:
+        return settings
+
+    async with get_async_session() as async_session:
+        result = await async_session.execute(
+            select(AppOwnerControl.metadata_json).where(AppOwnerControl.name == application_owner)
+        )
+        metadata_json = result.scalar()
+    return _cache_search_settings(application_owner, metadata_json)
+
 if __name__ == '__main__':
     is_allowed, message = check_quota(application_owner="catomind", duration_hours=1, is_update_hours=True)
     print(is_allowed)
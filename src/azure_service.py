@@ -1,15 +1,25 @@
 ﻿from dotenv import load_dotenv
-import requests
 import os
-import shutil
-import zipfile
-from collections import defaultdict
-from src.utilities import format_time, mp4_to_wav_file, extract_audio_segment
-from src.voiceprint_library_service import search_voiceprint
-from datetime import datetime, timedelta
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
-from src.app_owner_control_service import check_quota
+from typing import Optional
+from src.utilities import mp4_to_wav_file
+from src import http_client
+from src.transcript_stream_parser import parse_transcription_stream
+from src.segment_table import OUTPUT_FORMATS, render_transcript
+from src.speaker_clip_service import CLIP_FORMATS, select_speaker_clips, upload_clip_bundle
+from src.voiceprint_library_service import ACTIVE_MODEL_VERSION, embed_speaker_segments, identify_speakers, rematch_stored_speakers
+from datetime import timedelta
+from src.blob_store import get_blob_store, MEDIA_CONTAINER, SPEAKER_CLIP_CONTAINER
+from src.transcription_result_service import (
+    TranscriptionResultInProgress, source_key, get_transcription_results, claim_transcription_result,
+    charge_transcription_results, update_transcription_matches, release_transcription_result, needs_rematch
+)
+from src.azure_transcription_job_service import transcription_id_from_url, upsert_azure_transcription_job, is_running_locally
 import uuid
+import threading
+import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
 
 # Load environment variables
 load_dotenv()
@@ -22,44 +32,174 @@ headers = {
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Files of one batch transcription processed in parallel
+AZURE_TRANSCRIPTION_MAX_WORKERS = int(os.getenv("AZURE_TRANSCRIPTION_MAX_WORKERS", "3"))
+
+# Completed transcriptions are immutable: cache their file lists, source blob index and content documents
+AZURE_TRANSCRIPT_CACHE_SIZE = int(os.getenv("AZURE_TRANSCRIPT_CACHE_SIZE", "16"))  # Compact content documents
+TRANSCRIPT_STREAM_CHUNK_SIZE = 64 * 1024
+AZURE_FILES_PAGE_SIZE = 100  # Largest page of a transcription's files listing
+TRANSCRIPTION_FILE_KIND = "Transcription"  # Other kinds, e.g. TranscriptionReport, are not per recording results
+AZURE_COMPLETED_TRANSCRIPTION_CACHE_SIZE = 256
+_transcript_cache_lock = threading.Lock()
+_relist_lock = threading.Lock()  # One listing at a time replaces content URLs whose SAS expired
+_completed_transcriptions = OrderedDict()  # transcription url -> content urls, sys_ids and source blob index
+_transcript_documents = OrderedDict()  # content url without SAS -> parsed document, see parse_transcription_stream
+
+
+class AzureTranscriptionFailed(Exception):
+    """Azure reports the transcription as Failed, it will never produce results."""
+
 
 def azure_transcription(request):
     data = request.get_json()
     url = data.get('url')
     application_owner = data.get('application_owner')
-    confidence_threshold = data.get('confidence_threshold')
+    confidence_threshold = float(data['confidence_threshold']) if data.get('confidence_threshold') is not None else None  # None uses the tenant's search settings
+    output_format = data.get('output_format') or "legacy"  # legacy, structured or columnar
+
+    if output_format not in OUTPUT_FORMATS:
+        return {"error": f"output_format must be one of {', '.join(OUTPUT_FORMATS)}"}, 400
 
     try:
-        content_url_list, sys_ids = azure_check_status(url)
-        if content_url_list == "In Progress":
+        # Record who polls the job, so the webhook can process its results as soon as Azure completes it
+        job = upsert_azure_transcription_job(url, application_owner=application_owner, confidence_threshold=confidence_threshold)
+        if is_running_locally(job):
             return {"transcriptions": "Transcription in progress"}, 200
-            
-        output_list = []
-        total_duration_hours = 0
-        for i, content_url in enumerate(content_url_list[:-1]):
-            speaker_text_pairs, speaker_stats, total_duration, source_url = azure_fetch_completed_transcription(url=content_url, match_voiceprint=True, application_owner=application_owner, confidence_threshold=confidence_threshold)
-            result_dict = {
-                "sys_id": sys_ids[i] if i < len(sys_ids) else None,
+
+        if job["status"] == "Succeeded" and job["content_url_list"]:
+            content_url_list, sys_ids = job["content_url_list"], job["sys_ids"] or []
+        else:
+            # The file list is enough to serve stored results, the source index is only built if a file must be processed
+            content_url_list, sys_ids = azure_check_status(url, build_index=False)
+            if content_url_list == "In Progress":
+                upsert_azure_transcription_job(url, status="Running")
+                return {"transcriptions": "Transcription in progress"}, 200
+            upsert_azure_transcription_job(url, status="Succeeded", content_url_list=content_url_list, sys_ids=sys_ids)
+
+        return process_azure_transcription(url, application_owner, confidence_threshold, content_url_list, sys_ids,
+                                           current_app._get_current_object(), output_format)
+    except AzureTranscriptionFailed as e:
+        upsert_azure_transcription_job(url, status="Failed")
+        return {"error": f"Transcription failed: {e}"}, 400
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def process_azure_transcription(url: str, application_owner: str, confidence_threshold: Optional[float],
+                                content_url_list: list, sys_ids: list, app, output_format: str = "legacy"):
+    """
+    Build the results of a completed transcription, one entry per file in submission order.
+
+    :param app: Flask app, pushed as context in the workers
+    :param output_format: legacy, structured or columnar, see render_transcript
+    :return: The result list, or (error, status code)
+    """
+    try:
+        # Completed files are served from Postgres: no download, transcoding, matching or quota charge
+        job_id = transcription_id_from_url(url)
+        stored_results = get_transcription_results("azure", job_id, application_owner)
+
+        # Each file downloads, transcodes and matches voiceprints independently, so process them concurrently
+        def process_file(content_url):
+            """Returns (result, is_new), is_new results are claimed and still need to be charged and completed."""
+            key = source_key(content_url)
+            stored = stored_results.get(key)
+            if stored and not needs_rematch(stored, confidence_threshold):
+                return stored["result"], False
+            speaker_stats = rematch_stored_speakers(stored["result"], application_owner, confidence_threshold) if stored else None
+            if speaker_stats is not None:
+                # Re-matched from the speaker embeddings kept with the result, the media is not downloaded again
+                result = {**stored["result"], "speaker_stats": speaker_stats}
+                update_transcription_matches("azure", job_id, key, application_owner, result, confidence_threshold)
+                return result, False
+            if not stored and not claim_transcription_result("azure", job_id, key, application_owner):
+                raise TranscriptionResultInProgress("File is being processed by another request")
+
+            try:
+                with app.app_context():
+                    segments, speaker_stats, total_duration, source_url, speaker_embeddings = azure_fetch_completed_transcription(url=content_url, match_voiceprint=True, application_owner=application_owner, confidence_threshold=confidence_threshold, transcription_url=url)
+            except Exception:
+                if not stored:
+                    release_transcription_result("azure", job_id, key, application_owner)
+                raise
+            result = {
                 "source_url": source_url,
                 "speaker_stats": speaker_stats,
                 "total_duration": total_duration,
-                "transcriptions": speaker_text_pairs}
-            output_list.append(result_dict)
-            total_duration_hours += total_duration / 3600  # Convert seconds to hours
-
-        # Check quota after getting total duration
-        is_allowed, message = check_quota(application_owner, total_duration_hours)
-        if not is_allowed:
-            return {"error": message}, 403
-            
+                "segments": segments.to_columnar(precision=7),  # Ticks are 100ns, the legacy strings are rendered from these
+                "speaker_embeddings": speaker_embeddings,
+                "embedding_model_version": ACTIVE_MODEL_VERSION}
+
+            if stored:
+                # Re-matched with another confidence threshold, the file was already charged
+                update_transcription_matches("azure", job_id, key, application_owner, result, confidence_threshold)
+                return result, False
+            return result, True
+
+        with ThreadPoolExecutor(max_workers=max(1, min(AZURE_TRANSCRIPTION_MAX_WORKERS, len(content_url_list)))) as executor:
+            futures = [executor.submit(process_file, content_url) for content_url in content_url_list]
+
+        output_list = []
+        new_results = []
+        for i, future in enumerate(futures):
+            sys_id = sys_ids[i] if i < len(sys_ids) else None
+            try:
+                result, is_new = future.result()
+            except TranscriptionResultInProgress as e:
+                output_list.append({"sys_id": sys_id, "status": "in_progress", "message": str(e)})
+                continue
+            except Exception as e:
+                # One failed file should not discard the others, return it as a failed entry instead
+                print(f"Failed to process transcription file {i} (sys_id {sys_id}): {e}")
+                output_list.append({"sys_id": sys_id, "status": "failed", "error": str(e)})
+                continue
+            output_list.append({"sys_id": sys_id, **render_transcript(result, output_format)})
+            if is_new:
+                new_results.append((source_key(content_url_list[i]), result))
+
+        if new_results:
+            # Check quota after getting total duration, only newly processed files are charged;
+            # the charge and the completed results are committed together, once per file
+            is_allowed, message = charge_transcription_results("azure", job_id, application_owner, new_results, confidence_threshold)
+            if not is_allowed:
+                for key, _ in new_results:
+                    release_transcription_result("azure", job_id, key, application_owner)
+                return {"error": message}, 403
+
         return output_list
     except Exception as e:
         return {"error": str(e)}
 
 
+def azure_check_status(url: str, build_index: bool = True):
+    """
+    Get the content URLs and sys_ids of a transcription, or "In Progress" while Azure is still transcribing.
+    A completed transcription never changes, so its file list and source blob index are built once and cached;
+    later calls for the same transcription do not touch the network, until the SAS of the listed URLs expires.
 
-def azure_check_status(url: str):
-    response = requests.get(url, headers=headers)
+    :param build_index: Also download the content documents to index them by source blob, when not done yet
+    :raises AzureTranscriptionFailed: Azure reports the transcription as Failed
+    """
+    with _transcript_cache_lock:
+        completed = _completed_transcriptions.get(url)
+        if completed is not None:
+            _completed_transcriptions.move_to_end(url)
+    if completed is not None:
+        if build_index and completed["source_index"] is None:
+            try:
+                completed["source_index"] = build_transcript_source_index(completed["content_url_list"])
+            except requests.HTTPError as e:
+                if not is_expired_url_error(e):
+                    raise
+                # Listed too long ago, list the files again below
+                with _transcript_cache_lock:
+                    _completed_transcriptions.pop(url, None)
+                completed = None
+    if completed is not None:
+        return completed["content_url_list"], completed["sys_ids"]
+
+    response = http_client.get(http_client.AZURE_STT, url, headers=headers)
     response.raise_for_status()  # Raises an error for bad responses
     json_data = response.json()
 
@@ -82,183 +222,198 @@ def azure_check_status(url: str):
         file_url = json_data.get("links", {}).get("files")  # Avoids unnecessary empty string
 
         if file_url:
-            content_response = requests.get(file_url, headers=headers)
-            content_json = content_response.json()
-
-            values = content_json.get("values", [])
-            if values:
-                response_url_list = []
-                for item in values:
-                    content_url = item.get("links", {}).get("contentUrl")
-                    response_url_list.append(content_url)
+            values = list_transcription_files(file_url, expected_files=len(sys_ids) + 1)  # One report besides the transcriptions
+
+            # Only transcription files are results, the report and any other kinds are skipped wherever Azure lists them
+            response_url_list = [
+                item.get("links", {}).get("contentUrl") for item in values if item.get("kind") == TRANSCRIPTION_FILE_KIND
+            ]
+            if response_url_list:
+                source_index = build_transcript_source_index(response_url_list) if build_index else None
+                with _transcript_cache_lock:
+                    _completed_transcriptions[url] = {
+                        "content_url_list": response_url_list,
+                        "sys_ids": sys_ids,
+                        "source_index": source_index
+                    }
+                    while len(_completed_transcriptions) > AZURE_COMPLETED_TRANSCRIPTION_CACHE_SIZE:
+                        _completed_transcriptions.popitem(last=False)
                 return response_url_list, sys_ids
-    else:
-        return "In Progress"
+    elif transcribing_status == "Failed":
+        error = json_data.get("properties", {}).get("error", {})
+        raise AzureTranscriptionFailed(error.get("message") or error.get("code") or "Azure reported the transcription as Failed")
+    return "In Progress", sys_ids
 
 
+def is_expired_url_error(error: requests.HTTPError) -> bool:
+    """A listed content URL answers 403 once its SAS expired, and 404 if Azure moved the file."""
+    return error.response is not None and error.response.status_code in (403, 404)
 
-def azure_fetch_completed_transcription(url: str, match_voiceprint: bool = True, application_owner: str = None, confidence_threshold: float = 0.8):
-    response = requests.get(url)
-    response.raise_for_status()  # Raises an error for bad responses
-    json_data = response.json()
 
-    speaker_text_pairs = []
-    source_url = json_data.get("source")
-    speaker_stats = defaultdict(lambda: {"total_duration": 0, "total_words": 0, "segments": []})
-    
-    # Get total duration from JSON data (convert milliseconds to seconds)
-    total_duration = json_data.get("durationMilliseconds", 0) / 1000
+def relist_content_url(transcription_url: str, content_url: str) -> Optional[str]:
+    """
+    A fresh content URL for the file of content_url, listed again because its SAS expired.
+    Concurrent callers holding URLs of the same stale listing share a single new listing, which is also
+    stored on the job so later polls do not start from the expired URLs.
 
-    # Get the mp4 source and save the wav as src/uploads/temp_audio.wav
-    meeting_wav_path = mp4_to_wav_file(mp4_url=json_data.get("source"))
+    :return: The new content URL, None if the transcription no longer lists the file
+    """
+    key = source_key(content_url)
+    with _relist_lock:
+        with _transcript_cache_lock:
+            completed = _completed_transcriptions.get(transcription_url)
+        if completed is None or content_url in completed["content_url_list"]:
+            with _transcript_cache_lock:
+                _completed_transcriptions.pop(transcription_url, None)
+            content_url_list, sys_ids = azure_check_status(transcription_url, build_index=False)
+            if content_url_list == "In Progress":
+                return None
+            upsert_azure_transcription_job(transcription_url, content_url_list=content_url_list, sys_ids=sys_ids)
+        else:
+            content_url_list = completed["content_url_list"]
+    return next((url for url in content_url_list if source_key(url) == key), None)
 
-    for phrase in json_data.get("recognizedPhrases", []):
-        speaker = phrase.get("speaker")
-        display_text = phrase.get("nBest", [{}])[0].get("display", "")
-        offset = phrase.get("offsetInTicks", 0) / 10000000  # Convert ticks to seconds
-        duration = phrase.get("durationInTicks", 0) / 10000000  # Convert ticks to seconds
 
-        start_time = format_time(offset)
-        end_time = format_time(offset + duration)
+def list_transcription_files(file_url: str, expected_files: int = 0) -> list:
+    """
+    All entries of a transcription's files listing, in Azure's order, across every page.
 
-        if speaker is not None and display_text:
-            speaker_text_pairs.append(f"Speaker-{speaker} ({start_time} - {end_time}): {display_text}")
+    Azure pages the listing with skip / top and links the next page in "@nextLink". The pages the expected
+    file count needs are requested together after the first one; "@nextLink" is still followed from the last
+    page, so a batch larger than expected is listed completely.
 
-            # Update speaker statistics
-            speaker_stats[speaker]["total_duration"] += duration
-            speaker_stats[speaker]["total_words"] += len(display_text.split())
-            speaker_stats[speaker]["segments"].append({
-                "start": offset,
-                "end": offset + duration,
-                "duration": duration
-            })
+    :param file_url: The transcription's links.files URL
+    :param expected_files: Entries the listing is expected to hold, e.g. the recordings submitted plus the report
+    """
+    def fetch_page(page_url, params=None):
+        response = http_client.get(http_client.AZURE_STT, page_url, headers=headers, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    page = fetch_page(file_url, {"skip": 0, "top": AZURE_FILES_PAGE_SIZE})
+    values = page.get("values", [])
+    next_link = page.get("@nextLink")
+
+    remaining_pages = -(-expected_files // AZURE_FILES_PAGE_SIZE) - 1
+    if next_link and remaining_pages > 0:
+        skips = [AZURE_FILES_PAGE_SIZE * (i + 1) for i in range(remaining_pages)]
+        with ThreadPoolExecutor(max_workers=min(AZURE_TRANSCRIPTION_MAX_WORKERS, len(skips))) as executor:
+            pages = list(executor.map(lambda skip: fetch_page(file_url, {"skip": skip, "top": AZURE_FILES_PAGE_SIZE}), skips))
+        for page in pages:
+            values.extend(page.get("values", []))
+        next_link = pages[-1].get("@nextLink")
+
+    while next_link:
+        page = fetch_page(next_link)
+        values.extend(page.get("values", []))
+        next_link = page.get("@nextLink")
+    return values
+
+
+def download_transcript_document(content_url: str) -> dict:
+    with http_client.get(http_client.MEDIA, content_url, stream=True) as response:
+        response.raise_for_status()  # Raises an error for bad responses
+        return parse_transcription_stream(response.iter_content(chunk_size=TRANSCRIPT_STREAM_CHUNK_SIZE))
+
+
+def fetch_transcript_document(content_url: str, transcription_url: Optional[str] = None) -> dict:
+    """
+    Get a transcription content document in its compact form (see parse_transcription_stream),
+    from the in-memory cache when it was fetched before. The most recently used AZURE_TRANSCRIPT_CACHE_SIZE documents are kept.
+    The JSON is parsed while it streams in, so nBest alternatives and word timings are never held in memory.
 
-    # Match voiceprint, Calculate percentages and words per minute
-    if match_voiceprint and application_owner:
-        for speaker, stats in speaker_stats.items():
-            stats["percentage"] = (stats["total_duration"] / total_duration) * 100
-            stats["words_per_minute"] = (stats["total_words"] / stats["total_duration"]) * 60
-
-            # Sort segments by duration and get top 3
-            stats["segments"].sort(key=lambda x: x["duration"], reverse=True)
-            top_segments = stats["segments"][:3]
-
-            # Extract audio segments and perform voiceprint matching
-            if len(top_segments) >= 1:
-                # Extract audio segments
-                for i, segment in enumerate(top_segments):
-                    output_name = f"speaker_{speaker}_segment_{i}"
-                    extract_audio_segment(output_name=output_name, start_time=segment["start"], end_time=segment["end"], input_file=meeting_wav_path, clean_up_after=False)
-
-                    # Perform voiceprint matching
-                    wav_path = os.path.join(UPLOAD_FOLDER, f"{output_name}.wav")
-                    matches = search_voiceprint(wav_path, application_owner)
-
-                    # Get the best match
-                    if matches:
-                        # Convert response to JSON data
-                        matches_data = matches.get_json()
-                        if matches_data and len(matches_data) > 0:
-                            best_match = matches_data[0]
-                            if best_match.get("similarity", 0) >= confidence_threshold:  # Confidence threshold
-                                stats["identified_name"] = best_match.get("name", "unknown")
-                                stats["confidence"] = best_match.get("similarity")
-                            else:
-                                stats["identified_name"] = "unknown"
-                        else:
-                            stats["identified_name"] = "unknown"
-                    else:
-                        stats["identified_name"] = "unknown"
-
-                    # Clean up the temporary WAV file
-                    os.remove(wav_path)
-            else:
-                stats["identified_name"] = "unknown"
-
-    # Clean up the temporary WAV file
-    if os.path.exists(meeting_wav_path):
-        os.remove(meeting_wav_path)
-
-    return speaker_text_pairs, speaker_stats, total_duration, source_url
-
-
-
-def azure_upload_file_and_get_sas_url(file_path, blob_name, expiry_date: timedelta = timedelta(hours=1)):
+    :param transcription_url: The transcription listing content_url, to list it again if the URL expired
     """
-    Uploads a file to Azure Blob Storage and generates a temporary SAS URL.
+    key = source_key(content_url)  # Re-signed URLs of the same file share the cached document
+    with _transcript_cache_lock:
+        document = _transcript_documents.get(key)
+        if document is not None:
+            _transcript_documents.move_to_end(key)
+            return document
 
-    :param expiry_date: Expiry date for the SAS url
-    :param file_path: Path to the local file to be uploaded.
-    :param blob_name: Name for the blob in Azure Storage.
+    try:
+        document = download_transcript_document(content_url)
+    except requests.HTTPError as e:
+        if transcription_url is None or not is_expired_url_error(e):
+            raise
+        fresh_url = relist_content_url(transcription_url, content_url)
+        if fresh_url is None:
+            raise
+        document = download_transcript_document(fresh_url)
+
+    with _transcript_cache_lock:
+        _transcript_documents[key] = document
+        while len(_transcript_documents) > AZURE_TRANSCRIPT_CACHE_SIZE:
+            _transcript_documents.popitem(last=False)
+    return document
+
+
+def build_transcript_source_index(content_url_list: list) -> dict:
+    """
+    Map each file's source blob to its content URL, fetching the content documents concurrently.
+    The fetched documents stay in the document cache for the azure_fetch_completed_transcription that follows.
 
-    :return: SAS URL string for the uploaded blob.
+    :param content_url_list: Content URLs of the Transcription kind files only, as azure_check_status lists them;
+        the report and other kinds are not downloaded
     """
-    try:
-        container_name = os.getenv('AZURE_CONTAINER_NAME')
-        account_name = os.getenv('AZURE_ACCOUNT_NAME')
-        account_key = os.getenv('AZURE_ACCOUNT_KEY')
-
-        # Construct the BlobServiceClient using the account URL and account key
-        account_url = f"https://{account_name}.blob.core.windows.net"
-        blob_service_client = BlobServiceClient(account_url=account_url, credential=account_key)
-
-        # Get the container client
-        container_client = blob_service_client.get_container_client(container_name)
-
-        # Upload the file
-        with open(file_path, "rb") as data:
-            blob_client = container_client.upload_blob(name=blob_name, data=data, overwrite=True)
-
-        # Set the SAS token expiration time (e.g., 1 hour from now)
-        sas_expiry = datetime.now() + expiry_date
-
-        # Generate the SAS token with read permissions
-        sas_token = generate_blob_sas(
-            account_name=account_name,
-            container_name=container_name,
-            blob_name=blob_name,
-            account_key=account_key,
-            permission=BlobSasPermissions(read=True),
-            expiry=sas_expiry
-        )
-
-        # Construct the full URL with the SAS token
-        sas_url = f"{account_url}/{container_name}/{blob_name}?{sas_token}"
-        return sas_url
+    def source_of(content_url):
+        return fetch_transcript_document(content_url).get("source")
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
+    with ThreadPoolExecutor(max_workers=max(1, min(AZURE_TRANSCRIPTION_MAX_WORKERS, len(content_url_list)))) as executor:
+        sources = list(executor.map(source_of, content_url_list))
 
+    # A document without a source cannot be looked up by source blob
+    return {source_key(source): content_url for source, content_url in zip(sources, content_url_list) if source}
 
-def azure_delete_blob(blob_name):
+
+def find_transcript_content_url(transcription_url: str, source_url: str) -> Optional[str]:
     """
-    Deletes a blob from Azure Blob Storage.
+    Get the content URL of the file transcribed from source_url.
 
-    :param blob_name: Name of the blob to be deleted.
-    :return: Boolean indicating whether the deletion was successful.
+    :param transcription_url: Azure transcription URL
+    :param source_url: URL of the source media, with or without its SAS token
+    :return: The content URL, None if the transcription has no file for this source
     """
-    try:
-        # Retrieve Azure Storage account details from environment variables
-        container_name = os.getenv('AZURE_CONTAINER_NAME')
-        account_name = os.getenv('AZURE_ACCOUNT_NAME')
-        account_key = os.getenv('AZURE_ACCOUNT_KEY')
+    azure_check_status(transcription_url)  # Builds the index on the first call
+    with _transcript_cache_lock:
+        completed = _completed_transcriptions.get(transcription_url)
+    if completed is None:
+        return None
+    return completed["source_index"].get(source_key(source_url))
 
-        # Construct the BlobServiceClient using the account URL and account key
-        account_url = f"https://{account_name}.blob.core.windows.net"
-        blob_service_client = BlobServiceClient(account_url=account_url, credential=account_key)
 
-        # Get the container client
-        container_client = blob_service_client.get_container_client(container_name)
+def azure_fetch_completed_transcription(url: str, match_voiceprint: bool = True, application_owner: str = None, confidence_threshold: Optional[float] = None,
+                                        transcription_url: Optional[str] = None):
+    """
+    :param transcription_url: The transcription listing url, to list it again if the content URL expired
+    :return: (segments, speaker_stats, total_duration, source_url, speaker_embeddings), segments is the SegmentTable of the
+        recognized phrases and speaker_embeddings the embeddings of each speaker's longest segments when voiceprints were matched
+    """
+    json_data = fetch_transcript_document(url, transcription_url)
 
-        # Delete the blob
-        container_client.delete_blob(blob_name, delete_snapshots='include')
-        print(f"Blob '{blob_name}' deleted successfully.")
-        return True
+    source_url = json_data.get("source")
 
-    except Exception as e:
-        print(f"An error occurred while deleting the blob: {e}")
-        return False
+    # Get total duration from JSON data (convert milliseconds to seconds)
+    total_duration = json_data.get("durationMilliseconds", 0) / 1000
+
+    # Built while the document streamed in; the stats are copied since voiceprint matching adds to them
+    segments = json_data["segments"]
+    speaker_stats = {speaker: dict(stats) for speaker, stats in json_data["speaker_stats"].items()}
+
+    # Embed the top 3 longest segments of each speaker and match them against the voiceprint library;
+    # the embeddings are returned so a stored result can be re-matched without the media
+    speaker_embeddings = {}
+    if match_voiceprint and application_owner:
+        meeting_wav_path = mp4_to_wav_file(mp4_url=json_data.get("source"))
+        try:
+            speaker_embeddings = embed_speaker_segments(segments, speaker_stats, meeting_wav_path)
+        finally:
+            # Clean up the temporary WAV file
+            if meeting_wav_path and os.path.exists(meeting_wav_path):
+                os.remove(meeting_wav_path)
+        identify_speakers(speaker_stats, speaker_embeddings, application_owner, confidence_threshold)
+
+    return segments, speaker_stats, total_duration, source_url, speaker_embeddings
 
 
 def azure_extract_speaker_clip(request):
@@ -269,6 +424,7 @@ def azure_extract_speaker_clip(request):
         request: Flask request object containing:
             - source_url: URL of the meeting recording MP4 file
             - azure_url: URL of the Azure transcription results
+            - format: (optional) Clip format, wav (default), flac or opus
             
     Returns:
         A zip file containing audio segments for each speaker
@@ -276,102 +432,47 @@ def azure_extract_speaker_clip(request):
     data = request.get_json()
     mp4_url = data.get('source_url')
     transcription_url = data.get('azure_url')
+    clip_format = data.get('format') or "wav"
 
     if not mp4_url or not transcription_url:
         return {"error": "Both source_url and azure_url are required"}, 400
+    if clip_format not in CLIP_FORMATS:
+        return {"error": f"format must be one of {', '.join(CLIP_FORMATS)}"}, 400
         
+    meeting_wav_path = None
     try:
-        # Generate unique identifier for this request
-        unique_id = str(uuid.uuid4())
-        
-        # Create unique directory for this request's files
-        request_dir = os.path.join(UPLOAD_FOLDER, f"request_{unique_id}")
-        os.makedirs(request_dir, exist_ok=True)
-        
-        try:
-            # First get the transcription results
-            content_url_list, sys_ids = azure_check_status(transcription_url)
-            if content_url_list == "In Progress":
-                return {"error": "Transcription is still in progress"}, 400
-                
-            # Find the index of the matching sys_id
-            try:
-                target_content_url = ''
-                mp4_sig = mp4_url.split("sig=")[1]
-                for content_url in content_url_list:
-                    response = requests.get(content_url)
-                    response.raise_for_status()  # Raises an error for bad responses
-                    json_data = response.json()
-                    url = json_data.get('source')
-                    content_url_sig = url.split("sig=")[1]
-                    if mp4_sig == content_url_sig:
-                        target_content_url = content_url
-                        break
-
-                if target_content_url == '':
-                    return {"error": "target content url not found"}, 400
-
-                content_url_index = content_url_list.index(target_content_url)
-            except ValueError:
-                return {"error": "target content url not found"}, 400
-                
-            # Get the content URL for the matching sys_id
-            content_url = content_url_list[content_url_index]
-            speaker_text_pairs, speaker_stats, total_duration, source_url = azure_fetch_completed_transcription(url=content_url, match_voiceprint=False)
-            
-            # Download and convert the MP4 to WAV
-            meeting_wav_path = mp4_to_wav_file(mp4_url=mp4_url)
-            
-            # Create a directory to store the speaker clips
-            clips_dir = os.path.join(request_dir, "speaker_clips")
-            os.makedirs(clips_dir, exist_ok=True)
-            
-            # Extract segments for each speaker
-            for speaker, stats in speaker_stats.items():
-                # Sort segments by duration and get top 3
-                stats["segments"].sort(key=lambda x: x["duration"], reverse=True)
-                top_segments = stats["segments"][:3]  # Get up to 3 longest segments
-                
-                # Extract each segment
-                for i, segment in enumerate(top_segments):
-                    output_name = f"speaker_{speaker}_segment_{i}"
-                    extract_audio_segment(output_name=output_name, start_time=segment["start"], end_time=segment["end"], input_file=meeting_wav_path, clean_up_after=False)
-                    
-                    # Move the file to the clips directory
-                    src_path = os.path.join(UPLOAD_FOLDER, f"{output_name}.wav")
-                    dst_path = os.path.join(clips_dir, f"{output_name}.wav")
-                    os.rename(src_path, dst_path)
-            
-            # Create a zip file of all clips with unique name
-            zip_filename = f"speaker_clips_{unique_id}.zip"
-            zip_path = os.path.join(request_dir, zip_filename)
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for root, dirs, files in os.walk(clips_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, clips_dir)
-                        zipf.write(file_path, arcname)
-
-            # Clean up the clips directory
-            shutil.rmtree(clips_dir)
-
-            # Upload the zip file to Azure Blob Storage and get a SAS URL
-            blob_name = f"speaker_clips_{unique_id}.zip"  # Use unique name for blob
-            download_url = azure_upload_file_and_get_sas_url(zip_path, blob_name)
-
-            # Clean up all temporary files and directories
-            if os.path.exists(meeting_wav_path):
-                os.remove(meeting_wav_path)
-            if os.path.exists(request_dir):
-                shutil.rmtree(request_dir)
+        # First get the transcription results
+        content_url_list, sys_ids = azure_check_status(transcription_url)
+        if content_url_list == "In Progress":
+            return {"error": "Transcription is still in progress"}, 400
+
+        # Find the content URL of the source media, from the cached source blob index
+        content_url = find_transcript_content_url(transcription_url, mp4_url)
+        if content_url is None:
+            return {"error": "target content url not found"}, 400
+
+        segments, speaker_stats, total_duration, source_url, _ = azure_fetch_completed_transcription(url=content_url, match_voiceprint=False, transcription_url=transcription_url)
+
+        # Download and convert the MP4 to WAV
+        meeting_wav_path = mp4_to_wav_file(mp4_url=mp4_url)
+        if not meeting_wav_path:
+            return {"error": "Failed to process audio"}, 500
 
-            return {"download_url": download_url}
+        # Cut up to 3 longest segments of each speaker straight into a zip streamed to blob storage
+        blob_name = f"speaker_clips_{uuid.uuid4()}.zip"  # Use unique name for blob
+        clips = select_speaker_clips(segments, speaker_stats)
+        upload = lambda stream: get_blob_store().put_stream_and_presign(SPEAKER_CLIP_CONTAINER, blob_name, stream, content_type="application/zip")
+        discard = lambda: get_blob_store().delete(SPEAKER_CLIP_CONTAINER, blob_name)
+        download_url = upload_clip_bundle(meeting_wav_path, clips, upload, clip_format, discard)
 
-        except Exception as e:
-            return {"error": str(e)}, 500
+        return {"download_url": download_url}
 
     except Exception as e:
         return {"error": str(e)}, 500
+    finally:
+        # Clean up the temporary WAV file
+        if meeting_wav_path and os.path.exists(meeting_wav_path):
+            os.remove(meeting_wav_path)
 
 
 def azure_match_speaker_voiceprint(request):
@@ -391,108 +492,35 @@ def azure_match_speaker_voiceprint(request):
     mp4_url = data.get('source_url')
     transcription_url = data.get('azure_url')
     application_owner = data.get('application_owner')
-    confidence_threshold = data.get('confidence_threshold')
+    confidence_threshold = float(data['confidence_threshold']) if data.get('confidence_threshold') is not None else None  # None uses the tenant's search settings
 
     if not mp4_url or not transcription_url or not application_owner:
         return {"error": "source_url, azure_url, and application_owner are required"}, 400
 
     try:
-        # Clean up upload folder first
-        for filename in os.listdir(UPLOAD_FOLDER):
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-            except Exception as e:
-                print(f'Failed to delete {file_path}. Reason: {e}')
-
         # First get the transcription results
         content_url_list, sys_ids = azure_check_status(transcription_url)
         if content_url_list == "In Progress":
             return {"error": "Transcription is still in progress"}, 400
 
-        # Find the index of the matching sys_id
-        try:
-            target_content_url = ''
-            mp4_sig = mp4_url.split("sig=")[1]
-            for content_url in content_url_list:
-                response = requests.get(content_url)
-                response.raise_for_status()  # Raises an error for bad responses
-                json_data = response.json()
-                url = json_data.get('source')
-                content_url_sig = url.split("sig=")[1]
-                if mp4_sig == content_url_sig:
-                    target_content_url = content_url
-                    break
-
-            if target_content_url == '':
-                return {"error": "target content url not found"}, 400
-
-            content_url_index = content_url_list.index(target_content_url)
-        except ValueError:
+        # Find the content URL of the source media, from the cached source blob index
+        content_url = find_transcript_content_url(transcription_url, mp4_url)
+        if content_url is None:
             return {"error": "target content url not found"}, 400
 
-        # Get the content URL for the matching sys_id
-        content_url = content_url_list[content_url_index]
-        speaker_text_pairs, speaker_stats, total_duration, source_url = azure_fetch_completed_transcription(
-            url=content_url, match_voiceprint=True, application_owner=application_owner, confidence_threshold=confidence_threshold)
-
-        # Download and convert the MP4 to WAV
-        meeting_wav_path = mp4_to_wav_file(mp4_url=mp4_url)
-
-        # Create a directory to store the speaker clips
-        clips_dir = os.path.join(UPLOAD_FOLDER, "speaker_clips")
-        os.makedirs(clips_dir, exist_ok=True)
-
-        # Extract segments for each speaker
-        for speaker, stats in speaker_stats.items():
-            # Sort segments by duration and get top 3
-            stats["segments"].sort(key=lambda x: x["duration"], reverse=True)
-            top_segments = stats["segments"][:3]  # Get up to 3 longest segments
-
-            # Extract audio segments and perform voiceprint matching
-            if len(top_segments) >= 1:
-                # Extract audio segments
-                for i, segment in enumerate(top_segments):
-                    output_name = f"speaker_{speaker}_segment_{i}"
-                    extract_audio_segment(output_name=output_name, start_time=segment["start"], end_time=segment["end"], input_file=meeting_wav_path, clean_up_after=False)
-
-                    # Perform voiceprint matching
-                    wav_path = os.path.join(UPLOAD_FOLDER, f"{output_name}.wav")
-                    matches = search_voiceprint(wav_path, application_owner)
-
-                    # Get the best match
-                    if matches:
-                        # Convert response to JSON data
-                        matches_data = matches.get_json()
-                        if matches_data and len(matches_data) > 0:
-                            best_match = matches_data[0]
-                            if best_match.get("similarity", 0) >= confidence_threshold:  # Confidence threshold
-                                stats["identified_name"] = best_match.get("name", "unknown")
-                                stats["confidence"] = best_match.get("similarity")
-                            else:
-                                stats["identified_name"] = "unknown"
-                        else:
-                            stats["identified_name"] = "unknown"
-                    else:
-                        stats["identified_name"] = "unknown"
-
-                    # Clean up the temporary WAV file
-                    os.remove(wav_path)
-            else:
-                stats["identified_name"] = "unknown"
+        # A stored result is matched from its speaker embeddings, otherwise the fetch embeds and matches the speakers
+        stored = get_transcription_results("azure", transcription_id_from_url(transcription_url), application_owner).get(source_key(content_url))
+        speaker_stats = rematch_stored_speakers(stored["result"], application_owner, confidence_threshold) if stored else None
+        if speaker_stats is None:
+            _, speaker_stats, _, _, _ = azure_fetch_completed_transcription(
+                url=content_url, match_voiceprint=True, application_owner=application_owner, confidence_threshold=confidence_threshold,
+                transcription_url=transcription_url)
 
         output_list = []
         for speaker, stats in speaker_stats.items():
             confidence_pct = f"{stats.get('confidence', 0) * 100:.2f}%"
             output_list.append(f'Speaker-{speaker}: {stats["identified_name"]} ({confidence_pct})')
 
-        # Clean up the temporary WAV file
-        if os.path.exists(meeting_wav_path):
-            os.remove(meeting_wav_path)
-
         # Return the speaker voiceprint match
         return {"speaker": '\n'.join(output_list)}
 
@@ -502,7 +530,7 @@ def azure_match_speaker_voiceprint(request):
 
 def azure_upload_media_and_get_sas_url(request):
     """
-    Uploads a media file (MP4 or WAV) to Azure Blob Storage and generates a SAS URL with 1-year expiry.
+    Uploads a media file (MP4 or WAV) to blob storage and generates a SAS URL with 1-year expiry (7 days on MinIO).
     Automatically detects file type from URL and content.
     
     Args:
@@ -532,7 +560,7 @@ def azure_upload_media_and_get_sas_url(request):
         
         try:
             # Download the file
-            response = requests.get(file_url, stream=True)
+            response = http_client.get(http_client.MEDIA, file_url, stream=True)
             response.raise_for_status()
             
             # Get content type from response headers
@@ -558,15 +586,12 @@ def azure_upload_media_and_get_sas_url(request):
             # Generate blob name
             blob_name = f"media/{unique_id}.{file_type}"
             
-            # Upload to Azure with 1-year expiry
-            sas_url = azure_upload_file_and_get_sas_url(
-                file_path=temp_filepath,
-                blob_name=blob_name,
-                expiry_date=timedelta(days=365)
-            )
-            
-            if not sas_url:
-                return {"error": "Failed to upload file to Azure"}, 500
+            # Upload with 1-year expiry
+            try:
+                sas_url = get_blob_store().put_file_and_presign(MEDIA_CONTAINER, blob_name, temp_filepath, expiry=timedelta(days=365))
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                return {"error": "Failed to upload file to blob storage"}, 500
                 
             return {"sas_url": sas_url}
             
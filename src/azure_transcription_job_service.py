@@ -0,0 +1,155 @@
+import os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from typing import Optional
+from urllib.parse import urlsplit
+from sqlalchemy import create_engine, select, update, func, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import sessionmaker
+
+from src.models import AzureTranscriptionJob
+from src.db_config import get_database_url
+
+# Load environment variables
+load_dotenv()
+
+# Local job state is only trusted when Azure reports status changes through the webhook
+AZURE_STT_WEBHOOK_ENABLED = bool(os.getenv("AZURE_STT_WEBHOOK_SECRET"))
+# A running job whose status was not updated by a callback or a check for this long is checked against Azure again,
+# so a lost completion callback delays its results by this much at most
+AZURE_JOB_STATUS_GRACE = timedelta(seconds=int(os.getenv("AZURE_JOB_STATUS_GRACE_SECONDS", "60")))
+# Result processing that has not finished after this long is considered dead and may be restarted
+PROCESSING_TIMEOUT = timedelta(minutes=int(os.getenv("TRANSCRIPTION_RESULT_PROCESSING_TIMEOUT_MINUTES", "30")))
+
+RUNNING_STATUSES = ("NotStarted", "Running")
+
+DATABASE_URL = get_database_url()
+
+# Create database engine
+engine = create_engine(DATABASE_URL, connect_args={'client_encoding': 'utf8'})
+Session = sessionmaker(bind=engine)
+
+
+def transcription_id_from_url(url: str) -> str:
+    """The transcription id, the last path segment of the Azure transcription URL."""
+    return urlsplit(url).path.rstrip("/").split("/")[-1]
+
+
+def job_to_dict(job: AzureTranscriptionJob) -> dict:
+    return {
+        "transcription_id": job.transcription_id,
+        "transcription_url": job.transcription_url,
+        "application_owner": job.application_owner,
+        "confidence_threshold": job.confidence_threshold,
+        "status": job.status,
+        "processing_status": job.processing_status,
+        "content_url_list": job.content_url_list,
+        "sys_ids": job.sys_ids,
+        "error_message": job.error_message,
+        "status_dt": job.status_dt.isoformat() if job.status_dt else None,
+        "created_dt": job.created_dt.isoformat() if job.created_dt else None,
+        "updated_dt": job.updated_dt.isoformat() if job.updated_dt else None,
+        "completed_dt": job.completed_dt.isoformat() if job.completed_dt else None,
+    }
+
+
+def get_azure_transcription_job(transcription_id: str) -> Optional[dict]:
+    with Session() as session:
+        job = session.execute(
+            select(AzureTranscriptionJob).where(AzureTranscriptionJob.transcription_id == transcription_id)
+        ).scalars().first()
+        return job_to_dict(job) if job else None
+
+
+def is_running_locally(job: Optional[dict]) -> bool:
+    """
+    True when the webhook keeps this job's status current and it was reported running within AZURE_JOB_STATUS_GRACE,
+    so polls need not ask Azure. Checks against Azure refresh the status too, so however often clients poll,
+    a running job is checked at most once per grace period.
+    """
+    if not AZURE_STT_WEBHOOK_ENABLED or job is None or job["status"] not in RUNNING_STATUSES:
+        return False
+    status_dt = datetime.fromisoformat(job["status_dt"]) if job["status_dt"] else None
+    return status_dt is not None and datetime.now() - status_dt < AZURE_JOB_STATUS_GRACE
+
+
+def upsert_azure_transcription_job(transcription_url: str, application_owner: Optional[str] = None,
+                                   confidence_threshold: Optional[float] = None, status: Optional[str] = None,
+                                   content_url_list: Optional[list] = None, sys_ids: Optional[list] = None) -> dict:
+    """
+    Create the job of a transcription or update the values given; None leaves a value unchanged.
+
+    Returns:
+        dict: The job
+    """
+    now = datetime.now()
+    values = {
+        "application_owner": application_owner,
+        "confidence_threshold": confidence_threshold,
+        "status": status,
+        "content_url_list": content_url_list,
+        "sys_ids": sys_ids,
+    }
+    values = {key: value for key, value in values.items() if value is not None}
+    if status is not None:
+        values["status_dt"] = now
+        if status in ("Succeeded", "Failed"):
+            values["completed_dt"] = now
+
+    statement = insert(AzureTranscriptionJob).values(
+        transcription_id=transcription_id_from_url(transcription_url),
+        transcription_url=transcription_url,
+        processing_status="pending",
+        updated_dt=now,
+        **{"status": "NotStarted", **values}
+    )
+    update_values = {**values, "updated_dt": now}
+    if "completed_dt" in update_values:
+        update_values["completed_dt"] = func.coalesce(AzureTranscriptionJob.completed_dt, now)
+    statement = statement.on_conflict_do_update(
+        index_elements=["transcription_id"],
+        set_=update_values
+    ).returning(AzureTranscriptionJob)
+
+    with Session() as session:
+        job = session.execute(statement).scalars().one()
+        session.commit()
+        return job_to_dict(job)
+
+
+def claim_azure_transcription_processing(transcription_id: str) -> bool:
+    """
+    Mark a succeeded job's results as processing, unless they already are or are done.
+    A job can only be processed once its application owner is known.
+    """
+    with Session() as session:
+        result = session.execute(
+            update(AzureTranscriptionJob)
+            .where(
+                AzureTranscriptionJob.transcription_id == transcription_id,
+                AzureTranscriptionJob.status == "Succeeded",
+                AzureTranscriptionJob.application_owner.is_not(None),
+                or_(
+                    AzureTranscriptionJob.processing_status.in_(["pending", "failed"]),
+                    (AzureTranscriptionJob.processing_status == "processing")
+                    & (AzureTranscriptionJob.updated_dt < datetime.now() - PROCESSING_TIMEOUT)
+                )
+            )
+            .values(processing_status="processing", error_message=None, updated_dt=datetime.now())
+        )
+        session.commit()
+        return result.rowcount == 1
+
+
+def finish_azure_transcription_processing(transcription_id: str, error_message: Optional[str] = None) -> None:
+    with Session() as session:
+        session.execute(
+            update(AzureTranscriptionJob)
+            .where(AzureTranscriptionJob.transcription_id == transcription_id)
+            .values(
+                processing_status="failed" if error_message else "completed",
+                error_message=error_message,
+                updated_dt=datetime.now()
+            )
+        )
+        session.commit()
@@ -0,0 +1,191 @@
+import os
+import hmac
+import base64
+import hashlib
+import argparse
+import threading
+from dotenv import load_dotenv
+from flask import current_app
+
+from src import http_client
+from src.azure_service import AzureTranscriptionFailed, azure_check_status, process_azure_transcription, headers
+from src.azure_transcription_job_service import (
+    transcription_id_from_url, get_azure_transcription_job, upsert_azure_transcription_job,
+    claim_azure_transcription_processing, finish_azure_transcription_processing
+)
+
+# Load environment variables
+load_dotenv()
+
+AZURE_STT_ENDPOINT = os.getenv("AZURE_STT_ENDPOINT")  # e.g. https://eastasia.api.cognitive.microsoft.com
+AZURE_STT_WEBHOOK_URL = os.getenv("AZURE_STT_WEBHOOK_URL")  # Public URL of /azure_transcription/webhook
+AZURE_STT_WEBHOOK_SECRET = os.getenv("AZURE_STT_WEBHOOK_SECRET")
+AZURE_STT_API_VERSION = "v3.2"
+
+EVENT_HEADER = "X-MicrosoftSpeechServices-Event"
+SIGNATURE_HEADER = "X-MicrosoftSpeechServices-Signature"
+
+# Webhook event -> Azure transcription status, completion is resolved by asking Azure for the outcome
+EVENT_STATUSES = {
+    "transcriptioncreation": "NotStarted",
+    "transcriptionprocessing": "Running",
+    "transcriptiondeletion": "Deleted",
+}
+
+
+def is_valid_signature(body: bytes, signature: str) -> bool:
+    """Azure signs the payload with HMAC-SHA256 using the secret given when the webhook was registered."""
+    if not AZURE_STT_WEBHOOK_SECRET or not signature:
+        return False
+    digest = hmac.new(AZURE_STT_WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).digest()
+    return hmac.compare_digest(signature, base64.b64encode(digest).decode()) or hmac.compare_digest(signature.lower(), digest.hex())
+
+
+def process_completed_transcription(transcription_id: str, app) -> None:
+    """Build and store the results of a succeeded job whose application owner is known, once."""
+    if not claim_azure_transcription_processing(transcription_id):
+        return
+    job = get_azure_transcription_job(transcription_id)
+    try:
+        content_url_list, sys_ids = job["content_url_list"], job["sys_ids"] or []
+        if not content_url_list:
+            # Not listed yet, or cleared by a migration
+            content_url_list, sys_ids = azure_check_status(job["transcription_url"], build_index=False)
+            if content_url_list == "In Progress":
+                raise Exception("Transcription files are not available")
+            upsert_azure_transcription_job(job["transcription_url"], content_url_list=content_url_list, sys_ids=sys_ids)
+        result = process_azure_transcription(
+            job["transcription_url"], job["application_owner"], job["confidence_threshold"],
+            content_url_list, sys_ids, app
+        )
+        if isinstance(result, tuple):
+            raise Exception(result[0].get("error", "Failed to process transcription"))
+        if isinstance(result, dict) and "error" in result:
+            raise Exception(result["error"])
+        failed = [entry for entry in result if entry.get("status") in ("failed", "in_progress")]
+        finish_azure_transcription_processing(transcription_id, f"{len(failed)} file(s) not processed" if failed else None)
+        print(f"Processed Azure transcription {transcription_id}")
+    except Exception as e:
+        finish_azure_transcription_processing(transcription_id, str(e))
+        print(f"Failed to process Azure transcription {transcription_id}: {e}")
+
+
+def start_processing(transcription_id: str) -> None:
+    app = current_app._get_current_object()
+    threading.Thread(target=process_completed_transcription, args=(transcription_id, app), daemon=True).start()
+
+
+def azure_transcription_webhook(request):
+    """
+    Receives Azure Speech batch transcription webhook callbacks.
+
+    Args:
+        request: Flask request object, either:
+            - the registration challenge, with a validationToken query parameter to echo back
+            - an event, {"self": "<transcription url>", "invokedDateTime": ...} signed in X-MicrosoftSpeechServices-Signature
+
+    Returns:
+        The validation token for the challenge, otherwise an acknowledgement
+    """
+    validation_token = request.args.get("validationToken")
+    if validation_token:
+        return validation_token, 200, {"Content-Type": "text/plain"}
+
+    if not is_valid_signature(request.get_data(), request.headers.get(SIGNATURE_HEADER, "")):
+        return {"error": "Invalid signature"}, 401
+
+    event = request.headers.get(EVENT_HEADER, "").lower()
+    data = request.get_json(silent=True) or {}
+    transcription_url = data.get("self")
+    if not transcription_url:
+        return {"error": "self is required"}, 400
+
+    if event == "transcriptioncompletion":
+        # The callback only says the job finished, one status call tells whether it succeeded and lists its files
+        try:
+            content_url_list, sys_ids = azure_check_status(transcription_url, build_index=False)
+        except AzureTranscriptionFailed:
+            content_url_list = None
+        if content_url_list is None or content_url_list == "In Progress":
+            upsert_azure_transcription_job(transcription_url, status="Failed")
+        else:
+            upsert_azure_transcription_job(transcription_url, status="Succeeded", content_url_list=content_url_list, sys_ids=sys_ids)
+            start_processing(transcription_id_from_url(transcription_url))
+    elif event in EVENT_STATUSES:
+        upsert_azure_transcription_job(transcription_url, status=EVENT_STATUSES[event])
+    else:
+        return {"error": f"Unsupported event: {event}"}, 400
+
+    return {"status": "accepted"}, 200
+
+
+def register_azure_transcription_job(request):
+    """
+    Registers the application owner of a transcription ahead of its completion, so the results are processed
+    as soon as the webhook reports it completed, before anyone polls /azure_transcription.
+
+    Args:
+        request: Flask request object containing:
+            - url: Azure transcription URL
+            - application_owner: Owner charged for the transcription
+            - confidence_threshold: (optional) Voiceprint matching threshold
+
+    Returns:
+        The job's local status
+    """
+    data = request.get_json()
+    url = data.get('url')
+    application_owner = data.get('application_owner')
+    confidence_threshold = float(data['confidence_threshold']) if data.get('confidence_threshold') is not None else None
+
+    if not url or not application_owner:
+        return {"error": "url and application_owner are required"}, 400
+
+    job = upsert_azure_transcription_job(url, application_owner=application_owner, confidence_threshold=confidence_threshold)
+    if job["status"] == "Succeeded":
+        start_processing(job["transcription_id"])
+    return job, 200
+
+
+def get_azure_transcription_job_status(transcription_id: str):
+    """The job's status as last reported by the webhook or a poll, without calling Azure."""
+    job = get_azure_transcription_job(transcription_id)
+    if job is None:
+        return {"error": "Transcription job not found"}, 404
+    return job, 200
+
+
+def register_azure_webhook() -> dict:
+    """
+    Register AZURE_STT_WEBHOOK_URL with Azure Speech, signed with AZURE_STT_WEBHOOK_SECRET.
+    Azure validates the URL with a challenge before sending events, so the backend must be reachable.
+    """
+    if not AZURE_STT_ENDPOINT or not AZURE_STT_WEBHOOK_URL or not AZURE_STT_WEBHOOK_SECRET:
+        raise ValueError("AZURE_STT_ENDPOINT, AZURE_STT_WEBHOOK_URL and AZURE_STT_WEBHOOK_SECRET are required")
+
+    payload = {
+        "displayName": "AiMeetingBackend transcription events",
+        "webUrl": AZURE_STT_WEBHOOK_URL,
+        "events": {
+            "transcriptionCreation": True,
+            "transcriptionProcessing": True,
+            "transcriptionCompletion": True,
+            "transcriptionDeletion": True
+        },
+        "properties": {"secret": AZURE_STT_WEBHOOK_SECRET}
+    }
+    response = http_client.post(
+        http_client.AZURE_STT, f"{AZURE_STT_ENDPOINT.rstrip('/')}/speechtotext/{AZURE_STT_API_VERSION}/webhooks",
+        json=payload, headers=headers
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+if __name__ == '__main__':
+    # Register the webhook once per Speech resource: python -m src.azure_webhook_service register
+    parser = argparse.ArgumentParser(description="Manage the Azure Speech transcription webhook")
+    parser.add_argument("command", choices=["register"])
+    args = parser.parse_args()
+
+    print(register_azure_webhook())
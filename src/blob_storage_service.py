@@ -1,7 +1,13 @@
 ﻿import os
+import threading
 from dotenv import load_dotenv
 from minio import Minio
-from datetime import timedelta
+from minio.error import S3Error
+from azure.storage.blob import BlobServiceClient, ContainerClient, generate_blob_sas, BlobSasPermissions
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import urlsplit, unquote
 import mimetypes
 from enum import Enum
 from src.enums import NgrokMode
@@ -23,16 +29,61 @@ client = Minio(MINIO_ENDPOINT,
                secret_key=MINIO_SECRET_KEY,
                secure=MINIO_SECURE)
 
+# Part size of streamed uploads of unknown length, MinIO's minimum is 5 MiB
+MINIO_STREAM_PART_SIZE = 8 * 1024 * 1024
+
+# Large recordings are uploaded as MinIO multipart parts / Azure blocks of this size, this many at a time
+BLOB_UPLOAD_PART_SIZE = int(os.getenv("BLOB_UPLOAD_PART_SIZE_MB", "16")) * 1024 * 1024
+BLOB_UPLOAD_CONCURRENCY = int(os.getenv("BLOB_UPLOAD_CONCURRENCY", "8"))
+
+# Buckets known to exist, checked once per process instead of before every upload
+_known_buckets = set()
+_bucket_lock = threading.Lock()
+
+# Host of the presigned URLs handed out
+MINIO_URL_HOST = MINIO_ENDPOINT
+
 # Check if the minio blob storage is public access, or only local access
 NGROK_PUBLIC_MODE = os.getenv("NGROK_PUBLIC_MODE")
 if NGROK_PUBLIC_MODE == NgrokMode.PUBLIC.value:
     # Public access via ngrok
     ngrok_host = os.getenv("NGROK_HOST")  # <-- use your current ngrok host
+    MINIO_URL_HOST = ngrok_host
     client = Minio(f"{ngrok_host}",
                    access_key=MINIO_ACCESS_KEY,
                    secret_key=MINIO_SECRET_KEY,
                    secure=True)  # ngrok uses https
 
+def ensure_bucket(bucket: str) -> None:
+    """Create the bucket if it does not exist, asking the server once per process."""
+    if bucket in _known_buckets:
+        return
+    with _bucket_lock:
+        if bucket in _known_buckets:
+            return
+        if not client.bucket_exists(bucket):
+            try:
+                client.make_bucket(bucket)
+            except S3Error as e:
+                if e.code not in ("BucketAlreadyOwnedByYou", "BucketAlreadyExists"):  # Created by another worker meanwhile
+                    raise
+        _known_buckets.add(bucket)
+
+
+def _upload_to_bucket(bucket: str, upload) -> None:
+    """Run upload after ensure_bucket, once more if the bucket was deleted since it was cached."""
+    ensure_bucket(bucket)
+    try:
+        upload()
+    except S3Error as e:
+        if e.code != "NoSuchBucket":
+            raise
+        with _bucket_lock:
+            _known_buckets.discard(bucket)
+        ensure_bucket(bucket)
+        upload()
+
+
 def minio_upload_and_share(file_path: str, bucket: str, blob_name: str, expiry_date: timedelta = timedelta(hours=1)) -> str:
     """
     Uploads a blob from Minio Blob Storage.
@@ -44,16 +95,15 @@ def minio_upload_and_share(file_path: str, bucket: str, blob_name: str, expiry_d
     :return: The sas url path of the uploaded file.
     """
 
-    # Ensure bucket exists
-    if not client.bucket_exists(bucket):
-        client.make_bucket(bucket)
-
     # Detect MIME type
     content_type, _ = mimetypes.guess_type(file_path)
     content_type = content_type or 'application/octet-stream'
 
-    # Upload
-    client.fput_object(bucket, blob_name, file_path, content_type=content_type)
+    # Upload, large files as a multipart upload with parts sent in parallel
+    _upload_to_bucket(bucket, lambda: client.fput_object(
+        bucket, blob_name, file_path, content_type=content_type,
+        part_size=BLOB_UPLOAD_PART_SIZE, num_parallel_uploads=BLOB_UPLOAD_CONCURRENCY
+    ))
 
     # Generate presigned URL for GET
     url = client.get_presigned_url(
@@ -63,6 +113,47 @@ def minio_upload_and_share(file_path: str, bucket: str, blob_name: str, expiry_d
     return url
 
 
+def minio_upload_stream_and_share(stream, bucket: str, blob_name: str, expiry_date: timedelta = timedelta(hours=1),
+                                  content_type: str = 'application/octet-stream') -> str:
+    """
+    Uploads a readable stream of unknown length to Minio Blob Storage as a multipart upload.
+
+    :param stream: Readable binary stream, e.g. the read end of a pipe
+    :param bucket: Name of the bucket where the stream will be uploaded.
+    :param blob_name: Name of the blob to be uploaded.
+    :param expiry_date: How long should the blob expire.
+    :param content_type: MIME type of the blob
+    :return: The sas url path of the uploaded blob.
+    """
+    # A stream cannot be replayed, so a bucket deleted since it was cached is not retried here
+    ensure_bucket(bucket)
+    client.put_object(bucket, blob_name, stream, length=-1, part_size=MINIO_STREAM_PART_SIZE, content_type=content_type)
+    return minio_presigned_url(bucket, blob_name, expiry_date)
+
+
+def minio_presigned_url(bucket: str, blob_name: str, expiry_date: timedelta = timedelta(hours=1)) -> str:
+    """
+    Generates a presigned GET URL for an existing blob, without touching the blob.
+
+    :param bucket: Bucket of the blob
+    :param blob_name: Name of the blob
+    :param expiry_date: How long the URL is valid.
+    :return: The presigned URL of the blob.
+    """
+    return client.get_presigned_url("GET", bucket, blob_name, expires=expiry_date)
+
+
+def minio_object_from_url(url: str) -> Optional[tuple[str, str]]:
+    """(bucket, blob name) when url is a presigned URL of this MinIO server, e.g. one returned by /upload/file, otherwise None."""
+    parts = urlsplit(url)
+    if parts.netloc != MINIO_URL_HOST and parts.hostname != MINIO_URL_HOST:
+        return None
+    bucket, _, blob_name = parts.path.lstrip("/").partition("/")
+    if not bucket or not blob_name:
+        return None
+    return bucket, unquote(blob_name)
+
+
 def minio_delete_blob(bucket: str, blob_name: str):
     """
     Deletes a blob from Azure Blob Storage.
@@ -79,6 +170,146 @@ def minio_delete_blob(bucket: str, blob_name: str):
         print(f"An error occurred while deleting the blob: {e}")
         return False
 
+def minio_download_blob(bucket: str, blob_name: str, file_path: str):
+    """
+    Downloads a blob from Minio Blob Storage to a local file.
+
+    :param bucket: Bucket of the blob
+    :param blob_name: Name of the blob to be downloaded.
+    :param file_path: Local path to write the blob to.
+    :return: Boolean indicating whether the download was successful.
+    """
+    try:
+        client.fget_object(bucket, blob_name, file_path)
+        return True
+    except Exception as e:
+        print(f"An error occurred while downloading the blob: {e}")
+        return False
+
+@lru_cache(maxsize=None)
+def get_azure_blob_service_client() -> BlobServiceClient:
+    """The process's Azure Blob Storage client, created once; its connection pool is reused by every call."""
+    return BlobServiceClient(
+        account_url=f"https://{os.getenv('AZURE_ACCOUNT_NAME')}.blob.core.windows.net",
+        credential=os.getenv('AZURE_ACCOUNT_KEY'),
+        max_block_size=BLOB_UPLOAD_PART_SIZE,
+        max_single_put_size=BLOB_UPLOAD_PART_SIZE  # Larger files are staged as blocks in parallel
+    )
+
+
+@lru_cache(maxsize=None)
+def get_azure_container_client() -> ContainerClient:
+    return get_azure_blob_service_client().get_container_client(os.getenv('AZURE_CONTAINER_NAME'))
+
+
+def azure_upload_file_and_get_sas_url(file_path, blob_name, expiry_date: timedelta = timedelta(hours=1)):
+    """
+    Uploads a file to Azure Blob Storage and generates a temporary SAS URL.
+    Files larger than a block are staged as BLOB_UPLOAD_PART_SIZE blocks, BLOB_UPLOAD_CONCURRENCY at a time.
+
+    :param expiry_date: Expiry date for the SAS url
+    :param file_path: Path to the local file to be uploaded.
+    :param blob_name: Name for the blob in Azure Storage.
+
+    :return: SAS URL string for the uploaded blob.
+    """
+    try:
+        with open(file_path, "rb") as data:
+            get_azure_container_client().upload_blob(name=blob_name, data=data, overwrite=True, max_concurrency=BLOB_UPLOAD_CONCURRENCY)
+
+        return azure_generate_sas_url(blob_name, expiry_date)
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
+
+
+def azure_upload_stream_and_get_sas_url(stream, blob_name, expiry_date: timedelta = timedelta(hours=1)):
+    """
+    Uploads a readable stream of unknown length to Azure Blob Storage, staged as blocks while it is read,
+    and generates a temporary SAS URL.
+
+    :param stream: Readable binary stream, e.g. the read end of a pipe
+    :param blob_name: Name for the blob in Azure Storage.
+    :param expiry_date: Expiry date for the SAS url
+    :return: SAS URL string for the uploaded blob.
+    """
+    get_azure_container_client().upload_blob(name=blob_name, data=stream, overwrite=True, max_concurrency=BLOB_UPLOAD_CONCURRENCY)
+    return azure_generate_sas_url(blob_name, expiry_date)
+
+
+def azure_generate_sas_url(blob_name: str, expiry_date: timedelta = timedelta(hours=1),
+                           permission: Optional[BlobSasPermissions] = None) -> str:
+    """
+    Generates a SAS URL for a blob of the container, without touching the blob.
+
+    :param blob_name: Name of the blob in Azure Storage.
+    :param expiry_date: How long the SAS URL is valid.
+    :param permission: Permissions of the SAS token, read-only by default.
+    :return: SAS URL string for the blob.
+    """
+    container_name = os.getenv('AZURE_CONTAINER_NAME')
+    account_name = os.getenv('AZURE_ACCOUNT_NAME')
+    account_key = os.getenv('AZURE_ACCOUNT_KEY')
+
+    # Generate the SAS token, read-only unless other permissions are given
+    sas_token = generate_blob_sas(
+        account_name=account_name,
+        container_name=container_name,
+        blob_name=blob_name,
+        account_key=account_key,
+        permission=permission or BlobSasPermissions(read=True),
+        expiry=datetime.now() + expiry_date
+    )
+
+    # Construct the full URL with the SAS token
+    return f"https://{account_name}.blob.core.windows.net/{container_name}/{blob_name}?{sas_token}"
+
+
+def azure_blob_name_from_url(url: str) -> Optional[str]:
+    """The blob name when url points into this app's container, e.g. a SAS URL returned by /upload/file, otherwise None."""
+    parts = urlsplit(url)
+    container_prefix = f"/{os.getenv('AZURE_CONTAINER_NAME')}/"
+    if parts.hostname != f"{os.getenv('AZURE_ACCOUNT_NAME')}.blob.core.windows.net" or not parts.path.startswith(container_prefix):
+        return None
+    return unquote(parts.path[len(container_prefix):]) or None
+
+
+def azure_delete_blob(blob_name):
+    """
+    Deletes a blob from Azure Blob Storage.
+
+    :param blob_name: Name of the blob to be deleted.
+    :return: Boolean indicating whether the deletion was successful.
+    """
+    try:
+        get_azure_container_client().delete_blob(blob_name, delete_snapshots='include')
+        print(f"Blob '{blob_name}' deleted successfully.")
+        return True
+
+    except Exception as e:
+        print(f"An error occurred while deleting the blob: {e}")
+        return False
+
+
+def azure_download_blob(blob_name, file_path):
+    """
+    Downloads a blob from Azure Blob Storage to a local file, in ranges fetched in parallel.
+
+    :param blob_name: Name of the blob to be downloaded.
+    :param file_path: Local path to write the blob to.
+    :return: Boolean indicating whether the download was successful.
+    """
+    try:
+        with open(file_path, "wb") as file:
+            get_azure_container_client().download_blob(blob_name, max_concurrency=BLOB_UPLOAD_CONCURRENCY).readinto(file)
+        return True
+
+    except Exception as e:
+        print(f"An error occurred while downloading the blob: {e}")
+        return False
+
+
 def generate_sharing_info(sas_url: str, blob_name: str, expiry_date: timedelta) -> str:
     """
     Generate sharing information for the file
@@ -0,0 +1,504 @@
+import os
+import re
+import hmac
+import time
+import uuid
+import base64
+import shutil
+import hashlib
+import secrets
+import mimetypes
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from functools import lru_cache
+from typing import BinaryIO, Iterator, Optional
+from urllib.parse import urlsplit, unquote, quote, urlencode
+from dotenv import load_dotenv
+from minio.commonconfig import CopySource
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobBlock, BlobSasPermissions, ContentSettings
+
+from src.enums import OnPremiseMode
+from src import blob_storage_service, http_client
+
+# Load environment variables
+load_dotenv()
+
+# Logical containers: MinIO buckets / local directories. Azure keeps every blob in AZURE_CONTAINER_NAME as before
+MEDIA_CONTAINER = "meeting-minutes"
+TEMP_AUDIO_CONTAINER = "meeting-minutes-temp-audio"
+SPEAKER_CLIP_CONTAINER = "meeting-minutes-speaker-clip"
+VOICEPRINT_CONTAINER = "meeting-minutes-voiceprint"
+
+AZURE_STORE = "azure"
+MINIO_STORE = "minio"
+LOCAL_STORE = "local"
+
+MINIO_MAX_PRESIGN_EXPIRY = timedelta(days=7)  # Longest presigned URL MinIO signs
+# Local store: blobs are files under LOCAL_BLOB_ROOT, presigned URLs are served by the app's /blobs route
+LOCAL_BLOB_ROOT = os.getenv("LOCAL_BLOB_ROOT", "blob_store")
+LOCAL_BLOB_BASE_URL = os.getenv("LOCAL_BLOB_BASE_URL", "http://localhost:5000").rstrip("/")
+LOCAL_BLOB_ROUTE = "/blobs"
+LOCAL_COPY_BUFFER = 1024 * 1024
+LOCAL_UPLOADS_DIR = ".uploads"  # Parts of unfinished multipart uploads, next to the containers
+LOCAL_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+LOCAL_SECRET_FILE = ".secret"  # Signing key generated once when LOCAL_BLOB_SECRET is unset, next to the containers
+PART_URL_EXPIRY = timedelta(minutes=15)  # Part URLs the server signs for its own uploads
+AZURE_COPY_TIMEOUT = timedelta(minutes=30)  # Longest server-side copy waited for
+
+
+class BlobStore(ABC):
+    """
+    Blob storage used by every service: one interface for Azure Blob Storage, MinIO and the local filesystem.
+    Blobs are addressed by a logical container and a blob name. Methods raise on failure.
+    """
+
+    name: str  # Stored with deferred deletions to find the store again
+
+    @abstractmethod
+    def put_file(self, container: str, blob_name: str, file_path: str, content_type: Optional[str] = None) -> None:
+        ...
+
+    @abstractmethod
+    def put_stream(self, container: str, blob_name: str, stream: BinaryIO, content_type: str = "application/octet-stream") -> None:
+        """Upload a readable stream of unknown length, e.g. the read end of a pipe, while it is read."""
+
+    @abstractmethod
+    def get_range(self, container: str, blob_name: str, offset: int = 0, length: Optional[int] = None) -> bytes:
+        """length bytes from offset, up to the end of the blob when length is None."""
+
+    @abstractmethod
+    def download(self, container: str, blob_name: str, file_path: str) -> None:
+        ...
+
+    @abstractmethod
+    def presign(self, container: str, blob_name: str, expiry: timedelta = timedelta(hours=1)) -> str:
+        """A read URL of the blob for clients and providers, valid for expiry (or the store's maximum)."""
+
+    @abstractmethod
+    def delete(self, container: str, blob_name: str) -> None:
+        ...
+
+    @abstractmethod
+    def copy(self, container: str, blob_name: str, target_blob_name: str, target_container: Optional[str] = None) -> None:
+        ...
+
+    @abstractmethod
+    def list(self, container: str, prefix: str = "") -> Iterator[str]:
+        """Blob names of the container starting with prefix."""
+
+    @abstractmethod
+    def locate(self, url: str) -> Optional[tuple[str, str]]:
+        """(container, blob name) when url is a presigned URL of this store, otherwise None."""
+
+    # Multipart uploads: clients PUT numbered parts, from 1, straight to presigned URLs; completing joins them in order
+
+    @abstractmethod
+    def start_multipart_upload(self, container: str, blob_name: str, content_type: str = "application/octet-stream") -> str:
+        """Returns the upload id."""
+
+    @abstractmethod
+    def presign_upload_part(self, container: str, blob_name: str, upload_id: str, part_number: int,
+                            expiry: timedelta = timedelta(hours=1)) -> str:
+        """A URL the client PUTs the bytes of one part to."""
+
+    def put_part(self, container: str, blob_name: str, upload_id: str, part_number: int, stream: BinaryIO, length: int) -> None:
+        """Upload one part from the server, e.g. a chunk of a resumable upload, streamed to a presigned part URL as it is read."""
+        url = self.presign_upload_part(container, blob_name, upload_id, part_number, PART_URL_EXPIRY)
+        # A stream cannot be replayed, so the PUT is not retried; the client sends the chunk again
+        response = http_client.request(http_client.MEDIA, "PUT", url, retry=False, data=_SizedStream(stream, length))
+        response.raise_for_status()
+
+    @abstractmethod
+    def list_parts(self, container: str, blob_name: str, upload_id: str) -> dict[int, int]:
+        """Part number -> size in bytes of the parts uploaded so far."""
+
+    @abstractmethod
+    def complete_multipart_upload(self, container: str, blob_name: str, upload_id: str, part_count: int) -> None:
+        """Join parts 1 to part_count into the blob; raises when one of them was not uploaded."""
+
+    @abstractmethod
+    def abort_multipart_upload(self, container: str, blob_name: str, upload_id: str) -> None:
+        ...
+
+    def put_file_and_presign(self, container: str, blob_name: str, file_path: str,
+                             expiry: timedelta = timedelta(hours=1), content_type: Optional[str] = None) -> str:
+        self.put_file(container, blob_name, file_path, content_type)
+        return self.presign(container, blob_name, expiry)
+
+    def put_stream_and_presign(self, container: str, blob_name: str, stream: BinaryIO,
+                               expiry: timedelta = timedelta(hours=1), content_type: str = "application/octet-stream") -> str:
+        self.put_stream(container, blob_name, stream, content_type)
+        return self.presign(container, blob_name, expiry)
+
+
+class _SizedStream:
+    """A stream with a known length, so requests sends it with Content-Length instead of chunked encoding."""
+
+    def __init__(self, stream: BinaryIO, length: int):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        return self.stream.read(size)
+
+
+class AzureBlobStore(BlobStore):
+    """All logical containers share AZURE_CONTAINER_NAME, blob names keep their prefixes (media/, voiceprints/)."""
+
+    name = AZURE_STORE
+
+    def _blob(self, blob_name: str):
+        return blob_storage_service.get_azure_container_client().get_blob_client(blob_name)
+
+    def put_file(self, container, blob_name, file_path, content_type=None):
+        with open(file_path, "rb") as data:
+            self._blob(blob_name).upload_blob(data, overwrite=True, max_concurrency=blob_storage_service.BLOB_UPLOAD_CONCURRENCY)
+
+    def put_stream(self, container, blob_name, stream, content_type="application/octet-stream"):
+        self._blob(blob_name).upload_blob(stream, overwrite=True, max_concurrency=blob_storage_service.BLOB_UPLOAD_CONCURRENCY)
+
+    def get_range(self, container, blob_name, offset=0, length=None):
+        return self._blob(blob_name).download_blob(offset=offset, length=length).readall()
+
+    def download(self, container, blob_name, file_path):
+        with open(file_path, "wb") as file:
+            self._blob(blob_name).download_blob(max_concurrency=blob_storage_service.BLOB_UPLOAD_CONCURRENCY).readinto(file)
+
+    def presign(self, container, blob_name, expiry=timedelta(hours=1)):
+        return blob_storage_service.azure_generate_sas_url(blob_name, expiry)
+
+    def delete(self, container, blob_name):
+        self._blob(blob_name).delete_blob(delete_snapshots="include")
+
+    def copy(self, container, blob_name, target_blob_name, target_container=None):
+        # Server-side copy within the account; the source is read through a short-lived SAS URL
+        target = self._blob(target_blob_name)
+        copy_id = target.start_copy_from_url(self.presign(container, blob_name, timedelta(hours=1)))["copy_id"]
+        deadline = time.monotonic() + AZURE_COPY_TIMEOUT.total_seconds()
+        copy = target.get_blob_properties().copy
+        while copy.status == "pending":
+            if time.monotonic() > deadline:
+                target.abort_copy(copy_id)
+                raise TimeoutError(f"Copy of {blob_name} to {target_blob_name} did not finish in {AZURE_COPY_TIMEOUT}")
+            time.sleep(1)
+            copy = target.get_blob_properties().copy
+        if copy.status != "success":
+            raise RuntimeError(f"Copy of {blob_name} to {target_blob_name} {copy.status}: {copy.status_description}")
+
+    def list(self, container, prefix=""):
+        for blob in blob_storage_service.get_azure_container_client().list_blobs(name_starts_with=prefix or None):
+            yield blob.name
+
+    def locate(self, url):
+        blob_name = blob_storage_service.azure_blob_name_from_url(url)
+        return (MEDIA_CONTAINER, blob_name) if blob_name else None
+
+    @staticmethod
+    def _block_id(upload_id: str, part_number: int) -> str:
+        # Block ids of a blob must all have the same length
+        return base64.b64encode(f"{upload_id}-{part_number:05d}".encode("ascii")).decode("ascii")
+
+    def start_multipart_upload(self, container, blob_name, content_type="application/octet-stream"):
+        # Parts are uncommitted blocks of the blob, nothing to create; Azure drops uncommitted blocks after 7 days
+        return uuid.uuid4().hex
+
+    def presign_upload_part(self, container, blob_name, upload_id, part_number, expiry=timedelta(hours=1)):
+        sas_url = blob_storage_service.azure_generate_sas_url(blob_name, expiry, permission=BlobSasPermissions(write=True))
+        return f"{sas_url}&{urlencode({'comp': 'block', 'blockid': self._block_id(upload_id, part_number)})}"
+
+    def list_parts(self, container, blob_name, upload_id):
+        parts = {}
+        try:
+            _, uncommitted = self._blob(blob_name).get_block_list("uncommitted")
+        except ResourceNotFoundError:
+            return parts  # No block staged yet
+        for block in uncommitted:
+            name = base64.b64decode(block.id).decode("ascii", errors="replace")
+            block_upload_id, _, part_number = name.rpartition("-")
+            if block_upload_id == upload_id and part_number.isdigit():
+                parts[int(part_number)] = block.size
+        return parts
+
+    def complete_multipart_upload(self, container, blob_name, upload_id, part_count):
+        content_type = mimetypes.guess_type(blob_name)[0] or "application/octet-stream"
+        self._blob(blob_name).commit_block_list(
+            [BlobBlock(block_id=self._block_id(upload_id, part_number)) for part_number in range(1, part_count + 1)],
+            content_settings=ContentSettings(content_type=content_type)
+        )
+
+    def abort_multipart_upload(self, container, blob_name, upload_id):
+        pass  # Uncommitted blocks expire on their own
+
+
+class MinioBlobStore(BlobStore):
+    """
+    Logical containers are buckets, created on first use. Multipart uploads use the client's private multipart
+    methods, the public API only uploads whole files; minio is pinned in requirements.txt for them.
+    """
+
+    name = MINIO_STORE
+
+    def put_file(self, container, blob_name, file_path, content_type=None):
+        content_type = content_type or mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        blob_storage_service._upload_to_bucket(container, lambda: blob_storage_service.client.fput_object(
+            container, blob_name, file_path, content_type=content_type,
+            part_size=blob_storage_service.BLOB_UPLOAD_PART_SIZE, num_parallel_uploads=blob_storage_service.BLOB_UPLOAD_CONCURRENCY
+        ))
+
+    def put_stream(self, container, blob_name, stream, content_type="application/octet-stream"):
+        blob_storage_service.ensure_bucket(container)
+        blob_storage_service.client.put_object(container, blob_name, stream, length=-1,
+                                               part_size=blob_storage_service.MINIO_STREAM_PART_SIZE, content_type=content_type)
+
+    def get_range(self, container, blob_name, offset=0, length=None):
+        response = blob_storage_service.client.get_object(container, blob_name, offset=offset, length=length or 0)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    def download(self, container, blob_name, file_path):
+        blob_storage_service.client.fget_object(container, blob_name, file_path)
+
+    def presign(self, container, blob_name, expiry=timedelta(hours=1)):
+        return blob_storage_service.minio_presigned_url(container, blob_name, min(expiry, MINIO_MAX_PRESIGN_EXPIRY))
+
+    def delete(self, container, blob_name):
+        blob_storage_service.client.remove_object(container, blob_name)
+
+    def copy(self, container, blob_name, target_blob_name, target_container=None):
+        target_container = target_container or container
+        blob_storage_service.ensure_bucket(target_container)
+        blob_storage_service.client.copy_object(target_container, target_blob_name, CopySource(container, blob_name))
+
+    def list(self, container, prefix=""):
+        for blob in blob_storage_service.client.list_objects(container, prefix=prefix or None, recursive=True):
+            yield blob.object_name
+
+    def locate(self, url):
+        return blob_storage_service.minio_object_from_url(url)
+
+    # The MinIO SDK keeps its multipart calls private, they are the S3 API calls of the same names
+
+    def start_multipart_upload(self, container, blob_name, content_type="application/octet-stream"):
+        blob_storage_service.ensure_bucket(container)
+        return blob_storage_service.client._create_multipart_upload(container, blob_name, {"Content-Type": content_type})
+
+    def presign_upload_part(self, container, blob_name, upload_id, part_number, expiry=timedelta(hours=1)):
+        return blob_storage_service.client.get_presigned_url(
+            "PUT", container, blob_name, expires=min(expiry, MINIO_MAX_PRESIGN_EXPIRY),
+            extra_query_params={"uploadId": upload_id, "partNumber": str(part_number)}
+        )
+
+    def _uploaded_parts(self, container: str, blob_name: str, upload_id: str) -> dict:
+        parts = {}
+        marker = None
+        while True:
+            result = blob_storage_service.client._list_parts(container, blob_name, upload_id, part_number_marker=marker)
+            parts.update((part.part_number, part) for part in result.parts)
+            if not result.is_truncated:
+                return parts
+            marker = str(result.next_part_number_marker)
+
+    def list_parts(self, container, blob_name, upload_id):
+        return {part_number: part.size for part_number, part in self._uploaded_parts(container, blob_name, upload_id).items()}
+
+    def complete_multipart_upload(self, container, blob_name, upload_id, part_count):
+        # ETags are listed here rather than collected from the client, so browsers need not read response headers
+        parts = self._uploaded_parts(container, blob_name, upload_id)
+        missing = [part_number for part_number in range(1, part_count + 1) if part_number not in parts]
+        if missing:
+            raise ValueError(f"Parts not uploaded: {missing[:10]}")
+        blob_storage_service.client._complete_multipart_upload(
+            container, blob_name, upload_id, [parts[part_number] for part_number in range(1, part_count + 1)]
+        )
+
+    def abort_multipart_upload(self, container, blob_name, upload_id):
+        blob_storage_service.client._abort_multipart_upload(container, blob_name, upload_id)
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blobs as files under a root directory, for development and offline benchmarks of the whole pipeline.
+    Presigned URLs point at the app's /blobs route and carry an HMAC of the blob and expiry.
+    """
+
+    name = LOCAL_STORE
+
+    def __init__(self, root: str = LOCAL_BLOB_ROOT, base_url: str = LOCAL_BLOB_BASE_URL, secret: Optional[str] = None):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url
+        secret = secret or os.getenv("LOCAL_BLOB_SECRET") or self._stored_secret()
+        self._secret = secret.encode("utf-8")
+
+    def _stored_secret(self) -> str:
+        """
+        The signing key kept under the root, generated by the first process that needs it, so URLs stay valid
+        across workers and restarts sharing the root.
+        """
+        path = os.path.join(self.root, LOCAL_SECRET_FILE)
+        if not os.path.exists(path):
+            print(f"LOCAL_BLOB_SECRET is not set, signing local blob URLs with the key in {path}")
+            os.makedirs(self.root, exist_ok=True)
+            partial_path = f"{path}.{secrets.token_hex(4)}.partial"
+            with open(os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as file:
+                file.write(secrets.token_hex(32))
+            try:
+                os.link(partial_path, path)  # Fails when another process stored its key first, that key is used
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(partial_path)
+        with open(path) as file:
+            return file.read().strip()
+
+    def path(self, container: str, blob_name: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, container, blob_name))
+        if not path.startswith(os.path.join(self.root, container) + os.sep):
+            raise ValueError(f"Invalid blob name: {blob_name}")
+        return path
+
+    def _target_path(self, container: str, blob_name: str) -> str:
+        path = self.path(container, blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def put_file(self, container, blob_name, file_path, content_type=None):
+        shutil.copyfile(file_path, self._target_path(container, blob_name))
+
+    def put_stream(self, container, blob_name, stream, content_type="application/octet-stream"):
+        path = self._target_path(container, blob_name)
+        partial_path = f"{path}.{secrets.token_hex(4)}.partial"  # Never readable half written
+        with open(partial_path, "wb") as file:
+            shutil.copyfileobj(stream, file, LOCAL_COPY_BUFFER)
+        os.replace(partial_path, path)
+
+    def get_range(self, container, blob_name, offset=0, length=None):
+        with open(self.path(container, blob_name), "rb") as file:
+            file.seek(offset)
+            return file.read(-1 if length is None else length)
+
+    def download(self, container, blob_name, file_path):
+        shutil.copyfile(self.path(container, blob_name), file_path)
+
+    def signature(self, container: str, blob_name: str, expires: int, *scope) -> str:
+        """HMAC of a URL; scope binds upload URLs to their upload and part."""
+        message = ":".join([f"{container}/{blob_name}", str(expires), *map(str, scope)])
+        return hmac.new(self._secret, message.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def verify(self, container: str, blob_name: str, expires: str, signature: str, *scope) -> bool:
+        if not expires.isdigit() or int(expires) < time.time():
+            return False
+        return hmac.compare_digest(self.signature(container, blob_name, int(expires), *scope), signature)
+
+    def presign(self, container, blob_name, expiry=timedelta(hours=1)):
+        expires = int(time.time() + expiry.total_seconds())
+        query = urlencode({"expires": expires, "signature": self.signature(container, blob_name, expires)})
+        return f"{self.base_url}{LOCAL_BLOB_ROUTE}/{quote(container)}/{quote(blob_name)}?{query}"
+
+    def delete(self, container, blob_name):
+        try:
+            os.remove(self.path(container, blob_name))
+        except FileNotFoundError:
+            pass  # Already gone, as with MinIO
+
+    def copy(self, container, blob_name, target_blob_name, target_container=None):
+        shutil.copyfile(self.path(container, blob_name), self._target_path(target_container or container, target_blob_name))
+
+    def list(self, container, prefix=""):
+        container_root = os.path.join(self.root, container)
+        for directory, _, files in os.walk(container_root):
+            for file_name in files:
+                blob_name = os.path.relpath(os.path.join(directory, file_name), container_root).replace(os.sep, "/")
+                if blob_name.startswith(prefix) and not blob_name.endswith(".partial"):
+                    yield blob_name
+
+    def _upload_path(self, upload_id: str) -> str:
+        if not LOCAL_UPLOAD_ID.match(upload_id):
+            raise ValueError(f"Invalid upload id: {upload_id}")
+        return os.path.join(self.root, LOCAL_UPLOADS_DIR, upload_id)
+
+    def _part_path(self, upload_id: str, part_number: int) -> str:
+        return os.path.join(self._upload_path(upload_id), f"{part_number:05d}")
+
+    def start_multipart_upload(self, container, blob_name, content_type="application/octet-stream"):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._upload_path(upload_id))
+        return upload_id
+
+    def presign_upload_part(self, container, blob_name, upload_id, part_number, expiry=timedelta(hours=1)):
+        expires = int(time.time() + expiry.total_seconds())
+        query = urlencode({
+            "upload_id": upload_id,
+            "part_number": part_number,
+            "expires": expires,
+            "signature": self.signature(container, blob_name, expires, "PUT", upload_id, part_number)
+        })
+        return f"{self.base_url}{LOCAL_BLOB_ROUTE}/{quote(container)}/{quote(blob_name)}?{query}"
+
+    def put_part(self, container, blob_name, upload_id, part_number, stream, length=None):
+        """Store one part, from the server or PUT to a presigned part URL; a part sent again replaces the earlier copy."""
+        part_path = self._part_path(upload_id, part_number)
+        if not os.path.isdir(os.path.dirname(part_path)):
+            raise FileNotFoundError(f"Unknown upload: {upload_id}")
+        partial_path = f"{part_path}.{secrets.token_hex(4)}.partial"
+        with open(partial_path, "wb") as file:
+            shutil.copyfileobj(stream, file, LOCAL_COPY_BUFFER)
+        os.replace(partial_path, part_path)
+
+    def list_parts(self, container, blob_name, upload_id):
+        upload_path = self._upload_path(upload_id)
+        if not os.path.isdir(upload_path):
+            return {}
+        return {
+            int(file_name): os.path.getsize(os.path.join(upload_path, file_name))
+            for file_name in os.listdir(upload_path) if file_name.isdigit()
+        }
+
+    def complete_multipart_upload(self, container, blob_name, upload_id, part_count):
+        part_paths = [self._part_path(upload_id, part_number) for part_number in range(1, part_count + 1)]
+        missing = [part_number for part_number, part_path in enumerate(part_paths, 1) if not os.path.isfile(part_path)]
+        if missing:
+            raise ValueError(f"Parts not uploaded: {missing[:10]}")
+        path = self._target_path(container, blob_name)
+        partial_path = f"{path}.{secrets.token_hex(4)}.partial"
+        with open(partial_path, "wb") as file:
+            for part_path in part_paths:
+                with open(part_path, "rb") as part:
+                    shutil.copyfileobj(part, file, LOCAL_COPY_BUFFER)
+        os.replace(partial_path, path)
+        shutil.rmtree(self._upload_path(upload_id), ignore_errors=True)
+
+    def abort_multipart_upload(self, container, blob_name, upload_id):
+        shutil.rmtree(self._upload_path(upload_id), ignore_errors=True)
+
+    def locate(self, url):
+        parts = urlsplit(url)
+        prefix = urlsplit(self.base_url).path + LOCAL_BLOB_ROUTE + "/"
+        if f"{parts.scheme}://{parts.netloc}" != f"{urlsplit(self.base_url).scheme}://{urlsplit(self.base_url).netloc}" or not parts.path.startswith(prefix):
+            return None
+        container, _, blob_name = parts.path[len(prefix):].partition("/")
+        if not container or not blob_name:
+            return None
+        return unquote(container), unquote(blob_name)
+
+
+BLOB_STORES = {AZURE_STORE: AzureBlobStore, MINIO_STORE: MinioBlobStore, LOCAL_STORE: LocalBlobStore}
+
+
+@lru_cache(maxsize=None)
+def get_blob_store(name: Optional[str] = None) -> BlobStore:
+    """
+    The blob store of this deployment, or the store called name (e.g. the one a deferred deletion was scheduled in).
+    BLOB_STORE selects azure, minio or local; by default it follows ON_PREMISES_MODE.
+    """
+    if name is None:
+        name = os.getenv("BLOB_STORE") or (AZURE_STORE if os.getenv("ON_PREMISES_MODE") == OnPremiseMode.ON_CLOUD.value else MINIO_STORE)
+    if name not in BLOB_STORES:
+        raise ValueError(f"Unknown blob store: {name}")
+    return BLOB_STORES[name]()
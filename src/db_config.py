@@ -1,6 +1,10 @@
 import os
 from dotenv import load_dotenv
+from functools import lru_cache
 from typing import Optional
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
 from src.enums import OnPremiseMode
 
 # Load environment variables
@@ -12,4 +16,50 @@ def get_database_url() -> Optional[str]:
         return os.getenv("AZURE_POSTGRES_CONNECTION")
     elif on_premises_mode == OnPremiseMode.ON_PREMISES.value:
         return os.getenv("ON_PREMISES_POSTGRES_CONNECTION")
-    return None 
\ No newline at end of file
+    return None
+
+def get_embedding_precision() -> str:
+    """
+    Storage precision of voiceprint embeddings, must match the database column:
+    float32 stores pgvector `vector`, float16 stores `halfvec` (see migrations/003_voiceprint_halfvec.sql).
+    """
+    precision = os.getenv("VOICEPRINT_EMBEDDING_PRECISION", "float32")
+    if precision not in ("float32", "float16"):
+        raise ValueError(f"VOICEPRINT_EMBEDDING_PRECISION must be float32 or float16, got {precision}")
+    return precision
+
+def get_async_database_url() -> Optional[str]:
+    """
+    Same database as get_database_url(), but addressed through the asyncpg driver.
+    asyncpg does not understand libpq's sslmode, so it is passed on as ssl.
+    """
+    database_url = get_database_url()
+    if not database_url:
+        return None
+
+    url = make_url(database_url).set(drivername="postgresql+asyncpg")
+    sslmode = url.query.get("sslmode")
+    if sslmode:
+        url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": sslmode})
+    return url.render_as_string(hide_password=False)
+
+@lru_cache(maxsize=1)
+def get_async_engine() -> AsyncEngine:
+    """
+    Process wide async engine.
+
+    Flask runs every `async def` view in a fresh event loop, and asyncpg connections cannot move between loops,
+    so pooling is off by default. Set ASYNC_DB_POOL_SIZE when serving from a single loop (e.g. uvicorn).
+    """
+    pool_size = int(os.getenv("ASYNC_DB_POOL_SIZE", "0"))
+    if pool_size > 0:
+        return create_async_engine(get_async_database_url(), pool_size=pool_size, pool_pre_ping=True)
+    return create_async_engine(get_async_database_url(), poolclass=NullPool)
+
+def get_async_session() -> AsyncSession:
+    """Open a new AsyncSession, to be used as `async with get_async_session() as session:`"""
+    return _get_async_session_maker()()
+
+@lru_cache(maxsize=1)
+def _get_async_session_maker() -> async_sessionmaker:
+    return async_sessionmaker(get_async_engine(), expire_on_commit=False)
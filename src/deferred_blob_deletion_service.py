@@ -0,0 +1,199 @@
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from typing import Callable, Optional, Sequence
+from sqlalchemy import create_engine, select, update, or_
+from sqlalchemy.orm import sessionmaker
+
+from src.models import DeferredBlobDeletion
+from src.db_config import get_database_url
+from src.blob_store import get_blob_store, AZURE_STORE, MINIO_STORE, LOCAL_STORE
+
+# Load environment variables
+load_dotenv()
+
+# Storage column values are blob store names
+AZURE_STORAGE = AZURE_STORE
+MINIO_STORAGE = MINIO_STORE
+LOCAL_STORAGE = LOCAL_STORE
+
+# Temporary blobs are deleted after this long even if their operation never reports done
+TEMP_BLOB_TTL = timedelta(minutes=int(os.getenv("TEMP_BLOB_TTL_MINUTES", "180")))
+# How often the scheduler looks for due deletions, and how often an operation is asked whether it is done
+DEFERRED_DELETION_INTERVAL_SECONDS = int(os.getenv("DEFERRED_DELETION_INTERVAL_SECONDS", "30"))
+OPERATION_CHECK_INTERVAL = timedelta(seconds=60)
+DEFERRED_DELETION_BATCH_SIZE = 50
+DEFERRED_DELETION_MAX_ATTEMPTS = 5
+# A claimed batch whose results were not recorded by then, e.g. its worker died, is claimed again
+DEFERRED_DELETION_LEASE = timedelta(minutes=5)
+
+DATABASE_URL = get_database_url()
+
+# Create database engine
+engine = create_engine(DATABASE_URL, connect_args={'client_encoding': 'utf8'})
+Session = sessionmaker(bind=engine)
+
+_scheduler_lock = threading.Lock()
+_scheduler_started = False
+
+
+def schedule_blob_deletion(storage: str, blob_name: str, bucket: Optional[str] = None,
+                           operation_id: Optional[str] = None, ttl: timedelta = TEMP_BLOB_TTL) -> None:
+    """
+    Queue a temporary blob for deletion by the background scheduler.
+
+    Args:
+        storage: Name of the blob store, e.g. AZURE_STORAGE or MINIO_STORAGE
+        blob_name: Name of the blob
+        bucket: Container of the blob; Azure keeps every blob in its one container
+        operation_id: Operation still reading the blob, the blob is deleted as soon as it reports done
+        ttl: Delete the blob after this long at the latest, timedelta(0) deletes it on the next run
+    """
+    now = datetime.now()
+    with Session() as session:
+        session.add(DeferredBlobDeletion(
+            storage=storage,
+            bucket=bucket,
+            blob_name=blob_name,
+            operation_id=operation_id,
+            delete_after=now + ttl,
+            next_check_dt=now
+        ))
+        session.commit()
+
+
+def delete_blob(storage: str, blob_name: str, bucket: Optional[str] = None) -> bool:
+    try:
+        get_blob_store(storage).delete(bucket, blob_name)
+        print(f"Blob '{blob_name}' deleted successfully.")
+        return True
+    except Exception as e:
+        print(f"An error occurred while deleting the blob: {e}")
+        return False
+
+
+def claim_due_deletions(now: datetime) -> list:
+    """
+    Claim a batch of due deletions by moving their next check past DEFERRED_DELETION_LEASE, and commit.
+    Rows are locked with SKIP LOCKED only for the claim, so schedulers of several workers never handle the same blob,
+    and a scheduler that dies before recording its results leaves the rows to be claimed again once the lease ends.
+    """
+    with Session() as session:
+        deletions = session.execute(
+            select(DeferredBlobDeletion)
+            .where(
+                DeferredBlobDeletion.status == "pending",
+                or_(DeferredBlobDeletion.next_check_dt.is_(None), DeferredBlobDeletion.next_check_dt <= now)
+            )
+            .order_by(DeferredBlobDeletion.next_check_dt)
+            .limit(DEFERRED_DELETION_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+
+        claimed = []
+        for deletion in deletions:
+            claimed.append({
+                "sys_id": deletion.sys_id,
+                "storage": deletion.storage,
+                "bucket": deletion.bucket,
+                "blob_name": deletion.blob_name,
+                "operation_id": deletion.operation_id,
+                "delete_after": deletion.delete_after,
+                "attempts": deletion.attempts,
+            })
+            deletion.next_check_dt = now + DEFERRED_DELETION_LEASE
+        session.commit()
+        return claimed
+
+
+def run_due_deletions(operation_done: Optional[Callable[[str], bool]] = None) -> int:
+    """
+    Delete the pending blobs whose TTL passed or whose operation is done.
+    The batch is claimed first; operations are checked and blobs deleted outside any transaction,
+    then the outcome of every row is recorded.
+
+    Args:
+        operation_done: Tells whether an operation no longer needs its blob; without it blobs wait for their TTL
+
+    Returns:
+        int: Number of blobs deleted
+    """
+    now = datetime.now()
+    outcomes = {}
+    for deletion in claim_due_deletions(now):
+        is_due = now >= deletion["delete_after"]
+        if not is_due and deletion["operation_id"] and operation_done is not None:
+            try:
+                is_due = operation_done(deletion["operation_id"])
+            except Exception as e:
+                print(f"Failed to check operation {deletion['operation_id']}: {e}")
+        if not is_due:
+            outcomes[deletion["sys_id"]] = {"next_check_dt": min(now + OPERATION_CHECK_INTERVAL, deletion["delete_after"])}
+            continue
+
+        attempts = deletion["attempts"] + 1
+        if delete_blob(deletion["storage"], deletion["blob_name"], deletion["bucket"]):
+            outcomes[deletion["sys_id"]] = {"attempts": attempts, "status": "deleted", "deleted_dt": datetime.now()}
+        elif attempts >= DEFERRED_DELETION_MAX_ATTEMPTS:
+            outcomes[deletion["sys_id"]] = {"attempts": attempts, "status": "failed", "error_message": f"Not deleted after {attempts} attempts"}
+        else:
+            # Back off, the storage may be briefly unavailable
+            outcomes[deletion["sys_id"]] = {"attempts": attempts, "next_check_dt": now + timedelta(seconds=DEFERRED_DELETION_INTERVAL_SECONDS * 2 ** attempts)}
+
+    with Session() as session:
+        for sys_id, values in outcomes.items():
+            session.execute(update(DeferredBlobDeletion).where(DeferredBlobDeletion.sys_id == sys_id).values(**values))
+        session.commit()
+    return sum(1 for values in outcomes.values() if values.get("status") == "deleted")
+
+
+def run_deferred_blob_deletion(operation_done: Optional[Callable[[str], bool]] = None,
+                               sweeps: Sequence[Callable[[], int]] = ()) -> None:
+    """
+    Run the scheduler loop in the calling thread.
+
+    Args:
+        operation_done: See run_due_deletions
+        sweeps: Other cleanups run on every pass, e.g. expiring abandoned uploads; each returns how many items it cleaned
+    """
+    while True:
+        try:
+            deleted_count = run_due_deletions(operation_done)
+            if deleted_count:
+                print(f"Deleted {deleted_count} temporary blob(s)")
+        except Exception as e:
+            print(f"Deferred blob deletion failed: {e}")
+        for sweep in sweeps:
+            try:
+                swept_count = sweep()
+                if swept_count:
+                    print(f"{sweep.__name__}: cleaned up {swept_count} item(s)")
+            except Exception as e:
+                print(f"{sweep.__name__} failed: {e}")
+        time.sleep(DEFERRED_DELETION_INTERVAL_SECONDS)
+
+
+def start_deferred_blob_deletion(operation_done: Optional[Callable[[str], bool]] = None,
+                                 sweeps: Sequence[Callable[[], int]] = ()) -> None:
+    """
+    Start the background scheduler of this process, once.
+    Called from the gunicorn worker hook in gunicorn.conf.py or `python app.py`, never on import, so CLIs,
+    migrations and tests importing the app do not start it.
+    """
+    global _scheduler_started
+    with _scheduler_lock:
+        if _scheduler_started:
+            return
+        _scheduler_started = True
+
+    threading.Thread(target=run_deferred_blob_deletion, args=(operation_done, sweeps), name="deferred-blob-deletion", daemon=True).start()
+
+
+if __name__ == '__main__':
+    # Run the scheduler as its own process instead of in the web workers: python -m src.deferred_blob_deletion_service
+    from src.fanolab_service import is_fanolab_operation_done
+    from src.upload_session_service import expire_upload_sessions
+
+    run_deferred_blob_deletion(operation_done=is_fanolab_operation_done, sweeps=(expire_upload_sessions,))
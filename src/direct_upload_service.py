@@ -0,0 +1,168 @@
+import os
+import re
+import hmac
+import json
+import math
+import uuid
+import base64
+import hashlib
+from datetime import timedelta
+from dotenv import load_dotenv
+from typing import Optional
+
+from src.blob_store import get_blob_store, MEDIA_CONTAINER
+from src.blob_storage_service import BLOB_UPLOAD_PART_SIZE
+
+# Load environment variables
+load_dotenv()
+
+# Recordings are sent by the browser straight to blob storage as a multipart upload; the backend only signs the parts
+DIRECT_UPLOAD_EXTENSIONS = {"mp4": "video/mp4", "wav": "audio/wav"}
+DIRECT_UPLOAD_MAX_PARTS = 10000  # S3 / MinIO limit of parts per upload
+DIRECT_UPLOAD_MIN_PART_SIZE = 5 * 1024 * 1024  # S3 / MinIO minimum size of every part but the last
+DIRECT_UPLOAD_CONCURRENCY = int(os.getenv("DIRECT_UPLOAD_CONCURRENCY", "4"))  # Parts / session chunks clients send at a time
+DIRECT_UPLOAD_URL_TTL = timedelta(hours=int(os.getenv("DIRECT_UPLOAD_URL_TTL_HOURS", "6")))
+MEDIA_URL_TTL = timedelta(days=365)  # As /upload/file, MinIO caps it at 7 days
+MEDIA_BLOB_NAME = re.compile(r"^media/[0-9a-f-]{36}\.(mp4|wav)$")
+# Signs the size and part size of a direct upload, so completing it does not rely on what the client reports
+DIRECT_UPLOAD_SECRET = os.getenv("DIRECT_UPLOAD_SECRET")
+
+
+def plan_part_size(size: int) -> int:
+    """BLOB_UPLOAD_PART_SIZE, or whole MiB more when the file would otherwise need more than DIRECT_UPLOAD_MAX_PARTS parts."""
+    part_size = max(BLOB_UPLOAD_PART_SIZE, DIRECT_UPLOAD_MIN_PART_SIZE)
+    if math.ceil(size / part_size) > DIRECT_UPLOAD_MAX_PARTS:
+        part_size = math.ceil(size / DIRECT_UPLOAD_MAX_PARTS / (1024 * 1024)) * 1024 * 1024
+    return part_size
+
+
+def _upload_signature(upload_id: str, blob_name: str, payload: str) -> str:
+    message = f"{upload_id}\n{blob_name}\n{payload}".encode("utf-8")
+    return hmac.new(DIRECT_UPLOAD_SECRET.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def sign_upload(upload_id: str, blob_name: str, size: int, part_size: int) -> str:
+    """The upload_token of a direct upload: its size and part size, signed together with its upload id and blob name."""
+    payload = base64.urlsafe_b64encode(json.dumps({"size": size, "part_size": part_size}).encode("utf-8")).decode("ascii")
+    return f"{payload}.{_upload_signature(upload_id, blob_name, payload)}"
+
+
+def read_upload_token(upload_id: str, blob_name: str, upload_token: str) -> Optional[tuple[int, int]]:
+    """(size, part size) signed by sign_upload for this upload, None when the token is not one."""
+    payload, _, signature = upload_token.partition(".")
+    if not hmac.compare_digest(signature, _upload_signature(upload_id, blob_name, payload)):
+        return None
+    plan = json.loads(base64.urlsafe_b64decode(payload))
+    return plan["size"], plan["part_size"]
+
+
+def start_direct_upload(request):
+    """
+    Start a multipart upload of a recording straight to blob storage.
+
+    Args:
+        request: Flask request object containing:
+            - filename: Name of the file, .mp4 or .wav
+            - size: Size of the file in bytes
+
+    Returns:
+        {"upload_id", "blob_name", "upload_token", "part_size", "concurrency", "parts": [{"part_number", "url"}]}; the
+        client PUTs bytes [(part_number - 1) * part_size, part_number * part_size) of the file to each url, then calls
+        /upload/direct/complete
+    """
+    if not DIRECT_UPLOAD_SECRET:
+        return {"error": "Direct uploads need DIRECT_UPLOAD_SECRET to be set"}, 500
+    data = request.get_json(silent=True) or {}
+    filename = data.get("filename") or ""
+    size = data.get("size")
+
+    file_type = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if file_type not in DIRECT_UPLOAD_EXTENSIONS:
+        return {"error": "Unsupported file type. Only MP4 and WAV files are supported."}, 400
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0:  # JSON true is an int in Python
+        return {"error": "size must be a positive number of bytes"}, 400
+
+    blob_name = f"media/{uuid.uuid4()}.{file_type}"
+    part_size = plan_part_size(size)
+    part_count = math.ceil(size / part_size)
+
+    store = get_blob_store()
+    upload_id = store.start_multipart_upload(MEDIA_CONTAINER, blob_name, DIRECT_UPLOAD_EXTENSIONS[file_type])
+    parts = [
+        {"part_number": part_number, "url": store.presign_upload_part(MEDIA_CONTAINER, blob_name, upload_id, part_number, DIRECT_UPLOAD_URL_TTL)}
+        for part_number in range(1, part_count + 1)
+    ]
+    print(f"Started direct upload of {blob_name}: {size} bytes in {part_count} part(s) of {part_size} bytes")
+    return {
+        "upload_id": upload_id,
+        "blob_name": blob_name,
+        "upload_token": sign_upload(upload_id, blob_name, size, part_size),
+        "part_size": part_size,
+        "concurrency": DIRECT_UPLOAD_CONCURRENCY,
+        "parts": parts,
+    }
+
+
+def _read_upload(request):
+    data = request.get_json(silent=True) or {}
+    upload_id = data.get("upload_id")
+    blob_name = data.get("blob_name") or ""
+    if not upload_id or not isinstance(upload_id, str):
+        return None, ({"error": "upload_id is required"}, 400)
+    if not MEDIA_BLOB_NAME.match(blob_name):
+        return None, ({"error": "blob_name must be the one returned by /upload/direct"}, 400)
+    return (data, upload_id, blob_name), None
+
+
+def complete_direct_upload(request):
+    """
+    Completion callback of a direct upload: join the uploaded parts into the recording.
+
+    Args:
+        request: Flask request object containing:
+            - upload_id, blob_name, upload_token: As returned by /upload/direct
+
+    Returns:
+        {"sas_url"} of the recording, as /upload/file returns
+    """
+    upload, error = _read_upload(request)
+    if error:
+        return error
+    data, upload_id, blob_name = upload
+    upload_token = data.get("upload_token")
+    plan = None
+    if DIRECT_UPLOAD_SECRET and isinstance(upload_token, str):
+        try:
+            plan = read_upload_token(upload_id, blob_name, upload_token)
+        except (TypeError, ValueError):
+            pass  # Not ASCII, base64 or JSON, a forged token
+    if plan is None:
+        return {"error": "upload_token must be the one returned by /upload/direct"}, 400
+    size, part_size = plan
+    part_count = math.ceil(size / part_size)
+
+    store = get_blob_store()
+    try:
+        # Every part but the last is part_size bytes, so the recording has the size the upload was started with
+        uploaded = store.list_parts(MEDIA_CONTAINER, blob_name, upload_id)
+        wrong_parts = [
+            part_number for part_number in range(1, part_count + 1)
+            if uploaded.get(part_number) != min(part_size, size - (part_number - 1) * part_size)
+        ]
+        if wrong_parts:
+            return {"error": f"Parts missing or of the wrong size: {wrong_parts[:10]}"}, 400
+        store.complete_multipart_upload(MEDIA_CONTAINER, blob_name, upload_id, part_count)
+    except Exception as e:
+        print(f"Failed to complete direct upload of {blob_name}: {e}")
+        return {"error": f"Failed to complete upload: {e}"}, 400
+    return {"sas_url": store.presign(MEDIA_CONTAINER, blob_name, MEDIA_URL_TTL)}
+
+
+def abort_direct_upload(request):
+    """Discard the parts of a direct upload the client gave up on."""
+    upload, error = _read_upload(request)
+    if error:
+        return error
+    _, upload_id, blob_name = upload
+    get_blob_store().abort_multipart_upload(MEDIA_CONTAINER, blob_name, upload_id)
+    return {"aborted": True}
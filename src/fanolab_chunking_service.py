@@ -0,0 +1,306 @@
+import os
+import uuid
+from datetime import timedelta
+from dotenv import load_dotenv
+from typing import Optional
+import numpy as np
+import librosa
+import soundfile
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from src.models import FanolabChunkedJob
+from src.db_config import get_database_url
+from src.voiceprint_library_service import compute_embedding
+from src.silence_removal_service import OffsetMap, remap_alternative
+
+# Load environment variables
+load_dotenv()
+
+# Long recordings are cut at quiet points into chunks of about this length, transcribed by Fanolab in parallel
+FANOLAB_CHUNK_SECONDS = int(os.getenv("FANOLAB_CHUNK_SECONDS", "900"))
+# Audio shared by neighbouring chunks, so words at a cut are heard whole by both
+FANOLAB_CHUNK_OVERLAP_SECONDS = float(os.getenv("FANOLAB_CHUNK_OVERLAP_SECONDS", "10"))
+FANOLAB_CHUNK_WORKERS = int(os.getenv("FANOLAB_CHUNK_WORKERS", "8"))  # Chunks uploaded and submitted at a time
+# Chunk-local speakers whose voiceprints are at least this similar are the same global speaker
+FANOLAB_CHUNK_SPEAKER_THRESHOLD = float(os.getenv("FANOLAB_CHUNK_SPEAKER_THRESHOLD", "0.75"))
+# The converted recording is kept in blob storage to reconcile speakers once every chunk is done, deleted after stitching
+FANOLAB_CHUNK_AUDIO_TTL = timedelta(hours=int(os.getenv("FANOLAB_CHUNK_AUDIO_TTL_HOURS", "24")))
+
+CHUNKED_JOB_PREFIX = "chunked-"
+CHUNK_SEARCH_SECONDS = 60  # A cut is placed at the quietest point within this many seconds of the target length
+ENERGY_FRAME_SECONDS = 0.03
+QUIET_WINDOW_SECONDS = 0.5  # Energy is averaged over this long, so a cut lands in a pause rather than between syllables
+ENERGY_READ_FRAMES = 2000  # Energy frames decoded per read
+EMBEDDING_SEGMENTS = 3  # Longest segments of a chunk-local speaker used for its voiceprint
+EMBEDDING_MAX_SECONDS = 30
+EMBEDDING_SAMPLE_RATE = 16000
+
+DATABASE_URL = get_database_url()
+
+# Create database engine
+engine = create_engine(DATABASE_URL, connect_args={'client_encoding': 'utf8'})
+Session = sessionmaker(bind=engine)
+
+
+def is_chunked_job_id(fanolab_id: str) -> bool:
+    return bool(fanolab_id) and fanolab_id.startswith(CHUNKED_JOB_PREFIX)
+
+
+def is_long_enough_to_chunk(duration_seconds: float) -> bool:
+    """Shorter recordings would end up as a single chunk and are submitted as they are."""
+    return duration_seconds > FANOLAB_CHUNK_SECONDS + CHUNK_SEARCH_SECONDS
+
+
+def frame_energies(wav_path: str) -> np.ndarray:
+    """RMS energy of each ENERGY_FRAME_SECONDS frame of the recording, read in blocks rather than decoded at once."""
+    with soundfile.SoundFile(wav_path) as meeting:
+        frame_length = max(1, int(meeting.samplerate * ENERGY_FRAME_SECONDS))
+        energies = []
+        for block in meeting.blocks(blocksize=frame_length * ENERGY_READ_FRAMES, dtype="float32", always_2d=True):
+            mono = block.mean(axis=1)
+            frame_count = len(mono) // frame_length
+            if frame_count:
+                frames = mono[:frame_count * frame_length].reshape(frame_count, frame_length)
+                energies.append(np.sqrt(np.mean(frames ** 2, axis=1)))
+    return np.concatenate(energies) if energies else np.zeros(0, dtype=np.float32)
+
+
+def find_split_points(energies: np.ndarray, duration_seconds: float, chunk_seconds: float = FANOLAB_CHUNK_SECONDS,
+                      search_seconds: float = CHUNK_SEARCH_SECONDS) -> list:
+    """
+    Seconds at which to cut the recording: every cut is the quietest point within search_seconds of chunk_seconds
+    after the previous cut, so chunks end in pauses instead of mid-sentence.
+    """
+    window = max(1, int(QUIET_WINDOW_SECONDS / ENERGY_FRAME_SECONDS))
+    smoothed = np.convolve(energies, np.ones(window) / window, mode="same")
+
+    cuts = []
+    position = 0.0
+    while duration_seconds - position > chunk_seconds + search_seconds:
+        target = position + chunk_seconds
+        first_frame = int((target - search_seconds) / ENERGY_FRAME_SECONDS)
+        last_frame = min(int((target + search_seconds) / ENERGY_FRAME_SECONDS), len(smoothed))
+        if first_frame >= last_frame:
+            cut = target  # Energy frames shorter than the header claims, cut at the target
+        else:
+            cut = (first_frame + int(np.argmin(smoothed[first_frame:last_frame])) + 0.5) * ENERGY_FRAME_SECONDS
+        cuts.append(cut)
+        position = cut
+    return cuts
+
+
+def plan_chunks(wav_path: str, duration_seconds: float, overlap_seconds: float = FANOLAB_CHUNK_OVERLAP_SECONDS) -> list:
+    """
+    Split a recording into overlapping chunks. Each chunk keeps the segments whose midpoint falls between its cuts
+    and carries half the overlap of audio on either side of them.
+
+    Returns:
+        list: {"audio_start", "audio_end", "keep_start", "keep_end"} in seconds of the recording, in time order
+    """
+    boundaries = [0.0, *find_split_points(frame_energies(wav_path), duration_seconds), duration_seconds]
+    padding = overlap_seconds / 2
+    return [
+        {
+            "audio_start": max(0.0, keep_start - padding),
+            "audio_end": min(duration_seconds, keep_end + padding),
+            "keep_start": keep_start,
+            "keep_end": keep_end,
+        }
+        for keep_start, keep_end in zip(boundaries[:-1], boundaries[1:])
+    ]
+
+
+def write_chunk(wav_path: str, chunk: dict, output_path: str, file_format: str = "WAV") -> None:
+    """Write the audio of a chunk as 16-bit PCM in file_format (WAV or FLAC) with the recording's sample rate and channels."""
+    with soundfile.SoundFile(wav_path) as meeting:
+        start = int(chunk["audio_start"] * meeting.samplerate)
+        stop = min(int(chunk["audio_end"] * meeting.samplerate), meeting.frames)
+        meeting.seek(start)
+        samples = meeting.read(stop - start, dtype="int16", always_2d=True)
+        soundfile.write(output_path, samples, meeting.samplerate, format=file_format, subtype="PCM_16")
+
+
+def new_chunked_job_id() -> str:
+    return f"{CHUNKED_JOB_PREFIX}{uuid.uuid4().hex}"
+
+
+def create_chunked_job(job_id: str, source_url: str, sample_rate: int, duration_seconds: float, chunks: list,
+                       audio_store: Optional[str] = None, audio_blob: Optional[str] = None) -> None:
+    """
+    Args:
+        chunks: The planned chunks, each with the "operation_id" of its Fanolab submission
+        audio_store, audio_blob: The converted recording kept in TEMP_AUDIO_CONTAINER for stitching
+    """
+    with Session() as session:
+        session.add(FanolabChunkedJob(
+            job_id=job_id,
+            source_url=source_url,
+            sample_rate=sample_rate,
+            duration_seconds=duration_seconds,
+            chunks=chunks,
+            audio_store=audio_store,
+            audio_blob=audio_blob
+        ))
+        session.commit()
+
+
+def get_chunked_job(job_id: str) -> Optional[dict]:
+    with Session() as session:
+        job = session.execute(select(FanolabChunkedJob).where(FanolabChunkedJob.job_id == job_id)).scalar()
+        if job is None:
+            return None
+        return {
+            "job_id": job.job_id,
+            "source_url": job.source_url,
+            "sample_rate": job.sample_rate,
+            "duration_seconds": job.duration_seconds,
+            "chunks": job.chunks,
+            "audio_store": job.audio_store,
+            "audio_blob": job.audio_blob,
+        }
+
+
+def _parse_time(value) -> float:
+    """Fanolab times are strings with a trailing "s", e.g. "10.420s"."""
+    try:
+        return float(str(value).rstrip("s"))
+    except ValueError:
+        return 0.0
+
+
+def _shift_time(value, offset: float) -> str:
+    return f"{_parse_time(value) + offset:.3f}s"
+
+
+def stitch_chunk_results(chunks: list, chunk_operations: list) -> list:
+    """
+    Put the results of every chunk on the recording's timeline and drop the copies heard in the overlaps:
+    a segment belongs to the chunk whose cuts its midpoint falls between.
+
+    Returns:
+        list: (chunk index, chunk-local speaker tag, shifted alternative) in time order
+    """
+    stitched = []
+    for index, (chunk, operation) in enumerate(zip(chunks, chunk_operations)):
+        offset = chunk["audio_start"]
+        for result in operation.get("response", {}).get("results", []):
+            alternatives = result.get("alternatives", [])
+            if not alternatives or alternatives[0].get("speakerTag") is None:
+                continue
+            alternative = dict(alternatives[0])
+            start = _parse_time(alternative.get("startTime", "0s")) + offset
+            end = _parse_time(alternative.get("endTime", "0s")) + offset
+            if not chunk["keep_start"] <= (start + end) / 2 < chunk["keep_end"]:
+                continue
+
+            alternative["startTime"] = f"{start:.3f}s"
+            alternative["endTime"] = f"{end:.3f}s"
+            if alternative.get("words"):
+                alternative["words"] = [
+                    {**word, "startTime": _shift_time(word.get("startTime", "0s"), offset), "endTime": _shift_time(word.get("endTime", "0s"), offset)}
+                    for word in alternative["words"]
+                ]
+            stitched.append((index, str(alternative["speakerTag"]), alternative))
+    stitched.sort(key=lambda item: _parse_time(item[2]["startTime"]))
+    return stitched
+
+
+def _speaker_embedding(meeting: soundfile.SoundFile, segments: list) -> Optional[np.ndarray]:
+    """Unit voiceprint of a chunk-local speaker from their longest segments, None when it cannot be computed."""
+    samples = []
+    remaining = EMBEDDING_MAX_SECONDS
+    for start, end in sorted(segments, key=lambda segment: segment[0] - segment[1])[:EMBEDDING_SEGMENTS]:
+        length = min(end - start, remaining)
+        if length <= 0:
+            break
+        meeting.seek(min(int(start * meeting.samplerate), meeting.frames))
+        samples.append(meeting.read(int(length * meeting.samplerate), dtype="float32", always_2d=True).mean(axis=1))
+        remaining -= length
+    if not samples:
+        return None
+
+    audio = np.concatenate(samples)
+    if meeting.samplerate != EMBEDDING_SAMPLE_RATE:
+        audio = librosa.resample(audio, orig_sr=meeting.samplerate, target_sr=EMBEDDING_SAMPLE_RATE, res_type="polyphase")
+    try:
+        embedding = np.asarray(compute_embedding(audio), dtype=np.float32)
+    except Exception as e:
+        print(f"Failed to compute chunk speaker voiceprint: {e}")
+        return None
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm > 0 else None
+
+
+def reconcile_speakers(stitched: list, wav_path: str, threshold: float = FANOLAB_CHUNK_SPEAKER_THRESHOLD) -> dict:
+    """
+    Map chunk-local speaker tags to global speakers by voiceprint. Chunks are visited in time order and their speakers
+    matched greedily, most similar pair first, to the global speakers found so far. Speakers of one chunk were told
+    apart by Fanolab and never share a global speaker; unmatched speakers become new global speakers.
+
+    Returns:
+        dict: (chunk index, local tag) -> global speaker number, numbered from 1 by first appearance
+    """
+    segments = {}
+    for index, tag, alternative in stitched:
+        segments.setdefault((index, tag), []).append((_parse_time(alternative["startTime"]), _parse_time(alternative["endTime"])))
+
+    with soundfile.SoundFile(wav_path) as meeting:
+        embeddings = {speaker: _speaker_embedding(meeting, speaker_segments) for speaker, speaker_segments in segments.items()}
+
+    centroids = []  # Sum of the unit voiceprints of each global speaker, None for speakers without one
+    assignment = {}
+    for chunk_index in sorted({index for index, _ in segments}):
+        local_speakers = [speaker for speaker in segments if speaker[0] == chunk_index]
+        matchable = [speaker for speaker in local_speakers if embeddings[speaker] is not None]
+        candidates = [global_index for global_index, centroid in enumerate(centroids) if centroid is not None]
+
+        if matchable and candidates:
+            unit_centroids = np.stack([centroids[global_index] / np.linalg.norm(centroids[global_index]) for global_index in candidates])
+            similarity = np.stack([embeddings[speaker] for speaker in matchable]) @ unit_centroids.T
+            taken = set()
+            for flat_index in np.argsort(-similarity, axis=None):
+                row, column = np.unravel_index(flat_index, similarity.shape)
+                if similarity[row, column] < threshold:
+                    break
+                if matchable[row] in assignment or column in taken:
+                    continue
+                assignment[matchable[row]] = candidates[column]
+                taken.add(column)
+
+        for speaker in local_speakers:
+            if speaker in assignment:
+                centroids[assignment[speaker]] = centroids[assignment[speaker]] + embeddings[speaker]
+            else:
+                assignment[speaker] = len(centroids)
+                centroids.append(embeddings[speaker])
+
+    # Number global speakers by first appearance
+    numbers = {}
+    for index, tag, _ in stitched:
+        numbers.setdefault(assignment[(index, tag)], len(numbers) + 1)
+    return {speaker: numbers[global_index] for speaker, global_index in assignment.items()}
+
+
+def build_chunked_operation(job: dict, chunk_operations: list, wav_path: str, offset_map: Optional[OffsetMap] = None) -> dict:
+    """
+    The done operations of every chunk as one Fanolab-shaped operation on the recording's timeline with global
+    speaker tags, read by the rest of the backend exactly like a single Fanolab operation.
+
+    Args:
+        offset_map: Set when the chunks were cut from audio without its silences, maps their times back onto wav_path
+    """
+    stitched = stitch_chunk_results(job["chunks"], chunk_operations)
+    if offset_map:
+        stitched = [(index, tag, remap_alternative(alternative, offset_map)) for index, tag, alternative in stitched]
+    speakers = reconcile_speakers(stitched, wav_path)
+    results = [
+        {"alternatives": [{**alternative, "speakerTag": str(speakers[(index, tag)])}]}
+        for index, tag, alternative in stitched
+    ]
+    return {
+        "name": f"operations/{job['job_id']}",
+        "done": True,
+        "metadata": {"chunks": len(job["chunks"]), "speakers": len(set(speakers.values()))},
+        "response": {"results": results},
+    }
@@ -0,0 +1,71 @@
+import os
+import json
+import zlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from typing import Optional
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import sessionmaker
+
+from src.models import FanolabOperationCache
+from src.db_config import get_database_url
+
+# Load environment variables
+load_dotenv()
+
+# Done Fanolab operations never change: their payloads are kept zlib compressed in memory and in Postgres
+FANOLAB_OPERATION_CACHE_SIZE = int(os.getenv("FANOLAB_OPERATION_CACHE_SIZE", "32"))  # Payloads kept in memory
+COMPRESSION_LEVEL = 6
+
+DATABASE_URL = get_database_url()
+
+# Create database engine
+engine = create_engine(DATABASE_URL, connect_args={'client_encoding': 'utf8'})
+Session = sessionmaker(bind=engine)
+
+_cache_lock = threading.Lock()
+_operations = OrderedDict()  # fanolab_id -> compressed payload
+
+
+def _remember(fanolab_id: str, payload: bytes) -> None:
+    with _cache_lock:
+        _operations[fanolab_id] = payload
+        _operations.move_to_end(fanolab_id)
+        while len(_operations) > FANOLAB_OPERATION_CACHE_SIZE:
+            _operations.popitem(last=False)
+
+
+def get_cached_operation(fanolab_id: str) -> Optional[dict]:
+    """The payload of a done operation from memory, or from Postgres into memory; None when it is not cached."""
+    with _cache_lock:
+        payload = _operations.get(fanolab_id)
+        if payload is not None:
+            _operations.move_to_end(fanolab_id)
+
+    if payload is None:
+        with Session() as session:
+            payload = session.execute(
+                select(FanolabOperationCache.payload).where(FanolabOperationCache.fanolab_id == fanolab_id)
+            ).scalar()
+        if payload is None:
+            return None
+        _remember(fanolab_id, payload)
+
+    return json.loads(zlib.decompress(payload))
+
+
+def cache_operation(fanolab_id: str, operation: dict) -> None:
+    """Keep the payload of a done operation; the first stored payload wins, they are identical."""
+    raw = json.dumps(operation, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    payload = zlib.compress(raw, COMPRESSION_LEVEL)
+    _remember(fanolab_id, payload)
+
+    with Session() as session:
+        session.execute(
+            insert(FanolabOperationCache)
+            .values(fanolab_id=fanolab_id, payload=payload, payload_size=len(raw))
+            .on_conflict_do_nothing(index_elements=["fanolab_id"])
+        )
+        session.commit()
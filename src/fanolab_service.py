@@ -1,20 +1,33 @@
 ﻿import os
 from dotenv import load_dotenv
-import requests
-import time
-from collections import defaultdict
+from datetime import timedelta
 from pydub import AudioSegment
 from flask import Flask, request, jsonify, send_from_directory
 from typing import Optional
-from src.azure_service import azure_upload_file_and_get_sas_url, azure_delete_blob
-from src.blob_storage_service import minio_upload_and_share, minio_delete_blob
-from src.enums import OnPremiseMode
-from src.utilities import format_time, mp4_to_wav_file, extract_audio_segment
-from src.voiceprint_library_service import search_voiceprint
-from src.app_owner_control_service import check_quota
+from src.blob_store import get_blob_store, TEMP_AUDIO_CONTAINER, SPEAKER_CLIP_CONTAINER
+from src.deferred_blob_deletion_service import TEMP_BLOB_TTL, schedule_blob_deletion
+from src.utilities import mp4_to_wav_file, probe_wav_header, WAVE_FORMAT_PCM
+from requests import HTTPError
+from src import http_client
+from src.fanolab_operation_cache_service import get_cached_operation, cache_operation
+from src.segment_table import SegmentTableBuilder, OUTPUT_FORMATS, render_transcript
+from src.speaker_clip_service import CLIP_FORMATS, select_speaker_clips, upload_clip_bundle
+from src.fanolab_chunking_service import (
+    FANOLAB_CHUNK_WORKERS, is_chunked_job_id, is_long_enough_to_chunk, plan_chunks, write_chunk, new_chunked_job_id,
+    FANOLAB_CHUNK_AUDIO_TTL, create_chunked_job, get_chunked_job, build_chunked_operation
+)
+from src.silence_removal_service import remove_silences, remap_operation, save_offset_map, link_offset_map, discard_offset_map, get_offset_map
+from src.voiceprint_library_service import ACTIVE_MODEL_VERSION, embed_speaker_segments, identify_speakers, rematch_stored_speakers
+from src.app_owner_control_service import check_quota, async_check_quota, refund_quota
+from src.transcription_result_service import (
+    source_key, get_transcription_results, claim_transcription_result, complete_transcription_result,
+    update_transcription_matches, release_transcription_result, needs_rematch
+)
 import uuid
-import zipfile
-import shutil
+import asyncio
+import threading
+import soundfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 
 # Load environment variables
 load_dotenv()
@@ -47,7 +60,6 @@ load_dotenv()
 #     response = requests.post("https://portal-demo.fano.ai/speech/long-running-recognize", json=payload, headers=headers)
 #     return response.json()
 
-AZURE_BLOB_NAME = 'temp_audio.wav'
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
@@ -55,106 +67,506 @@ FANOLAB_HOST = os.getenv("FANOLAB_HOST")
 FANOLAB_API_KEY = os.getenv("FANOLAB_API_KEY")
 headers = {"Authorization": f"Bearer {FANOLAB_API_KEY}", "Content-Type": "application/json"}
 
-ON_PREMISES_MODE = os.getenv("ON_PREMISES_MODE")
+# Sample rates Fanolab accepts
+FANOLAB_MIN_SAMPLE_RATE = 8000
+FANOLAB_MAX_SAMPLE_RATE = 48000
+# Upload format -> (file extension, soundfile format, Fanolab config encoding). FLAC is lossless at about half the bytes
+FANOLAB_UPLOAD_FORMATS = {
+    "wav": (".wav", "WAV", "LINEAR16"),
+    "flac": (".flac", "FLAC", "FLAC"),
+}
+FANOLAB_UPLOAD_FORMAT = os.getenv("FANOLAB_UPLOAD_FORMAT", "wav")  # Default of upload_format
+ENCODE_BLOCK_FRAMES = 1024 * 1024  # Frames encoded per read
+# Default of remove_silence: submit audio without its long silences, results are mapped back to the original timeline
+FANOLAB_REMOVE_SILENCE = os.getenv("FANOLAB_REMOVE_SILENCE", "false").lower() == "true"
 
+# Chunked job id -> lock of a stitch in progress, a job is stitched once per process
+_stitch_locks: dict[str, threading.Lock] = {}
+_stitch_locks_guard = threading.Lock()
 
-def fanolab_submit_transcription(request):
+
+def presign_source_blob(source_url: str) -> Optional[str]:
+    """A fresh read URL of source_url's blob when it is stored in this app's blob storage, otherwise None."""
+    store = get_blob_store()
+    blob = store.locate(source_url)
+    return store.presign(*blob, expiry=TEMP_BLOB_TTL) if blob else None
+
+
+def probe_direct_source(source_url: str) -> Optional[dict]:
+    """
+    Check from its header alone whether the source can be handed to Fanolab as it is: a 16-bit PCM mono WAV
+    in this app's blob storage, such as a recording uploaded through /upload/file.
+
+    Returns:
+        {"wav_url", "sample_rate", "duration_seconds"} with a presigned URL of the original blob, or None when the
+        source must be downloaded and transcoded
+    """
+    if '.wav' not in source_url.lower():
+        return None
+    wav_url = presign_source_blob(source_url)
+    if not wav_url:
+        return None
+
+    wav_header = probe_wav_header(source_url)
+    if (wav_header is None or wav_header["audio_format"] != WAVE_FORMAT_PCM or wav_header["channels"] != 1
+            or wav_header["bits_per_sample"] != 16
+            or not FANOLAB_MIN_SAMPLE_RATE <= wav_header["sample_rate"] <= FANOLAB_MAX_SAMPLE_RATE):
+        return None
+    return {"wav_url": wav_url, "sample_rate": wav_header["sample_rate"], "duration_seconds": wav_header["duration_seconds"]}
+
+
+def upload_temp_audio(file_path: str, blob_name: str) -> tuple[Optional[str], Optional[str]]:
+    """
+    Upload audio for Fanolab to read under a temporary blob name.
+
+    Returns:
+        (read URL, name of the blob store); the URL is None when the upload failed
+    """
+    store = get_blob_store()
+    try:
+        return store.put_file_and_presign(TEMP_AUDIO_CONTAINER, blob_name, file_path), store.name
+    except Exception as e:
+        print(f"Failed to upload {blob_name}: {e}")
+        return None, store.name
+
+
+def encode_upload_audio(wav_path: str, output_path: str, upload_format: str) -> None:
+    """Re-encode a local 16-bit WAV in an upload format, block by block; the sample rate and channels are kept."""
+    with soundfile.SoundFile(wav_path) as source, \
+            soundfile.SoundFile(output_path, "w", source.samplerate, source.channels, subtype="PCM_16",
+                                format=FANOLAB_UPLOAD_FORMATS[upload_format][1]) as encoded:
+        for block in source.blocks(blocksize=ENCODE_BLOCK_FRAMES, dtype="int16", always_2d=True):
+            encoded.write(block)
+
+
+def schedule_temp_audio_deletion(blob_storage: str, blob_name: str, operation_id: Optional[str]) -> None:
+    """
+    Fanolab reads the uploaded audio while transcribing: the blob is deleted in the background once the operation
+    is done or its TTL passes, right away if the submission failed.
+    """
+    try:
+        schedule_blob_deletion(
+            blob_storage, blob_name,
+            bucket=TEMP_AUDIO_CONTAINER,
+            operation_id=operation_id,
+            ttl=TEMP_BLOB_TTL if operation_id else timedelta(0)
+        )
+    except Exception as e:
+        print(f"Failed to schedule deletion of {blob_name}: {e}")
+
+
+def recognize(wav_url: str, sample_rate_hertz: int, language_code: str, enable_automatic_punctuation: bool,
+              upload_format: str = "wav"):
+    """Submit audio to Fanolab's long-running recognition, returning the response."""
+    payload = {
+        "config": {
+            "encoding": FANOLAB_UPLOAD_FORMATS[upload_format][2],
+            "languageCode": language_code,
+            "sampleRateHertz": sample_rate_hertz,
+            "maxAlternatives": 1,
+            "enableSeparateRecognitionPerChannel": False,
+            "enableAutomaticPunctuation": enable_automatic_punctuation
+        },
+        "enableWordTimeOffsets": True,
+        "diarizationConfig": {
+            "disableSpeakerDiarization": False
+        },
+        "audio": {
+            "uri": wav_url
+        }
+    }
+    return http_client.post(http_client.FANOLAB, f"{FANOLAB_HOST}/speech/long-running-recognize", json=payload, headers=headers)
+
+
+def submit_chunk(meeting_wav_path: str, chunk: dict, sample_rate_hertz: int, language_code: str, enable_automatic_punctuation: bool,
+                 upload_format: str = "wav") -> str:
+    """Cut, upload and submit one chunk of a chunked transcription, returning its Fanolab operation id."""
+    blob_name = f"fanolab_chunk_{uuid.uuid4().hex}{FANOLAB_UPLOAD_FORMATS[upload_format][0]}"
+    chunk_path = os.path.join(UPLOAD_FOLDER, blob_name)
+    blob_storage: Optional[str] = None
+    operation_id: Optional[str] = None
+    try:
+        write_chunk(meeting_wav_path, chunk, chunk_path, FANOLAB_UPLOAD_FORMATS[upload_format][1])
+        wav_url, blob_storage = upload_temp_audio(chunk_path, blob_name)
+        if not wav_url:
+            raise RuntimeError("Failed to upload audio chunk")
+
+        response = recognize(wav_url, sample_rate_hertz, language_code, enable_automatic_punctuation, upload_format)
+        response.raise_for_status()
+        operation_id = response.json().get("name", "").split("/")[-1] or None
+        if not operation_id:
+            raise RuntimeError("Fanolab did not return an operation for the audio chunk")
+        return operation_id
+    finally:
+        if blob_storage:
+            schedule_temp_audio_deletion(blob_storage, blob_name, operation_id)
+        if os.path.exists(chunk_path):
+            os.remove(chunk_path)
+
+
+def submit_chunks(meeting_wav_path: str, chunks: list, sample_rate_hertz: int, language_code: str,
+                  enable_automatic_punctuation: bool, upload_format: str = "wav") -> list:
+    """
+    Submit the chunks in parallel, returning their Fanolab operation ids in chunk order. On the first failure the
+    chunks not started yet are cancelled and the error is raised; the audio of chunks already submitted is deleted
+    once Fanolab is done with it.
+    """
+    with ThreadPoolExecutor(max_workers=FANOLAB_CHUNK_WORKERS) as executor:
+        futures = [
+            executor.submit(submit_chunk, meeting_wav_path, chunk, sample_rate_hertz, language_code, enable_automatic_punctuation, upload_format)
+            for chunk in chunks
+        ]
+        _, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+
+    # Every chunk started has finished here
+    error = next((future.exception() for future in futures if not future.cancelled() and future.exception()), None)
+    if error is not None:
+        submitted = [future.result() for future in futures if not future.cancelled() and not future.exception()]
+        print(f"Chunked submission failed, abandoning {len(submitted)} of {len(chunks)} chunk operation(s) already submitted: "
+              f"{', '.join(submitted) or 'none'}")
+        raise error
+    return [future.result() for future in futures]
+
+
+def fanolab_submit_chunked_transcription(meeting_wav_path: str, source_url: str, sample_rate_hertz: int, duration_seconds: float,
+                                         language_code: str, enable_automatic_punctuation: bool, upload_format: str = "wav",
+                                         original_wav_path: Optional[str] = None) -> dict:
+    """
+    Cut a long recording at quiet points into overlapping chunks and submit them to Fanolab in parallel, so the
+    transcription takes about as long as its longest chunk. The job id is polled like a Fanolab operation id; once
+    every chunk is done the results are stitched onto one timeline, see get_chunked_operation.
+
+    Args:
+        meeting_wav_path: The audio to transcribe
+        original_wav_path: The recording on its original timeline when meeting_wav_path had its silences removed;
+            it is kept in blob storage until the job is stitched, to reconcile speakers by voiceprint
+
+    Returns:
+        {"name": "operations/chunked-<hex>", "metadata": {"chunks"}}, shaped like Fanolab's response
+    """
+    chunks = plan_chunks(meeting_wav_path, duration_seconds)
+    job_id = new_chunked_job_id()
+    store = get_blob_store()
+    audio_blob = f"fanolab_{job_id}.wav"
+    created = False
+    try:
+        store.put_file(TEMP_AUDIO_CONTAINER, audio_blob, original_wav_path or meeting_wav_path, "audio/wav")
+        print(f"Submitting {duration_seconds:.0f}s of audio as {len(chunks)} chunks")
+        operation_ids = submit_chunks(meeting_wav_path, chunks, sample_rate_hertz, language_code,
+                                      enable_automatic_punctuation, upload_format)
+        create_chunked_job(
+            job_id, source_url, sample_rate_hertz, duration_seconds,
+            [{**chunk, "operation_id": operation_id} for chunk, operation_id in zip(chunks, operation_ids)],
+            audio_store=store.name, audio_blob=audio_blob
+        )
+        created = True
+    finally:
+        # Deleted once the job is done and stitched, right away if the submission failed
+        try:
+            schedule_blob_deletion(store.name, audio_blob, bucket=TEMP_AUDIO_CONTAINER, operation_id=job_id if created else None,
+                                   ttl=FANOLAB_CHUNK_AUDIO_TTL if created else timedelta(0))
+        except Exception as e:
+            print(f"Failed to schedule deletion of {audio_blob}: {e}")
+    return {"name": f"operations/{job_id}", "metadata": {"chunks": len(chunks)}}
+
+
+def fanolab_submit_transcription(request, quota_check=check_quota):
     """
     Receives a JSON request with an MP4 URL, converts it to WAV, and sends the file URL to FanoLab API.
+
+    Args:
+        quota_check: Charges the submitted hours, as check_quota
     """
     data = request.get_json()
     source_url = data.get('source_url')
     language_code = data.get('language_code', 'yue-x-auto')
     enable_automatic_punctuation = data.get('enable_auto_punctuation', False)
     application_owner = data.get('application_owner')
+    # JSON booleans, or "true" / "1" as strings; "false" must not count as set
+    chunked = str(data.get('chunked', False)).lower() in ("true", "1")  # Long recordings are split and transcribed in parallel
+    remove_silence = str(data.get('remove_silence', FANOLAB_REMOVE_SILENCE)).lower() in ("true", "1")  # Fanolab and quota are charged less
+    upload_format = data.get('upload_format') or FANOLAB_UPLOAD_FORMAT  # wav or flac, for audio this backend uploads
 
     if not source_url:
         return {"error": "URL is required"}
 
+    if upload_format not in FANOLAB_UPLOAD_FORMATS:
+        return {"error": f"upload_format must be one of {', '.join(FANOLAB_UPLOAD_FORMATS)}"}, 400
+
     if not application_owner:
         return {"error": "application_owner is required"}
 
-    # Convert MP4 to WAV
-    meeting_wav_path = mp4_to_wav_file(source_url)
-    if not meeting_wav_path:
-        return {"error": "Failed to process audio"}
+    # A compatible WAV in our own storage is passed to Fanolab as it is, without downloading, transcoding or uploading it
+    # Chunked mode and silence removal cut the audio locally, so they always need the WAV
+    direct_source = None if chunked or remove_silence else probe_direct_source(source_url)
+    meeting_wav_path: Optional[str] = None
+    if direct_source is None:
+        # Convert MP4 to WAV
+        meeting_wav_path = mp4_to_wav_file(source_url)
+        if not meeting_wav_path:
+            return {"error": "Failed to process audio"}
+
+    # Unique per submission, concurrent submissions must not overwrite each other's audio
+    blob_name = f"fanolab_{uuid.uuid4().hex}{FANOLAB_UPLOAD_FORMATS[upload_format][0]}"
+    blob_storage: Optional[str] = None
+    operation_id: Optional[str] = None
+    condensed_wav_path: Optional[str] = None
+    encoded_path: Optional[str] = None
+    refund_hours: Optional[float] = None  # Charged to the tenant and not yet accepted by Fanolab
+    pending_map_id: Optional[str] = None  # Offset map saved before submission and not yet linked to its operation
 
     try:
-        # Get duration and sample rate from WAV file
-        audio = AudioSegment.from_wav(meeting_wav_path)
-        duration_seconds = len(audio) / 1000  # Convert milliseconds to seconds
-        duration_hours = duration_seconds / 3600  # Convert to hours
-        sample_rate_hertz = audio.frame_rate
+        if direct_source:
+            duration_seconds = direct_source["duration_seconds"]
+            sample_rate_hertz = direct_source["sample_rate"]
+        else:
+            # Get duration and sample rate from WAV file
+            audio = AudioSegment.from_wav(meeting_wav_path)
+            duration_seconds = len(audio) / 1000  # Convert milliseconds to seconds
+            sample_rate_hertz = audio.frame_rate
 
         # Validate sample rate
-        if not (8000 <= sample_rate_hertz <= 48000):
+        if not (FANOLAB_MIN_SAMPLE_RATE <= sample_rate_hertz <= FANOLAB_MAX_SAMPLE_RATE):
             raise ValueError(f"Invalid sample rate: {sample_rate_hertz} Hz. Sample rate must be between 8000 and 48000 Hz.")
 
+        # Long non-speech spans are cut out, only the condensed audio is uploaded, transcribed and charged
+        submit_wav_path = meeting_wav_path
+        offset_map = None
+        if remove_silence:
+            condensed_wav_path = os.path.join(UPLOAD_FOLDER, f"condensed_{uuid.uuid4().hex}.wav")
+            offset_map = remove_silences(meeting_wav_path, condensed_wav_path, duration_seconds)
+            if offset_map:
+                print(f"Removed {offset_map.removed_seconds:.0f}s of silence from {duration_seconds:.0f}s of audio")
+                submit_wav_path, duration_seconds = condensed_wav_path, offset_map.condensed_duration
+        duration_hours = duration_seconds / 3600  # Convert to hours
+
         # Check quota before proceeding
-        is_allowed, message = check_quota(application_owner, duration_hours)
+        is_allowed, message = quota_check(application_owner, duration_hours)
 
         if not is_allowed:
             return {"error": message}, 403
-
-        wav_url: Optional[str] = None
-
-        if ON_PREMISES_MODE == OnPremiseMode.ON_CLOUD.value:
-            # Upload audio file to Azure Blob Storage
-            wav_url = azure_upload_file_and_get_sas_url(file_path=meeting_wav_path, blob_name=AZURE_BLOB_NAME)
-            if not wav_url:
-                return {"error": "Failed to upload audio"}, 500
-
-        elif ON_PREMISES_MODE == OnPremiseMode.ON_PREMISES.value:
-            wav_url = minio_upload_and_share(
-                    file_path=meeting_wav_path,
-                    bucket="meeting-minutes-temp-audio",
-                    blob_name=AZURE_BLOB_NAME)
-            if not wav_url:
+        refund_hours = duration_hours
+
+        if offset_map:
+            # Saved before Fanolab accepts the audio, a database error then fails the submission instead of losing the map
+            pending_map_id = f"pending-{uuid.uuid4().hex}"
+            save_offset_map(pending_map_id, offset_map)
+
+        if chunked and is_long_enough_to_chunk(duration_seconds):
+            result = fanolab_submit_chunked_transcription(submit_wav_path, source_url, sample_rate_hertz, duration_seconds,
+                                                          language_code, enable_automatic_punctuation, upload_format,
+                                                          original_wav_path=meeting_wav_path)
+            refund_hours = None
+            link_submitted_offset_map(pending_map_id, result["name"].split("/")[-1])
+            pending_map_id = None  # Linked, or kept under its pending id to link by hand
+            return result
+
+        wav_url: Optional[str] = direct_source["wav_url"] if direct_source else None
+
+        if direct_source:
+            print("Source is Fanolab compatible, submitting the original blob")
+            upload_format = "wav"
+        else:
+            upload_path = submit_wav_path
+            if upload_format != "wav":
+                encoded_path = os.path.join(UPLOAD_FOLDER, blob_name)
+                encode_upload_audio(submit_wav_path, encoded_path, upload_format)
+                upload_path = encoded_path
+            # Upload audio file to blob storage
+            wav_url, blob_storage = upload_temp_audio(upload_path, blob_name)
+            if blob_storage and not wav_url:
                 return {"error": "Failed to upload audio"}, 500
 
         # Validate that wav_url was successfully set
         if not wav_url:
             return {"error": "Failed to upload audio file"}, 500
 
-        # Prepare API request
-        payload = {
-            "config": {
-                "languageCode": language_code,
-                "sampleRateHertz": sample_rate_hertz,
-                "maxAlternatives": 1,
-                "enableSeparateRecognitionPerChannel": False,
-                "enableAutomaticPunctuation": enable_automatic_punctuation
-            },
-            "enableWordTimeOffsets": True,
-            "diarizationConfig": {
-                "disableSpeakerDiarization": False
-            },
-            "audio": {
-                "uri": wav_url
-            }
-        }
-
         # Send request to FanoLab API
-        response = requests.post(f"{FANOLAB_HOST}/speech/long-running-recognize", json=payload, headers=headers)
-
-        if response:
-            # Wait for 5 seconds before deleting the blob
-            time.sleep(5)
-            if ON_PREMISES_MODE == OnPremiseMode.ON_CLOUD.value:
-                azure_delete_blob(blob_name=AZURE_BLOB_NAME)
-            elif ON_PREMISES_MODE == OnPremiseMode.ON_PREMISES.value:
-                minio_delete_blob(bucket="meeting-minutes-temp-audio", blob_name=AZURE_BLOB_NAME)
-            # Clean up the temporary WAV file
-            if os.path.exists(meeting_wav_path):
-                os.remove(meeting_wav_path)
+        response = recognize(wav_url, sample_rate_hertz, language_code, enable_automatic_punctuation, upload_format)
+
+        result = response.json()
+        if response.ok:
+            refund_hours = None
+            operation_id = result.get("name", "").split("/")[-1] or None
+            if operation_id:
+                link_submitted_offset_map(pending_map_id, operation_id)
+                pending_map_id = None  # Linked, or kept under its pending id to link by hand
 
-        return response.json()
+        return result
     except Exception as e:
         return {"error": str(e)}, 500
     finally:
-        # Clean up the WAV file
-        if os.path.exists(meeting_wav_path):
-            os.remove(meeting_wav_path)
+        if refund_hours is not None:
+            # Nothing was transcribed for the tenant: the upload failed or Fanolab did not accept the audio
+            try:
+                refund_quota(application_owner, refund_hours)
+            except Exception as e:
+                print(f"Failed to refund {refund_hours:.2f}h to {application_owner}: {e}")
+        if pending_map_id:
+            try:
+                discard_offset_map(pending_map_id)
+            except Exception as e:
+                print(f"Failed to discard offset map {pending_map_id}: {e}")
+        if blob_storage:
+            schedule_temp_audio_deletion(blob_storage, blob_name, operation_id)
+        # Clean up the WAV files
+        for wav_path in (meeting_wav_path, condensed_wav_path, encoded_path):
+            if wav_path and os.path.exists(wav_path):
+                os.remove(wav_path)
+
+
+def link_submitted_offset_map(pending_map_id: Optional[str], operation_id: str) -> None:
+    """
+    Link the offset map saved before submission to the operation Fanolab accepted. The submission already
+    succeeded, so a failure is logged with both ids to link them by hand and never fails the response.
+    """
+    if pending_map_id:
+        try:
+            link_offset_map(pending_map_id, operation_id)
+        except Exception as e:
+            print(f"Failed to link offset map {pending_map_id} to operation {operation_id}: {e}")
+
+
+async def async_fanolab_submit_transcription(request):
+    """
+    fanolab_submit_transcription for `async def` handlers: the audio is converted and uploaded on a worker thread,
+    while the quota is charged with async_check_quota in the handler's event loop.
+    """
+    loop = asyncio.get_running_loop()
+
+    def quota_check(application_owner: str, duration_hours: float) -> tuple[bool, str]:
+        return asyncio.run_coroutine_threadsafe(async_check_quota(application_owner, duration_hours), loop).result()
+
+    return await asyncio.to_thread(fanolab_submit_transcription, request._get_current_object(), quota_check)
+
+
+def get_fanolab_operation(fanolab_id: str) -> dict:
+    """
+    The JSON of a Fanolab operation. Done operations never change: they are cached compressed in memory and
+    Postgres on first sight, and only operations still in progress are fetched from Fanolab. Chunked job ids
+    resolve to the stitched operation of their chunks.
+    """
+    operation = get_cached_operation(fanolab_id)
+    if operation is not None:
+        return operation
+
+    if is_chunked_job_id(fanolab_id):
+        return get_chunked_operation(fanolab_id)  # Cached once stitched
+
+    response = http_client.get(http_client.FANOLAB, f"{FANOLAB_HOST}/speech/operations/{fanolab_id}", headers=headers)
+    response.raise_for_status()  # Raises an error for bad responses
+    operation = response.json()
+    if operation.get("done") is True:
+        # Audio submitted without its silences: results are cached on the original timeline
+        offset_map = get_offset_map(fanolab_id) if "error" not in operation else None
+        if offset_map:
+            operation = remap_operation(operation, offset_map)
+        try:
+            cache_operation(fanolab_id, operation)
+        except Exception as e:
+            print(f"Failed to cache Fanolab operation {fanolab_id}: {e}")
+    return operation
+
+
+def get_chunked_operation(job_id: str) -> dict:
+    """
+    A chunked job as one Fanolab-shaped operation: in progress until every chunk is done, failed when any chunk
+    failed, else the stitched results of all chunks with global speaker tags.
+    """
+    job = get_chunked_job(job_id)
+    if job is None:
+        raise ValueError(f"Unknown chunked transcription: {job_id}")
+
+    chunks = job["chunks"]
+    with ThreadPoolExecutor(max_workers=FANOLAB_CHUNK_WORKERS) as executor:
+        chunk_operations = list(executor.map(get_fanolab_operation, [chunk["operation_id"] for chunk in chunks]))
+
+    for index, chunk_operation in enumerate(chunk_operations):
+        if "error" in chunk_operation:
+            message = chunk_operation["error"].get("message", "Unknown error occurred")
+            return {"name": f"operations/{job_id}", "done": True, "error": {"message": f"Chunk {index + 1} of {len(chunks)} failed: {message}"}}
+
+    done_count = sum(1 for chunk_operation in chunk_operations if chunk_operation.get("done") is True)
+    if done_count < len(chunks):
+        return {"name": f"operations/{job_id}", "done": False, "metadata": {"chunks": len(chunks), "chunksDone": done_count}}
+
+    # Speakers are reconciled by voiceprint, which needs the recording; concurrent polls wait for one stitch
+    with _stitch_locks_guard:
+        stitch_lock = _stitch_locks.setdefault(job_id, threading.Lock())
+    try:
+        with stitch_lock:
+            operation = get_cached_operation(job_id)
+            if operation is not None:
+                return operation
+            meeting_wav_path = download_chunked_audio(job)
+            try:
+                operation = build_chunked_operation(job, chunk_operations, meeting_wav_path, get_offset_map(job_id))
+            finally:
+                os.remove(meeting_wav_path)
+            cache_operation(job_id, operation)
+            return operation
+    finally:
+        # Later polls hit the cache, the lock is only needed while the stitch runs
+        with _stitch_locks_guard:
+            if _stitch_locks.get(job_id) is stitch_lock and not stitch_lock.locked():
+                del _stitch_locks[job_id]
+
+
+def download_chunked_audio(job: dict) -> str:
+    """
+    The recording of a chunked job as a local WAV: the copy stored at submission, or for jobs submitted before it
+    was stored, converted again from the source URL.
+    """
+    if job["audio_blob"]:
+        wav_path = os.path.join(UPLOAD_FOLDER, f"chunked_{uuid.uuid4().hex}.wav")
+        try:
+            get_blob_store(job["audio_store"]).download(TEMP_AUDIO_CONTAINER, job["audio_blob"], wav_path)
+        except Exception:
+            if os.path.exists(wav_path):
+                os.remove(wav_path)
+            raise
+        return wav_path
+    meeting_wav_path = mp4_to_wav_file(job["source_url"])
+    if not meeting_wav_path:
+        raise RuntimeError("Failed to process audio")
+    return meeting_wav_path
+
+
+def is_fanolab_operation_done(operation_id: str) -> bool:
+    """True once the operation finished or failed, Fanolab no longer reads its audio then."""
+    if is_chunked_job_id(operation_id):
+        return is_chunked_job_done(operation_id)
+    try:
+        return get_fanolab_operation(operation_id).get("done") is True
+    except HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return True
+        raise
+
+
+def is_chunked_job_done(job_id: str) -> bool:
+    """
+    True once a chunked job no longer needs its recording: stitched, or failed in any chunk. Only the chunks'
+    statuses are looked up, the stitch runs on the client's poll and never in the deletion scheduler.
+    """
+    if get_cached_operation(job_id) is not None:
+        return True
+    job = get_chunked_job(job_id)
+    if job is None:
+        return True
+    for chunk in job["chunks"]:
+        try:
+            chunk_operation = get_fanolab_operation(chunk["operation_id"])
+        except HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return True
+            raise
+        if "error" in chunk_operation:
+            return True
+    # Every chunk done but not stitched yet: the stitch still reads the recording
+    return False
 
 
 def fanolab_transcription(request):
@@ -163,30 +575,75 @@ def fanolab_transcription(request):
     source_url = data.get('source_url')
     fanolab_id = data.get('fanolab_id')
     application_owner = data.get('application_owner')
-    confidence_threshold = float(data.get('confidence_threshold', 0.8))  # Convert to float with default value
+    confidence_threshold = float(data['confidence_threshold']) if data.get('confidence_threshold') is not None else None  # None uses the tenant's search settings
+    output_format = data.get('output_format') or "legacy"  # legacy, structured or columnar
 
     if not application_owner:
         return {"error": "application_owner is required"}, 400
+    if output_format not in OUTPUT_FORMATS:
+        return {"error": f"output_format must be one of {', '.join(OUTPUT_FORMATS)}"}, 400
 
     try:
-        url = f"{FANOLAB_HOST}/speech/operations/{fanolab_id}"
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raises an error for bad responses
-        json_data = response.json()
+        # A completed job is served from Postgres without asking Fanolab, transcoding or matching again
+        key = source_key(source_url)
+        stored = get_transcription_results("fanolab", fanolab_id, application_owner).get(key)
+        if stored and not needs_rematch(stored, confidence_threshold):
+            return {
+                "status": "success",
+                "message": "Transcription completed successfully",
+                "sys_id": sys_id,
+                **render_transcript(stored["result"], output_format)
+            }
+
+        speaker_stats = rematch_stored_speakers(stored["result"], application_owner, confidence_threshold) if stored else None
+        if speaker_stats is not None:
+            # Re-matched from the speaker embeddings kept with the result, the media is not downloaded again
+            result = {**stored["result"], "speaker_stats": speaker_stats}
+            update_transcription_matches("fanolab", fanolab_id, key, application_owner, result, confidence_threshold)
+            return {
+                "status": "success",
+                "message": "Transcription completed successfully",
+                "sys_id": sys_id,
+                **render_transcript(result, output_format)
+            }
+
+        json_data = get_fanolab_operation(fanolab_id)
 
         current_status = json_data.get('done')
 
         if current_status is True:
-            speaker_text_pairs, speaker_stats, total_duration, source_url = fanolab_fetch_completed_transcription(source_url=source_url, fanolab_id=fanolab_id, application_owner=application_owner, confidence_threshold=confidence_threshold)
-                
+            if not stored and not claim_transcription_result("fanolab", fanolab_id, key, application_owner):
+                return {
+                    "status": "in_progress",
+                    "message": "Transcription result is being processed by another request"
+                }, 200
+
+            try:
+                segments, speaker_stats, total_duration, source_url, speaker_embeddings = fanolab_fetch_completed_transcription(source_url=source_url, fanolab_id=fanolab_id, application_owner=application_owner, confidence_threshold=confidence_threshold)
+            except Exception:
+                if not stored:
+                    release_transcription_result("fanolab", fanolab_id, key, application_owner)
+                raise
+
+            result = {
+                "source_url": source_url,
+                "speaker_stats": speaker_stats,
+                "total_duration": total_duration,
+                "segments": segments.to_columnar(),  # The legacy strings are rendered from these
+                "speaker_embeddings": speaker_embeddings,
+                "embedding_model_version": ACTIVE_MODEL_VERSION
+            }
+            if stored:
+                update_transcription_matches("fanolab", fanolab_id, key, application_owner, result, confidence_threshold)
+            else:
+                # Quota was charged when the audio was submitted
+                complete_transcription_result("fanolab", fanolab_id, key, application_owner, result, confidence_threshold)
+
             result_dict = {
                 "status": "success",
                 "message": "Transcription completed successfully",
                 "sys_id": sys_id,
-                "source_url": source_url,
-                "speaker_stats": speaker_stats,
-                "total_duration": total_duration,
-                "transcriptions": speaker_text_pairs
+                **render_transcript(result, output_format)
             }
             return result_dict
         else:
@@ -208,37 +665,16 @@ def fanolab_transcription(request):
         }, 500
 
 
-def fanolab_fetch_completed_transcription(source_url: str, fanolab_id: str, match_voiceprint: bool = True, application_owner: str = None, confidence_threshold: float = 0.8):
-    url = f"{FANOLAB_HOST}/speech/operations/{fanolab_id}"
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()  # Raises an error for bad responses
-    json_data = response.json()
-
-    speaker_text_pairs = []
-
-    speaker_stats = defaultdict(lambda: {"total_duration": 0, "total_words": 0, "segments": []})
-    total_duration = 0
-
-    # If a source URL exists, perform the audio conversion
-    meeting_wav_path = mp4_to_wav_file(mp4_url=source_url)
+def fanolab_fetch_completed_transcription(source_url: str, fanolab_id: str, match_voiceprint: bool = True, application_owner: str = None, confidence_threshold: Optional[float] = None):
+    """
+    :return: (segments, speaker_stats, total_duration, source_url, speaker_embeddings), speaker_embeddings the embeddings
+        of each speaker's longest segments when voiceprints were matched, kept so a stored result is re-matched without the media
+    """
+    json_data = get_fanolab_operation(fanolab_id)
 
     # Process each result from Fanolab's response
-    results = json_data.get("response", {}).get("results", [])
-    
-    # Sort results by startTime
-    def get_start_time(result):
-        alternatives = result.get("alternatives", [])
-        if alternatives:
-            start_time_str = alternatives[0].get("startTime", "0s")
-            try:
-                return float(start_time_str.rstrip("s"))
-            except ValueError:
-                return 0
-        return 0
-    
-    sorted_results = sorted(results, key=get_start_time)
-    
-    for result in sorted_results:
+    builder = SegmentTableBuilder()
+    for result in json_data.get("response", {}).get("results", []):
         alternatives = result.get("alternatives", [])
         if not alternatives:
             continue
@@ -259,9 +695,6 @@ def fanolab_fetch_completed_transcription(source_url: str, fanolab_id: str, matc
         except ValueError:
             end_time_sec = 0
 
-        duration = end_time_sec - start_time_sec
-        formatted_start_time = format_time(start_time_sec)
-        formatted_end_time = format_time(end_time_sec)
         speaker = alternative.get("speakerTag")
 
         if speaker is not None and transcript:
@@ -269,63 +702,26 @@ def fanolab_fetch_completed_transcription(source_url: str, fanolab_id: str, matc
                 speaker_int = int(speaker)
             except ValueError:
                 continue  # Skip if speakerTag is not a valid integer string
-            speaker_text_pairs.append(
-                f"Speaker-{speaker_int} ({formatted_start_time} - {formatted_end_time}): {transcript}"
-            )
+            builder.append(speaker_int, start_time_sec, end_time_sec, transcript)
 
-            # Update speaker statistics
-            speaker_stats[speaker_int]["total_duration"] += duration
-            speaker_stats[speaker_int]["total_words"] += len(transcript.split())
-            speaker_stats[speaker_int]["segments"].append({
-                "start": start_time_sec,
-                "end": end_time_sec,
-                "duration": duration
-            })
-            total_duration += duration
-
-    # Calculate percentages and words per minute; also perform voiceprint matching
+    # Sort results by startTime
+    segments = builder.build(sort=True)
+    total_duration = float(segments.durations.sum())
+    speaker_stats = segments.speaker_stats(total_duration)
 
-    # Match voiceprint, Calculate percentages and words per minute
+    # Embed the top 3 longest segments of each speaker and match them against the voiceprint library
+    speaker_embeddings = {}
     if match_voiceprint and application_owner:
-        for speaker, stats in speaker_stats.items():
-            stats["percentage"] = (stats["total_duration"] / total_duration) * 100 if total_duration > 0 else 0
-            stats["words_per_minute"] = (stats["total_words"] / stats["total_duration"]) * 60 if stats["total_duration"] > 0 else 0
-
-            # Sort segments by duration (longest first) and get top 3 segments
-            stats["segments"].sort(key=lambda x: x["duration"], reverse=True)
-            top_segments = stats["segments"][:3]
-
-            if top_segments:
-                for i, segment in enumerate(top_segments):
-                    output_name = f"speaker_{speaker}_segment_{i}"
-                    extract_audio_segment(output_name=output_name, start_time=segment["start"], end_time=segment["end"], input_file=meeting_wav_path, clean_up_after=False)
-                    wav_path = os.path.join(UPLOAD_FOLDER, f"{output_name}.wav")
-                    matches = search_voiceprint(wav_path, application_owner)
-
-                    if matches:
-                        matches_data = matches.get_json()
-                        if matches_data and len(matches_data) > 0:
-                            best_match = matches_data[0]
-                            if best_match.get("similarity", 0) >= confidence_threshold:  # Confidence threshold
-                                stats["identified_name"] = best_match.get("name", "unknown")
-                                stats["confidence"] = best_match.get("similarity")
-                            else:
-                                stats["identified_name"] = "unknown"
-                        else:
-                            stats["identified_name"] = "unknown"
-                    else:
-                        stats["identified_name"] = "unknown"
-
-                    # Clean up the temporary WAV file
-                    os.remove(wav_path)
-            else:
-                stats["identified_name"] = "unknown"
-
-    # Clean up the temporary WAV file
-    if os.path.exists(meeting_wav_path):
-        os.remove(meeting_wav_path)
+        meeting_wav_path = mp4_to_wav_file(mp4_url=source_url)
+        try:
+            speaker_embeddings = embed_speaker_segments(segments, speaker_stats, meeting_wav_path)
+        finally:
+            # Clean up the temporary WAV file
+            if meeting_wav_path and os.path.exists(meeting_wav_path):
+                os.remove(meeting_wav_path)
+        identify_speakers(speaker_stats, speaker_embeddings, application_owner, confidence_threshold)
 
-    return speaker_text_pairs, speaker_stats, total_duration, source_url
+    return segments, speaker_stats, total_duration, source_url, speaker_embeddings
 
 
 def fanolab_extract_speaker_clip(request):
@@ -336,6 +732,7 @@ def fanolab_extract_speaker_clip(request):
         request: Flask request object containing:
             - source_url: URL of the meeting recording MP4 file
             - fanolab_id: ID of the Fanolab transcription operation
+            - format: (optional) Clip format, wav (default), flac or opus
             
     Returns:
         A zip file containing audio segments for each speaker
@@ -343,90 +740,46 @@ def fanolab_extract_speaker_clip(request):
     data = request.get_json()
     mp4_url = data.get('source_url')
     fanolab_id = data.get('fanolab_id')
+    clip_format = data.get('format') or "wav"
 
     if not mp4_url or not fanolab_id:
         return {"error": "Both source_url and fanolab_id are required"}, 400
+    if clip_format not in CLIP_FORMATS:
+        return {"error": f"format must be one of {', '.join(CLIP_FORMATS)}"}, 400
         
+    meeting_wav_path = None
     try:
-        # Generate unique identifier for this request
-        unique_id = str(uuid.uuid4())
-        
-        # Create unique directory for this request's files
-        request_dir = os.path.join(UPLOAD_FOLDER, f"request_{unique_id}")
-        os.makedirs(request_dir, exist_ok=True)
-        
-        try:
-            # Get the transcription results
-            speaker_text_pairs, speaker_stats, total_duration, source_url = fanolab_fetch_completed_transcription(
-                source_url=mp4_url,
-                fanolab_id=fanolab_id,
-                match_voiceprint = False,
-                application_owner=None  # We don't need voiceprint matching for this operation
-            )
-            
-            # Download and convert the MP4 to WAV
-            meeting_wav_path = mp4_to_wav_file(mp4_url=mp4_url)
-            
-            # Create a directory to store the speaker clips
-            clips_dir = os.path.join(request_dir, "speaker_clips")
-            os.makedirs(clips_dir, exist_ok=True)
-            
-            # Extract segments for each speaker
-            for speaker, stats in speaker_stats.items():
-                # Sort segments by duration and get top 3
-                stats["segments"].sort(key=lambda x: x["duration"], reverse=True)
-                top_segments = stats["segments"][:3]  # Get up to 3 longest segments
-                
-                # Extract each segment
-                for i, segment in enumerate(top_segments):
-                    output_name = f"speaker_{speaker}_segment_{i}"
-                    extract_audio_segment(output_name=output_name, start_time=segment["start"], end_time=segment["end"], input_file=meeting_wav_path, clean_up_after=False)
-                    
-                    # Move the file to the clips directory
-                    src_path = os.path.join(UPLOAD_FOLDER, f"{output_name}.wav")
-                    dst_path = os.path.join(clips_dir, f"{output_name}.wav")
-                    os.rename(src_path, dst_path)
-            
-            # Create a zip file of all clips with unique name
-            zip_filename = f"speaker_clips_{unique_id}.zip"
-            zip_path = os.path.join(request_dir, zip_filename)
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for root, dirs, files in os.walk(clips_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, clips_dir)
-                        zipf.write(file_path, arcname)
-
-            # Clean up the clips directory
-            shutil.rmtree(clips_dir)
-
-            # Upload the zip file to Azure Blob Storage and get a SAS URL
-            blob_name = f"speaker_clips_{unique_id}.zip"  # Use unique name for blob
-
-            download_url: Optional[str] = None
-
-            if ON_PREMISES_MODE == OnPremiseMode.ON_CLOUD.value:
-                download_url = azure_upload_file_and_get_sas_url(file_path=zip_path, blob_name=blob_name)
-
-            elif ON_PREMISES_MODE == OnPremiseMode.ON_PREMISES.value:
-                download_url = minio_upload_and_share(file_path=zip_path, bucket="meeting-minutes-speaker-clip", blob_name=blob_name)
+        # Get the transcription results
+        segments, speaker_stats, total_duration, source_url, _ = fanolab_fetch_completed_transcription(
+            source_url=mp4_url,
+            fanolab_id=fanolab_id,
+            match_voiceprint = False,
+            application_owner=None  # We don't need voiceprint matching for this operation
+        )
 
-            # Clean up all temporary files and directories
-            if os.path.exists(meeting_wav_path):
-                os.remove(meeting_wav_path)
-            if os.path.exists(request_dir):
-                shutil.rmtree(request_dir)
+        # Download and convert the MP4 to WAV
+        meeting_wav_path = mp4_to_wav_file(mp4_url=mp4_url)
+        if not meeting_wav_path:
+            return {"error": "Failed to process audio"}, 500
 
-            if not download_url:
-                return {"error": "Failed to export speaker clip"}, 500
+        # Cut up to 3 longest segments of each speaker straight into a zip streamed to blob storage
+        blob_name = f"speaker_clips_{uuid.uuid4()}.zip"  # Use unique name for blob
+        clips = select_speaker_clips(segments, speaker_stats)
 
-            return {"download_url": download_url}
+        upload = lambda stream: get_blob_store().put_stream_and_presign(SPEAKER_CLIP_CONTAINER, blob_name, stream, content_type="application/zip")
+        discard = lambda: get_blob_store().delete(SPEAKER_CLIP_CONTAINER, blob_name)
+        download_url = upload_clip_bundle(meeting_wav_path, clips, upload, clip_format, discard)
+        if not download_url:
+            return {"error": "Failed to export speaker clip"}, 500
 
-        except Exception as e:
-            return {"error": str(e)}, 500
+        return {"download_url": download_url}
 
     except Exception as e:
         return {"error": str(e)}, 500
+    finally:
+        # Clean up the temporary WAV file
+        if meeting_wav_path and os.path.exists(meeting_wav_path):
+            os.remove(meeting_wav_path)
 
 
 def fanolab_match_speaker_voiceprint(request):
@@ -446,31 +799,23 @@ def fanolab_match_speaker_voiceprint(request):
     mp4_url = data.get('source_url')
     fanolab_id = data.get('fanolab_id')
     application_owner = data.get('application_owner')
-    confidence_threshold = data.get('confidence_threshold')
+    confidence_threshold = float(data['confidence_threshold']) if data.get('confidence_threshold') is not None else None  # None uses the tenant's search settings
 
     if not mp4_url or not fanolab_id or not application_owner:
         return {"error": "source_url, fanolab_id, and application_owner are required"}, 400
 
     try:
-        # Clean up upload folder first
-        for filename in os.listdir(UPLOAD_FOLDER):
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-            except Exception as e:
-                print(f'Failed to delete {file_path}. Reason: {e}')
-
-        # Get the transcription results with voiceprint matching enabled
-        speaker_text_pairs, speaker_stats, total_duration, source_url = fanolab_fetch_completed_transcription(
-            source_url=mp4_url,
-            fanolab_id=fanolab_id,
-            match_voiceprint=True,
-            application_owner=application_owner,
-            confidence_threshold=confidence_threshold
-        )
+        # A stored result is matched from its speaker embeddings, otherwise the fetch embeds and matches the speakers
+        stored = get_transcription_results("fanolab", fanolab_id, application_owner).get(source_key(mp4_url))
+        speaker_stats = rematch_stored_speakers(stored["result"], application_owner, confidence_threshold) if stored else None
+        if speaker_stats is None:
+            _, speaker_stats, _, _, _ = fanolab_fetch_completed_transcription(
+                source_url=mp4_url,
+                fanolab_id=fanolab_id,
+                match_voiceprint=True,
+                application_owner=application_owner,
+                confidence_threshold=confidence_threshold
+            )
 
         # Create output list of speaker matches
         output_list = []
@@ -0,0 +1,159 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+from dotenv import load_dotenv
+from typing import Optional
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+# Load environment variables
+load_dotenv()
+
+# Upstreams called by the services, each gets its own pooled session and latency stats
+AZURE_STT = "azure_stt"
+FANOLAB = "fanolab"
+TFLOW = "tflow"
+MEDIA = "media"  # Source recordings, transcription content documents and other blob URLs
+UPSTREAMS = (AZURE_STT, FANOLAB, TFLOW, MEDIA)
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))  # Keep-alive connections per host and upstream
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))  # Longest wait for a byte, not for the whole body
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "10"))
+
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+LATENCY_SAMPLES = 1024
+
+_sessions: dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    upstream: {"requests": 0, "errors": 0, "retries": 0, "total_ms": 0.0, "max_ms": 0.0, "latencies": deque(maxlen=LATENCY_SAMPLES)}
+    for upstream in UPSTREAMS
+}
+
+
+def get_timeout(upstream: str) -> tuple[float, float]:
+    """(connect, read) timeout of an upstream, e.g. HTTP_READ_TIMEOUT_TFLOW overrides HTTP_READ_TIMEOUT for T-flow."""
+    suffix = upstream.upper()
+    return (
+        float(os.getenv(f"HTTP_CONNECT_TIMEOUT_{suffix}", HTTP_CONNECT_TIMEOUT)),
+        float(os.getenv(f"HTTP_READ_TIMEOUT_{suffix}", HTTP_READ_TIMEOUT)),
+    )
+
+
+def get_session(upstream: str) -> requests.Session:
+    """The shared keep-alive session of an upstream, created on first use."""
+    if upstream not in UPSTREAMS:
+        raise ValueError(f"Unknown upstream: {upstream}")
+    with _sessions_lock:
+        session = _sessions.get(upstream)
+        if session is None:
+            session = requests.Session()
+            # Retries are done in request() so they can be limited to idempotent calls and counted
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[upstream] = session
+        return session
+
+
+def _backoff_seconds(attempt: int, response: Optional[requests.Response] = None) -> float:
+    """Full jitter exponential backoff, or the upstream's Retry-After when it sends one."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+
+def _record(upstream: str, elapsed_ms: float, failed: bool, retries: int) -> None:
+    with _stats_lock:
+        stats = _stats[upstream]
+        stats["requests"] += 1
+        stats["errors"] += int(failed)
+        stats["retries"] += retries
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        stats["latencies"].append(elapsed_ms)
+
+
+def request(upstream: str, method: str, url: str, retry: Optional[bool] = None, **kwargs) -> requests.Response:
+    """
+    Send a request through the upstream's pooled session.
+
+    Args:
+        upstream: One of UPSTREAMS
+        method: HTTP method
+        url: Request URL
+        retry: Retry connection errors, timeouts and 429/5xx responses with jittered backoff.
+            Defaults to True for idempotent methods only; pass True for a POST that only reads (e.g. T-flow queries)
+        **kwargs: Passed to requests, timeout defaults to the upstream's (connect, read) timeout
+
+    Returns:
+        The response of the last attempt; status codes are left to the caller, as with requests
+    """
+    method = method.upper()
+    if retry is None:
+        retry = method in IDEMPOTENT_METHODS
+    kwargs.setdefault("timeout", get_timeout(upstream))
+    session = get_session(upstream)
+    attempts = HTTP_MAX_RETRIES + 1 if retry else 1
+
+    started = time.perf_counter()
+    for attempt in range(attempts):
+        is_last = attempt == attempts - 1
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if is_last:
+                _record(upstream, (time.perf_counter() - started) * 1000, True, attempt)
+                raise
+            print(f"{upstream} {method} failed ({e.__class__.__name__}), retrying")
+            time.sleep(_backoff_seconds(attempt))
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES and not is_last:
+            print(f"{upstream} {method} returned {response.status_code}, retrying")
+            response.close()
+            time.sleep(_backoff_seconds(attempt, response))
+            continue
+
+        # Streamed responses are timed to their headers, the body is read by the caller
+        _record(upstream, (time.perf_counter() - started) * 1000, response.status_code >= 400, attempt)
+        return response
+
+
+def get(upstream: str, url: str, **kwargs) -> requests.Response:
+    return request(upstream, "GET", url, **kwargs)
+
+
+def post(upstream: str, url: str, **kwargs) -> requests.Response:
+    return request(upstream, "POST", url, **kwargs)
+
+
+def get_http_stats() -> dict:
+    """Per upstream request counts, errors, retries and latency percentiles over the last LATENCY_SAMPLES requests."""
+    with _stats_lock:
+        snapshot = {upstream: dict(stats, latencies=list(stats["latencies"])) for upstream, stats in _stats.items()}
+
+    result = {}
+    for upstream, stats in snapshot.items():
+        latencies = np.array(stats["latencies"]) if stats["latencies"] else None
+        result[upstream] = {
+            "requests": stats["requests"],
+            "errors": stats["errors"],
+            "retries": stats["retries"],
+            "mean_ms": round(stats["total_ms"] / stats["requests"], 2) if stats["requests"] else None,
+            "p50_ms": round(float(np.percentile(latencies, 50)), 2) if latencies is not None else None,
+            "p95_ms": round(float(np.percentile(latencies, 95)), 2) if latencies is not None else None,
+            "max_ms": round(stats["max_ms"], 2),
+            "timeout": get_timeout(upstream),
+        }
+    return result
@@ -1,11 +1,15 @@
-from sqlalchemy import Column, Integer, String, Float, Date, TIMESTAMP, JSON
+from sqlalchemy import Column, Integer, String, Float, Date, TIMESTAMP, JSON, Text, UniqueConstraint, LargeBinary, BigInteger
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import Vector, HALFVEC
+from src.db_config import get_embedding_precision
 
 Base = declarative_base()
 
+EMBEDDING_DIMENSIONS = 256
+EMBEDDING_PRECISION = get_embedding_precision()
+
 class AppOwnerControl(Base):
     __tablename__ = 'ai_meeting_app_owner_control'
 
@@ -25,6 +29,129 @@ class VoiceprintLibrary(Base):
     email = Column(String(255))
     department = Column(String(255))
     position = Column(String(255))
-    embedding = Column(Vector(256))  # Adjust dimensions as needed
+    embedding = Column(HALFVEC(EMBEDDING_DIMENSIONS) if EMBEDDING_PRECISION == 'float16' else Vector(EMBEDDING_DIMENSIONS))
+    model_version = Column(String(64), nullable=False)  # Encoder that produced the embedding
     metadata_json = Column(JSONB, nullable=False, default=dict)
     created_dt = Column(TIMESTAMP, server_default='CURRENT_TIMESTAMP')
+
+class VoiceprintReembedJob(Base):
+    __tablename__ = 'voiceprint_reembed_job'
+
+    sys_id = Column(Integer, primary_key=True, autoincrement=True)
+    source_model_version = Column(String(64), nullable=False)
+    target_model_version = Column(String(64), nullable=False)
+    status = Column(String(32), nullable=False, default='pending')  # pending / running / completed / failed
+    batch_size = Column(Integer, nullable=False, default=50)
+    last_sys_id = Column(Integer, nullable=False, default=0)  # Checkpoint, voiceprints up to this sys_id are done
+    total_count = Column(Integer, nullable=False, default=0)
+    processed_count = Column(Integer, nullable=False, default=0)
+    skipped_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    failed_sys_ids = Column(JSONB, nullable=False, default=list)  # Voiceprints that failed, retried by the next run of the job
+    elapsed_seconds = Column(Float, nullable=False, default=0)
+    error_message = Column(Text)
+    heartbeat_dt = Column(TIMESTAMP)
+    created_dt = Column(TIMESTAMP, server_default='CURRENT_TIMESTAMP')
+    completed_dt = Column(TIMESTAMP)
+
+class TranscriptionResult(Base):
+    __tablename__ = 'transcription_result'
+    __table_args__ = (UniqueConstraint('provider', 'job_id', 'source_key', 'application_owner'),)
+
+    sys_id = Column(Integer, primary_key=True, autoincrement=True)
+    provider = Column(String(32), nullable=False)  # azure / fanolab
+    job_id = Column(String(255), nullable=False)  # Azure transcription id / Fanolab operation id
+    source_key = Column(Text, nullable=False)  # Transcribed file URL without its SAS query
+    application_owner = Column(String(255), nullable=False)
+    status = Column(String(32), nullable=False, default='processing')  # processing / completed
+    confidence_threshold = Column(Float)  # Threshold the voiceprints were matched with, NULL for the tenant default
+    total_duration = Column(Float)
+    charged_hours = Column(Float, nullable=False, default=0)  # Quota charged for this result, exactly once
+    result_json = Column(JSONB)  # source_url, speaker_stats, total_duration, transcriptions
+    heartbeat_dt = Column(TIMESTAMP)
+    created_dt = Column(TIMESTAMP, server_default='CURRENT_TIMESTAMP')
+    completed_dt = Column(TIMESTAMP)
+
+class AzureTranscriptionJob(Base):
+    __tablename__ = 'azure_transcription_job'
+
+    sys_id = Column(Integer, primary_key=True, autoincrement=True)
+    transcription_id = Column(String(255), nullable=False, unique=True)
+    transcription_url = Column(Text, nullable=False)
+    application_owner = Column(String(255))  # Known once the job was polled or registered, required to process results
+    confidence_threshold = Column(Float)
+    status = Column(String(32), nullable=False, default='NotStarted')  # Azure status: NotStarted / Running / Succeeded / Failed / Deleted
+    processing_status = Column(String(32), nullable=False, default='pending')  # Result processing: pending / processing / completed / failed
+    content_url_list = Column(JSONB)
+    sys_ids = Column(JSONB)
+    error_message = Column(Text)
+    status_dt = Column(TIMESTAMP)  # Last status report from Azure, by webhook or poll
+    created_dt = Column(TIMESTAMP, server_default='CURRENT_TIMESTAMP')
+    updated_dt = Column(TIMESTAMP)
+    completed_dt = Column(TIMESTAMP)
+
+class DeferredBlobDeletion(Base):
+    __tablename__ = 'deferred_blob_deletion'
+
+    sys_id = Column(Integer, primary_key=True, autoincrement=True)
+    storage = Column(String(16), nullable=False)  # azure / minio
+    bucket = Column(String(255))  # MinIO bucket, NULL for the Azure container
+    blob_name = Column(Text, nullable=False)
+    operation_id = Column(String(255))  # Fanolab operation reading the blob, it is deleted once the operation is done
+    status = Column(String(16), nullable=False, default='pending')  # pending / deleted / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    error_message = Column(Text)
+    delete_after = Column(TIMESTAMP, nullable=False)  # Deleted by then even if the operation never reports done
+    next_check_dt = Column(TIMESTAMP)
+    created_dt = Column(TIMESTAMP, server_default='CURRENT_TIMESTAMP')
+    deleted_dt = Column(TIMESTAMP)
+
+class FanolabOperationCache(Base):
+    __tablename__ = 'fanolab_operation_cache'
+
+    sys_id = Column(Integer, primary_key=True, autoincrement=True)
+    fanolab_id = Column(String(255), nullable=False, unique=True)
+    payload = Column(LargeBinary, nullable=False)  # zlib compressed JSON of the done operation
+    payload_size = Column(Integer, nullable=False)  # Uncompressed bytes
+    created_dt = Column(TIMESTAMP, server_default='CURRENT_TIMESTAMP')
+
+class FanolabChunkedJob(Base):
+    __tablename__ = 'fanolab_chunked_job'
+
+    sys_id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String(255), nullable=False, unique=True)  # chunked-<hex>, used like a Fanolab operation id
+    source_url = Column(Text, nullable=False)
+    sample_rate = Column(Integer, nullable=False)
+    duration_seconds = Column(Float, nullable=False)
+    chunks = Column(JSONB, nullable=False)  # [{"operation_id", "audio_start", "keep_start", "keep_end"}], in time order
+    audio_store = Column(String(16))  # Blob store of audio_blob
+    audio_blob = Column(Text)  # Converted recording in TEMP_AUDIO_CONTAINER, read to reconcile speakers; NULL for older jobs
+    created_dt = Column(TIMESTAMP, server_default='CURRENT_TIMESTAMP')
+
+class FanolabOffsetMap(Base):
+    __tablename__ = 'fanolab_offset_map'
+
+    sys_id = Column(Integer, primary_key=True, autoincrement=True)
+    fanolab_id = Column(String(255), nullable=False, unique=True)  # Operation or chunked job submitted without its silences
+    offset_map = Column(JSONB, nullable=False)  # {"kept": [[start, end], ...], "original_duration"} in original seconds
+    original_duration = Column(Float, nullable=False)
+    submitted_duration = Column(Float, nullable=False)  # Seconds sent to Fanolab and charged to the tenant
+    created_dt = Column(TIMESTAMP, server_default='CURRENT_TIMESTAMP')
+
+class UploadSession(Base):
+    __tablename__ = 'upload_session'
+
+    sys_id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String(64), nullable=False, unique=True)
+    store = Column(String(16), nullable=False)  # Blob store of the upload: azure / minio / local
+    container = Column(String(255), nullable=False)
+    blob_name = Column(Text, nullable=False)
+    upload_id = Column(Text, nullable=False)  # Multipart upload of the store, one part per chunk
+    filename = Column(Text)
+    size = Column(BigInteger, nullable=False)
+    chunk_size = Column(BigInteger, nullable=False)
+    status = Column(String(16), nullable=False, default='uploading')  # uploading / completing / completed / aborted
+    created_dt = Column(TIMESTAMP, server_default='CURRENT_TIMESTAMP')
+    updated_dt = Column(TIMESTAMP)  # Last chunk received
+    expires_dt = Column(TIMESTAMP, nullable=False)
+    completed_dt = Column(TIMESTAMP)
@@ -0,0 +1,214 @@
+from array import array
+from typing import Optional
+import numpy as np
+
+from src.utilities import format_time
+
+# Output formats of transcription results
+OUTPUT_FORMATS = ("legacy", "structured", "columnar")
+# Kept in stored results to re-match voiceprints without the audio, never part of the output
+STORED_ONLY_KEYS = ("speaker_embeddings", "embedding_model_version")
+# Consecutive phrases of one speaker separated by at most this many seconds are merged in structured / columnar output
+MERGE_GAP_SECONDS = 1.5
+
+
+class SegmentTable:
+    """
+    Transcript segments stored column-wise: start / end seconds, speaker id and word count as parallel numpy arrays,
+    and all texts in one string sliced by text_offsets. Built once per transcript and used for speaker stats,
+    top-k clip selection and every output format, instead of a dict per segment plus formatted strings.
+    """
+
+    def __init__(self, start: np.ndarray, end: np.ndarray, speaker: np.ndarray, words: np.ndarray,
+                 text_offsets: np.ndarray, text: str):
+        self.start = start
+        self.end = end
+        self.speaker = speaker
+        self.words = words
+        self.text_offsets = text_offsets
+        self.text = text
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    @property
+    def durations(self) -> np.ndarray:
+        return self.end - self.start
+
+    def text_at(self, index: int) -> str:
+        return self.text[self.text_offsets[index]:self.text_offsets[index + 1]]
+
+    def texts(self) -> list:
+        return [self.text_at(i) for i in range(len(self))]
+
+    def speakers(self) -> list:
+        """Speaker ids in order of first appearance."""
+        ids, first_index = np.unique(self.speaker, return_index=True)
+        return [int(speaker) for speaker in ids[np.argsort(first_index)]]
+
+    def speaker_stats(self, total_duration: float) -> dict:
+        """
+        Per speaker talk time, words, share of total_duration and speaking rate, without per segment lists.
+
+        Returns:
+            dict: speaker -> {"total_duration", "total_words", "percentage", "words_per_minute"}
+        """
+        totals = {}
+        durations = self.durations
+        for speaker in self.speakers():
+            mask = self.speaker == speaker
+            totals[speaker] = (float(durations[mask].sum()), int(self.words[mask].sum()))
+        return speaker_stats_from_totals(totals, total_duration)
+
+    def top_segments(self, speaker: int, k: int) -> list:
+        """The speaker's k longest segments as (start, end), longest first."""
+        indices = np.flatnonzero(self.speaker == speaker)
+        order = indices[np.argsort(-self.durations[indices], kind="stable")[:k]]
+        return [(float(self.start[i]), float(self.end[i])) for i in order]
+
+    def legacy_segments(self, speaker: int) -> list:
+        """The speaker's segments as the dicts of the legacy speaker_stats, longest first."""
+        return [
+            {"start": start, "end": end, "duration": end - start}
+            for start, end in self.top_segments(speaker, len(self))
+        ]
+
+    def legacy_lines(self) -> list:
+        """The legacy "Speaker-1 (00:00:10 - 00:00:15): text" lines."""
+        return [
+            f"Speaker-{int(self.speaker[i])} ({format_time(self.start[i])} - {format_time(self.end[i])}): {self.text_at(i)}"
+            for i in range(len(self))
+        ]
+
+    def merged(self, max_gap: float = MERGE_GAP_SECONDS) -> "SegmentTable":
+        """Merge runs of consecutive segments by the same speaker separated by at most max_gap seconds."""
+        if len(self) == 0:
+            return self
+        # A run starts where the speaker changes or the pause since the previous segment is too long
+        starts_run = np.ones(len(self), dtype=bool)
+        starts_run[1:] = (self.speaker[1:] != self.speaker[:-1]) | (self.start[1:] - self.end[:-1] > max_gap)
+        run_starts = np.flatnonzero(starts_run)
+        run_ends = np.append(run_starts[1:], len(self)) - 1
+
+        builder = SegmentTableBuilder()
+        for first, last in zip(run_starts, run_ends):
+            text = " ".join(self.text_at(i) for i in range(first, last + 1))
+            builder.append(int(self.speaker[first]), float(self.start[first]), float(self.end[first:last + 1].max()), text)
+        return builder.build()
+
+    def to_columnar(self, precision: int = 3) -> dict:
+        """Parallel arrays, the compact structured output and storage format."""
+        return {
+            "speaker": self.speaker.tolist(),
+            "start": np.round(self.start, precision).tolist(),
+            "end": np.round(self.end, precision).tolist(),
+            "text": self.texts(),
+        }
+
+    def to_records(self, precision: int = 3) -> list:
+        """One {"speaker", "start", "end", "text"} dict per segment."""
+        columns = self.to_columnar(precision)
+        return [
+            {"speaker": speaker, "start": start, "end": end, "text": text}
+            for speaker, start, end, text in zip(columns["speaker"], columns["start"], columns["end"], columns["text"])
+        ]
+
+    @classmethod
+    def from_columnar(cls, columns: dict) -> "SegmentTable":
+        builder = SegmentTableBuilder()
+        for speaker, start, end, text in zip(columns["speaker"], columns["start"], columns["end"], columns["text"]):
+            builder.append(speaker, start, end, text)
+        return builder.build()
+
+
+def speaker_stats_from_totals(totals: dict, total_duration: float) -> dict:
+    """speaker -> (talk time, words) as the speaker_stats dicts, see SegmentTable.speaker_stats."""
+    return {
+        speaker: {
+            "total_duration": speaker_duration,
+            "total_words": speaker_words,
+            "percentage": (speaker_duration / total_duration) * 100 if total_duration > 0 else 0,
+            "words_per_minute": (speaker_words / speaker_duration) * 60 if speaker_duration > 0 else 0,
+        }
+        for speaker, (speaker_duration, speaker_words) in totals.items()
+    }
+
+
+class SegmentTableBuilder:
+    """Appends segments into typed arrays, then freezes them into a SegmentTable. Speaker totals are kept as segments arrive."""
+
+    def __init__(self):
+        self._start = array("d")
+        self._end = array("d")
+        self._speaker = array("i")
+        self._words = array("i")
+        self._offsets = array("q", [0])
+        self._texts = []
+        self._speaker_totals = {}  # speaker -> [talk time, words], in order of first appearance
+
+    def append(self, speaker: int, start: float, end: float, text: str) -> None:
+        words = len(text.split())
+        self._speaker.append(int(speaker))
+        self._start.append(start)
+        self._end.append(end)
+        self._words.append(words)
+        self._texts.append(text)
+        self._offsets.append(self._offsets[-1] + len(text))
+        totals = self._speaker_totals.setdefault(int(speaker), [0.0, 0])
+        totals[0] += end - start
+        totals[1] += words
+
+    def speaker_stats(self, total_duration: float) -> dict:
+        """SegmentTable.speaker_stats of the segments appended so far, from the running totals."""
+        return speaker_stats_from_totals(self._speaker_totals, total_duration)
+
+    def build(self, sort: bool = False) -> SegmentTable:
+        """
+        Args:
+            sort: Order the segments by start time (stable), for providers that do not return them in order
+        """
+        table = SegmentTable(
+            start=np.frombuffer(self._start, dtype=np.float64).copy(),
+            end=np.frombuffer(self._end, dtype=np.float64).copy(),
+            speaker=np.frombuffer(self._speaker, dtype=np.int32).copy(),
+            words=np.frombuffer(self._words, dtype=np.int32).copy(),
+            text_offsets=np.frombuffer(self._offsets, dtype=np.int64).copy(),
+            text="".join(self._texts),
+        )
+        if sort and len(table) and np.any(np.diff(table.start) < 0):
+            order = np.argsort(table.start, kind="stable")
+            builder = SegmentTableBuilder()
+            for i in order:
+                builder.append(int(table.speaker[i]), float(table.start[i]), float(table.end[i]), table.text_at(i))
+            return builder.build()
+        return table
+
+
+def render_transcript(result: dict, output_format: Optional[str] = "legacy") -> dict:
+    """
+    Render a stored transcription result in the requested output format:
+        legacy: "transcriptions" as "Speaker-N (hh:mm:ss - hh:mm:ss): text" lines and per speaker segment lists
+        structured: "transcriptions" as merged {"speaker", "start", "end", "text"} records
+        columnar: "segments" as merged parallel arrays
+
+    Results stored before segment tables only have the legacy form and are returned as they are.
+    """
+    output_format = output_format or "legacy"
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {', '.join(OUTPUT_FORMATS)}")
+    if "segments" not in result:
+        return result
+
+    rendered = {key: value for key, value in result.items() if key != "segments" and key not in STORED_ONLY_KEYS}
+    table = SegmentTable.from_columnar(result["segments"])
+    if output_format == "legacy":
+        rendered["transcriptions"] = table.legacy_lines()
+        rendered["speaker_stats"] = {
+            speaker: {**stats, "segments": table.legacy_segments(int(speaker))}
+            for speaker, stats in result["speaker_stats"].items()
+        }
+    elif output_format == "structured":
+        rendered["transcriptions"] = table.merged().to_records()
+    else:
+        rendered["segments"] = table.merged().to_columnar()
+    return rendered
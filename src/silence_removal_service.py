@@ -0,0 +1,179 @@
+import os
+from dotenv import load_dotenv
+from typing import Optional
+import numpy as np
+import librosa
+import soundfile
+import webrtcvad
+from sqlalchemy import create_engine, select, update, delete
+from sqlalchemy.orm import sessionmaker
+
+from src.models import FanolabOffsetMap
+from src.db_config import get_database_url
+
+# Load environment variables
+load_dotenv()
+
+# Submissions with remove_silence drop non-speech spans at least this long, providers bill on submitted duration
+SILENCE_MIN_SECONDS = float(os.getenv("SILENCE_MIN_SECONDS", "5"))
+SILENCE_PADDING_SECONDS = 0.5  # Kept on either side of a removed span, so words at its edges stay whole
+VAD_AGGRESSIVENESS = int(os.getenv("VAD_AGGRESSIVENESS", "2"))  # webrtcvad mode, 0 (least) to 3 (most aggressive)
+VAD_FRAME_SECONDS = 0.03
+VAD_SAMPLE_RATES = (8000, 16000, 32000, 48000)
+VAD_RESAMPLE_RATE = 16000  # Recordings at other rates are resampled to this for detection only
+VAD_READ_SECONDS = 60  # Audio decoded per read
+
+DATABASE_URL = get_database_url()
+
+# Create database engine
+engine = create_engine(DATABASE_URL, connect_args={'client_encoding': 'utf8'})
+Session = sessionmaker(bind=engine)
+
+
+class OffsetMap:
+    """
+    The spans of the original recording kept in the condensed audio, in order. Times of the condensed audio are
+    mapped back onto the original timeline; an end time on a cut maps to the end of the span before it.
+    """
+
+    def __init__(self, kept_start: np.ndarray, kept_end: np.ndarray, original_duration: float):
+        self.kept_start = np.asarray(kept_start, dtype=np.float64)
+        self.kept_end = np.asarray(kept_end, dtype=np.float64)
+        self.original_duration = original_duration
+        lengths = self.kept_end - self.kept_start
+        self.condensed_start = np.concatenate(([0.0], np.cumsum(lengths)[:-1]))
+        self.condensed_duration = float(lengths.sum())
+
+    @property
+    def removed_seconds(self) -> float:
+        return self.original_duration - self.condensed_duration
+
+    def to_original(self, times, is_end: bool = False) -> np.ndarray:
+        times = np.asarray(times, dtype=np.float64)
+        span = np.clip(np.searchsorted(self.condensed_start, times, side="left" if is_end else "right") - 1, 0, len(self.kept_start) - 1)
+        return np.minimum(self.kept_start[span] + times - self.condensed_start[span], self.kept_end[span])
+
+    def to_json(self) -> dict:
+        return {"kept": np.stack([self.kept_start, self.kept_end], axis=1).round(3).tolist(), "original_duration": self.original_duration}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "OffsetMap":
+        kept = np.asarray(data["kept"], dtype=np.float64).reshape(-1, 2)
+        return cls(kept[:, 0], kept[:, 1], data["original_duration"])
+
+
+def detect_speech(wav_path: str) -> np.ndarray:
+    """webrtcvad speech flag of every VAD_FRAME_SECONDS frame, decoded in blocks rather than at once."""
+    vad = webrtcvad.Vad(VAD_AGGRESSIVENESS)
+    flags = []
+    with soundfile.SoundFile(wav_path) as meeting:
+        vad_rate = meeting.samplerate if meeting.samplerate in VAD_SAMPLE_RATES else VAD_RESAMPLE_RATE
+        frame_length = int(vad_rate * VAD_FRAME_SECONDS)
+        pending = np.zeros(0, dtype=np.int16)  # Samples left over from the previous block
+        for block in meeting.blocks(blocksize=meeting.samplerate * VAD_READ_SECONDS, dtype="float32", always_2d=True):
+            mono = block.mean(axis=1)
+            if vad_rate != meeting.samplerate:
+                mono = librosa.resample(mono, orig_sr=meeting.samplerate, target_sr=vad_rate, res_type="polyphase")
+            pending = np.concatenate((pending, (np.clip(mono, -1, 1) * 32767).astype("<i2")))
+            frame_count = len(pending) // frame_length
+            for frame in pending[:frame_count * frame_length].reshape(frame_count, frame_length):
+                flags.append(vad.is_speech(frame.tobytes(), vad_rate))
+            pending = pending[frame_count * frame_length:]
+    return np.asarray(flags, dtype=bool)
+
+
+def find_silences(speech: np.ndarray, min_seconds: float = SILENCE_MIN_SECONDS) -> list:
+    """Non-speech runs of at least min_seconds as (start, end) seconds, less SILENCE_PADDING_SECONDS at either end."""
+    # Run edges of the non-speech flags, padded so runs at the start and end are closed
+    edges = np.diff(np.concatenate(([0], (~speech).astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    return [
+        (start * VAD_FRAME_SECONDS + SILENCE_PADDING_SECONDS, end * VAD_FRAME_SECONDS - SILENCE_PADDING_SECONDS)
+        for start, end in zip(starts, ends)
+        if (end - start) * VAD_FRAME_SECONDS >= max(min_seconds, 2 * SILENCE_PADDING_SECONDS)
+    ]
+
+
+def remove_silences(wav_path: str, output_path: str, duration_seconds: float) -> Optional[OffsetMap]:
+    """
+    Write the recording without its long non-speech spans as 16-bit PCM WAV.
+
+    Returns:
+        OffsetMap: From the written audio back to the recording, None when nothing was removed and nothing written
+    """
+    silences = find_silences(detect_speech(wav_path))
+    if not silences:
+        return None
+
+    bounds = np.asarray(silences).ravel()
+    offset_map = OffsetMap(np.concatenate(([0.0], bounds[1::2])), np.concatenate((bounds[0::2], [duration_seconds])), duration_seconds)
+    with soundfile.SoundFile(wav_path) as meeting, \
+            soundfile.SoundFile(output_path, "w", meeting.samplerate, meeting.channels, subtype="PCM_16", format="WAV") as condensed:
+        for start, end in zip(offset_map.kept_start, offset_map.kept_end):
+            meeting.seek(min(int(start * meeting.samplerate), meeting.frames))
+            condensed.write(meeting.read(max(0, int(end * meeting.samplerate) - int(start * meeting.samplerate)), dtype="int16", always_2d=True))
+    return offset_map
+
+
+def _remap_time(value, offset_map: OffsetMap, is_end: bool) -> str:
+    # Fanolab times are strings with a trailing "s", e.g. "10.420s"
+    try:
+        seconds = float(str(value).rstrip("s"))
+    except ValueError:
+        seconds = 0.0
+    return f"{float(offset_map.to_original(seconds, is_end)):.3f}s"
+
+
+def remap_alternative(alternative: dict, offset_map: OffsetMap) -> dict:
+    """A Fanolab alternative with its own and its words' times moved onto the original timeline."""
+    remapped = dict(alternative)
+    for key, is_end in (("startTime", False), ("endTime", True)):
+        if key in remapped:
+            remapped[key] = _remap_time(remapped[key], offset_map, is_end)
+    if remapped.get("words"):
+        remapped["words"] = [
+            {**word, **{key: _remap_time(word[key], offset_map, is_end) for key, is_end in (("startTime", False), ("endTime", True)) if key in word}}
+            for word in remapped["words"]
+        ]
+    return remapped
+
+
+def remap_operation(operation: dict, offset_map: OffsetMap) -> dict:
+    """A done Fanolab operation of condensed audio with every result on the original timeline."""
+    results = [
+        {**result, "alternatives": [remap_alternative(alternative, offset_map) for alternative in result.get("alternatives", [])]}
+        for result in operation.get("response", {}).get("results", [])
+    ]
+    return {**operation, "response": {**operation.get("response", {}), "results": results}}
+
+
+def save_offset_map(fanolab_id: str, offset_map: OffsetMap) -> None:
+    with Session() as session:
+        session.add(FanolabOffsetMap(
+            fanolab_id=fanolab_id,
+            offset_map=offset_map.to_json(),
+            original_duration=offset_map.original_duration,
+            submitted_duration=offset_map.condensed_duration
+        ))
+        session.commit()
+
+
+def link_offset_map(pending_id: str, fanolab_id: str) -> None:
+    """Move an offset map saved before submission to the operation or chunked job id Fanolab's submission returned."""
+    with Session() as session:
+        session.execute(update(FanolabOffsetMap).where(FanolabOffsetMap.fanolab_id == pending_id).values(fanolab_id=fanolab_id))
+        session.commit()
+
+
+def discard_offset_map(pending_id: str) -> None:
+    """Delete an offset map saved before a submission that was not accepted."""
+    with Session() as session:
+        session.execute(delete(FanolabOffsetMap).where(FanolabOffsetMap.fanolab_id == pending_id))
+        session.commit()
+
+
+def get_offset_map(fanolab_id: str) -> Optional[OffsetMap]:
+    """The offset map of an operation or chunked job submitted without its silences, None for other submissions."""
+    with Session() as session:
+        data = session.execute(select(FanolabOffsetMap.offset_map).where(FanolabOffsetMap.fanolab_id == fanolab_id)).scalar()
+    return OffsetMap.from_json(data) if data is not None else None
@@ -0,0 +1,190 @@
+import io
+import os
+import wave
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from typing import Callable, BinaryIO, Optional
+import numpy as np
+import librosa
+import soundfile
+from pydub import AudioSegment
+
+from src.segment_table import SegmentTable
+
+# Load environment variables
+load_dotenv()
+
+CLIPS_PER_SPEAKER = 3  # Longest segments of each speaker
+WAV_READ_FRAMES = 64 * 1024  # Frames copied per read when cutting a clip
+
+# Clip format -> (file extension, soundfile format, soundfile subtype); WAV clips are copied without encoding
+CLIP_FORMATS = {
+    "wav": (".wav", None, None),
+    "flac": (".flac", "FLAC", "PCM_16"),  # Lossless
+    "opus": (".opus", "OGG", "OPUS"),
+}
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+OPUS_RESAMPLE_RATE = 16000  # Other sample rates are resampled to this for Opus, enough for speech
+CLIP_ENCODE_WORKERS = int(os.getenv("CLIP_ENCODE_WORKERS", "4"))
+
+
+def select_speaker_clips(segments: SegmentTable, speakers, clips_per_speaker: int = CLIPS_PER_SPEAKER) -> list:
+    """
+    The longest segments of each speaker, ordered by start time so the meeting is read front to back once.
+
+    Returns:
+        list: (clip name, start seconds, end seconds), clip names as speaker_<n>_segment_<i>
+    """
+    clips = []
+    for speaker in speakers:
+        for i, (start, end) in enumerate(segments.top_segments(speaker, clips_per_speaker)):
+            clips.append((f"speaker_{speaker}_segment_{i}", start, end))
+    return sorted(clips, key=lambda clip: clip[1])
+
+
+def _write_wav_clip(target: BinaryIO, meeting: wave.Wave_read, start: float, end: float) -> None:
+    """Copy the frames between start and end of an open PCM WAV into target as a WAV file."""
+    frame_rate = meeting.getframerate()
+    first_frame = min(max(0, int(start * frame_rate)), meeting.getnframes())
+    frame_count = max(0, min(int(end * frame_rate), meeting.getnframes()) - first_frame)
+
+    with wave.open(target, "wb") as clip:
+        clip.setnchannels(meeting.getnchannels())
+        clip.setsampwidth(meeting.getsampwidth())
+        clip.setframerate(frame_rate)
+        clip.setnframes(frame_count)  # Header written upfront, the zip member stream cannot seek back
+        meeting.setpos(first_frame)
+        remaining = frame_count
+        while remaining > 0:
+            frames = meeting.readframes(min(WAV_READ_FRAMES, remaining))
+            if not frames:
+                break
+            clip.writeframesraw(frames)  # writeframes would patch the header after each partial write
+            remaining -= len(frames) // (meeting.getnchannels() * meeting.getsampwidth())
+
+
+def _read_clip_samples(meeting_wav_path: str, clips: list):
+    """Yield the 16-bit samples of each clip as (frames, channels) arrays with their sample rate, in clip order."""
+    try:
+        meeting = wave.open(meeting_wav_path, "rb")
+    except (wave.Error, EOFError):
+        meeting = None
+
+    if meeting is not None and meeting.getsampwidth() == 2:
+        with meeting:
+            frame_rate, channels = meeting.getframerate(), meeting.getnchannels()
+            for clip_name, start, end in clips:
+                first_frame = min(max(0, int(start * frame_rate)), meeting.getnframes())
+                meeting.setpos(first_frame)
+                frames = meeting.readframes(max(0, min(int(end * frame_rate), meeting.getnframes()) - first_frame))
+                yield clip_name, np.frombuffer(frames, dtype="<i2").reshape(-1, channels), frame_rate
+        return
+    if meeting is not None:
+        meeting.close()
+
+    audio = AudioSegment.from_file(meeting_wav_path).set_sample_width(2)
+    for clip_name, start, end in clips:
+        segment = audio[start * 1000:end * 1000]
+        yield clip_name, np.frombuffer(segment.raw_data, dtype="<i2").reshape(-1, audio.channels), audio.frame_rate
+
+
+def encode_clip(samples: np.ndarray, sample_rate: int, clip_format: str) -> bytes:
+    """Encode 16-bit (frames, channels) samples in memory as FLAC or Opus."""
+    _, file_format, subtype = CLIP_FORMATS[clip_format]
+    if clip_format == "opus" and sample_rate not in OPUS_SAMPLE_RATES:
+        resampled = librosa.resample(samples.T.astype(np.float32) / 32768, orig_sr=sample_rate, target_sr=OPUS_RESAMPLE_RATE, res_type="polyphase")
+        samples, sample_rate = np.atleast_2d(resampled).T, OPUS_RESAMPLE_RATE
+    encoded = io.BytesIO()
+    soundfile.write(encoded, samples, sample_rate, format=file_format, subtype=subtype)
+    return encoded.getvalue()
+
+
+def write_clip_bundle(meeting_wav_path: str, clips: list, output: BinaryIO, clip_format: str = "wav") -> None:
+    """
+    Cut the clips from the meeting recording straight into a zip written to output, which need not be seekable.
+    PCM WAV recordings are read by frame position without decoding the whole file; other encodings are decoded once.
+
+    Args:
+        clip_format: One of CLIP_FORMATS; FLAC and Opus clips are encoded in parallel, in memory
+    """
+    if clip_format not in CLIP_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(CLIP_FORMATS)}")
+    extension = CLIP_FORMATS[clip_format][0]
+
+    if clip_format != "wav":
+        with zipfile.ZipFile(output, "w") as bundle, ThreadPoolExecutor(max_workers=CLIP_ENCODE_WORKERS) as executor:
+            clip_samples = _read_clip_samples(meeting_wav_path, clips)
+            futures = [
+                (clip_name, executor.submit(encode_clip, samples, sample_rate, clip_format))
+                for clip_name, samples, sample_rate in clip_samples
+            ]
+            # Already compressed, stored as they are
+            for clip_name, future in futures:
+                bundle.writestr(f"{clip_name}{extension}", future.result())
+        return
+
+    with zipfile.ZipFile(output, "w") as bundle:
+        try:
+            meeting = wave.open(meeting_wav_path, "rb")
+        except (wave.Error, EOFError):
+            meeting = None
+
+        if meeting is not None:
+            with meeting:
+                for clip_name, start, end in clips:
+                    with bundle.open(f"{clip_name}.wav", "w") as member:
+                        _write_wav_clip(member, meeting, start, end)
+        else:
+            audio = AudioSegment.from_file(meeting_wav_path)
+            for clip_name, start, end in clips:
+                # pydub seeks in its output, so each clip is encoded in memory before it is written to the zip
+                clip = audio[start * 1000:end * 1000].export(io.BytesIO(), format="wav")
+                bundle.writestr(f"{clip_name}.wav", clip.getvalue())
+
+
+def upload_clip_bundle(meeting_wav_path: str, clips: list, upload: Callable[[BinaryIO], str], clip_format: str = "wav",
+                       discard: Optional[Callable[[], None]] = None) -> str:
+    """
+    Build the clip bundle and upload it while it is being written: the zip goes through a pipe into upload,
+    which streams it to blob storage in parts, so neither the clips nor the zip are written to disk.
+
+    Args:
+        meeting_wav_path: Local WAV of the meeting
+        clips: (clip name, start, end), see select_speaker_clips
+        upload: Uploads a readable stream of unknown length and returns its download URL
+        clip_format: wav, flac or opus
+        discard: Deletes what upload stored; a writer that fails closes the pipe like a finished zip, so upload
+            stores a truncated bundle, which is discarded before the error is raised
+
+    Returns:
+        str: The download URL returned by upload
+    """
+    read_fd, write_fd = os.pipe()
+    writer_error = []
+
+    def write():
+        try:
+            with os.fdopen(write_fd, "wb") as pipe_writer:
+                write_clip_bundle(meeting_wav_path, clips, pipe_writer, clip_format)
+        except Exception as e:
+            writer_error.append(e)
+
+    writer = threading.Thread(target=write, name="speaker-clip-bundle", daemon=True)
+    writer.start()
+    try:
+        with os.fdopen(read_fd, "rb") as pipe_reader:
+            download_url = upload(pipe_reader)
+    finally:
+        # Closing the reader unblocks a writer whose upload failed
+        writer.join()
+
+    if writer_error:
+        if discard is not None:
+            try:
+                discard()
+            except Exception as e:
+                print(f"Failed to discard the incomplete clip bundle: {e}")
+        raise writer_error[0]
+    return download_url
@@ -1,11 +1,11 @@
 ﻿import os
 from dotenv import load_dotenv
-import requests
 import json
 from collections import defaultdict
 from enum import Enum
 import urllib.parse
 from src.enums import Dashboard, OnPremiseMode
+from src import http_client
 
 # Load environment variables
 load_dotenv()
@@ -57,7 +57,7 @@ def get_project_list(request):
         "filters": []
     }
     # Send request to Get Meeting Minutes List API
-    response = requests.post(f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=payload)
+    response = http_client.post(http_client.TFLOW, f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=payload, retry=True)
 
     output_list = []
     if response and response.status_code == 200:
@@ -88,7 +88,7 @@ def get_project_list(request):
                     }
                 ]
             }
-            response_glossary = requests.post(f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=glossary_payload)
+            response_glossary = http_client.post(http_client.TFLOW, f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=glossary_payload, retry=True)
 
             glossary_data = response_glossary.json().get("data", {}).get("rows", [])
 
@@ -150,7 +150,7 @@ def get_project_memory(request):
         ]
     }
     # Send request to Get Project Memory List API
-    response = requests.post(f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=payload)
+    response = http_client.post(http_client.TFLOW, f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=payload, retry=True)
 
     output_list = []
     if response and response.status_code == 200:
@@ -208,7 +208,7 @@ def get_meeting_minutes(request):
         ]
     }
     # Send request to Get Meeting Minutes List API
-    response = requests.post(f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=payload)
+    response = http_client.post(http_client.TFLOW, f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=payload, retry=True)
 
     if response:
         meeting_minutes_data = response.json()
@@ -232,7 +232,7 @@ def get_meeting_minutes(request):
                 }
             ]
         }
-        response_speaker_map = requests.post(f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=speaker_payload)
+        response_speaker_map = http_client.post(http_client.TFLOW, f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=speaker_payload, retry=True)
 
         speaker_map_data = response_speaker_map.json().get("data", {}).get("rows", [])
         output_speaker_data_list = []
@@ -358,7 +358,7 @@ def get_dashboard(request):
             })
 
         # Send request to Get Project Memory List API
-        response = requests.post(f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=payload)
+        response = http_client.post(http_client.TFLOW, f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=payload, retry=True)
         # Dictionaries to hold summaries
         duration_by_project = defaultdict(int)
         meeting_count_by_project = defaultdict(int)
@@ -464,7 +464,7 @@ def get_dashboard(request):
             "filters": []
         }
         # Send request to Get Project Memory List API
-        response = requests.post(f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=payload)
+        response = http_client.post(http_client.TFLOW, f"{TFLOW_HOST}/api/v2/open/worksheet/getFilterRows", json=payload, retry=True)
 
         # Dictionaries to hold summaries
         project_time_by_staff = defaultdict(lambda: defaultdict(int))
@@ -0,0 +1,195 @@
+import re
+import json
+import codecs
+from typing import Iterable, Iterator, Optional
+
+from src.segment_table import SegmentTableBuilder
+
+# Top level values of an Azure transcription document kept besides recognizedPhrases, everything else
+# (combinedRecognizedPhrases with the full text of every channel, timestamps...) is skipped without being decoded
+HEADER_KEYS = ("source", "durationMilliseconds", "durationInTicks")
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"\s*")
+_STRUCTURE = re.compile(r'["\[\]{}]')
+_STRING_END = re.compile(r'["\\]')
+_NUMBER_CHARACTERS = frozenset("0123456789+-.eE")
+
+
+class _StreamBuffer:
+    """
+    Text buffer over a byte stream. Consumed text is dropped whenever more is read,
+    so the buffer only ever holds the value being decoded plus one chunk.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._eof = False
+        self.text = ""
+        self.pos = 0
+
+    def fill(self) -> bool:
+        """Read more text, returns False at the end of the stream."""
+        self.text = self.text[self.pos:]
+        self.pos = 0
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            decoded = self._decoder.decode(chunk)
+            if decoded:
+                self.text += decoded
+                return True
+        self._eof = True
+        decoded = self._decoder.decode(b"", final=True)
+        self.text += decoded
+        return bool(decoded)
+
+    def peek(self) -> str:
+        """The next non whitespace character, without consuming it."""
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of transcription JSON")
+
+    def expect(self, character: str) -> None:
+        found = self.peek()
+        if found != character:
+            raise ValueError(f"Invalid transcription JSON: expected {character!r}, found {found!r}")
+        self.pos += 1
+
+    def decode_value(self):
+        """Decode the next JSON value, reading until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.text, self.pos)
+                # A number cut at the end of the buffer decodes as a shorter number, only trust it once followed by a delimiter
+                if self._eof or (end < len(self.text) and self.text[end] not in _NUMBER_CHARACTERS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            if not self.fill():
+                value, self.pos = _DECODER.raw_decode(self.text, self.pos)
+                return value
+
+    def skip_value(self) -> None:
+        """Skip the next JSON value, scanning for its end without building it."""
+        if self.peek() not in "[{\"":
+            self.decode_value()  # Numbers, true, false and null are short
+            return
+
+        depth = 0
+        in_string = False
+        while True:
+            match = (_STRING_END if in_string else _STRUCTURE).search(self.text, self.pos)
+            if match is None:
+                self.pos = len(self.text)
+            elif in_string and match.group() == "\\":
+                if match.end() < len(self.text):
+                    self.pos = match.end() + 1  # Skip the escaped character
+                    continue
+                self.pos = match.start()  # The escaped character is in the next chunk, keep the backslash
+            else:
+                character = match.group()
+                if in_string:
+                    in_string = False
+                elif character == '"':
+                    in_string = True
+                elif character in "[{":
+                    depth += 1
+                else:
+                    depth -= 1
+                self.pos = match.end()
+                if depth == 0 and not in_string:
+                    return
+                continue
+            if not self.fill():
+                raise ValueError("Unexpected end of transcription JSON")
+
+
+def compact_phrase(phrase: dict) -> dict:
+    """Keep what the meeting minutes use from a recognized phrase: speaker, timing and the top display text."""
+    return {
+        "speaker": phrase.get("speaker"),
+        "offsetInTicks": phrase.get("offsetInTicks", 0),
+        "durationInTicks": phrase.get("durationInTicks", 0),
+        "display": (phrase.get("nBest") or [{}])[0].get("display", ""),
+    }
+
+
+def iter_recognized_phrases(chunks: Iterable[bytes], header: Optional[dict] = None) -> Iterator[dict]:
+    """
+    Incrementally parse an Azure transcription document, yielding its recognizedPhrases one at a time as compact phrases.
+    Only one phrase (with its nBest alternatives and word timings) is decoded at a time, so memory stays flat
+    however long the meeting is.
+
+    Args:
+        chunks: The document's bytes, e.g. response.iter_content(chunk_size=...)
+        header: Dict filled with the HEADER_KEYS values found; complete once iteration finishes
+
+    Yields:
+        dict: speaker, offsetInTicks, durationInTicks and display of each phrase
+    """
+    if header is None:
+        header = {}
+    stream = _StreamBuffer(chunks)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+
+    while True:
+        key = stream.decode_value()
+        stream.expect(":")
+        if key == "recognizedPhrases":
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.pos += 1
+            else:
+                while True:
+                    yield compact_phrase(stream.decode_value())
+                    separator = stream.peek()
+                    stream.pos += 1
+                    if separator == "]":
+                        break
+                    if separator != ",":
+                        raise ValueError(f"Invalid transcription JSON: unexpected {separator!r} in recognizedPhrases")
+        elif key in HEADER_KEYS:
+            header[key] = stream.decode_value()
+        else:
+            stream.skip_value()
+
+        separator = stream.peek()
+        stream.pos += 1
+        if separator == "}":
+            return
+        if separator != ",":
+            raise ValueError(f"Invalid transcription JSON: unexpected {separator!r}")
+
+
+def parse_transcription_stream(chunks: Iterable[bytes]) -> dict:
+    """
+    Parse an Azure transcription document into its compact form:
+    {"source", "durationMilliseconds", "durationInTicks", "segments": SegmentTable, "speaker_stats": {...}}
+
+    Each phrase goes into the segment table's typed arrays as soon as it is decoded, and the per speaker talk time
+    and words are summed on the way, so no phrase is kept as a dict and the stats need no second pass.
+    Phrases without a speaker or text are left out.
+    """
+    header = {}
+    builder = SegmentTableBuilder()
+    for phrase in iter_recognized_phrases(chunks, header):
+        speaker = phrase["speaker"]
+        display_text = phrase["display"]
+        offset = phrase["offsetInTicks"] / 10000000  # Convert ticks to seconds
+        duration = phrase["durationInTicks"] / 10000000  # Convert ticks to seconds
+
+        if speaker is not None and display_text:
+            builder.append(speaker, offset, offset + duration, display_text)
+
+    total_duration = header.get("durationMilliseconds", 0) / 1000
+    return {**header, "segments": builder.build(), "speaker_stats": builder.speaker_stats(total_duration)}
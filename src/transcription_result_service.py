@@ -0,0 +1,209 @@
+import os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from typing import Optional
+from urllib.parse import urlsplit
+from sqlalchemy import create_engine, select, update, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import sessionmaker
+
+from src.models import TranscriptionResult
+from src.db_config import get_database_url
+from src.app_owner_control_service import charge_quota
+
+# Load environment variables
+load_dotenv()
+
+# A result still "processing" after this long belongs to a request that died, another poll may take it over
+PROCESSING_TIMEOUT = timedelta(minutes=int(os.getenv("TRANSCRIPTION_RESULT_PROCESSING_TIMEOUT_MINUTES", "30")))
+
+DATABASE_URL = get_database_url()
+
+# Create database engine
+engine = create_engine(DATABASE_URL, connect_args={'client_encoding': 'utf8'})
+Session = sessionmaker(bind=engine)
+
+
+class TranscriptionResultInProgress(Exception):
+    """Another request is processing the same transcribed file."""
+
+
+def source_key(url: Optional[str]) -> str:
+    """A transcribed file's URL without its SAS query, stable across re-signed URLs of the same blob."""
+    if not url:
+        return ""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+
+def result_to_dict(result: TranscriptionResult) -> dict:
+    return {
+        "source_key": result.source_key,
+        "confidence_threshold": result.confidence_threshold,
+        "total_duration": result.total_duration,
+        "charged_hours": result.charged_hours,
+        "result": result.result_json,
+        "completed_dt": result.completed_dt.isoformat() if result.completed_dt else None,
+    }
+
+
+def get_transcription_results(provider: str, job_id: str, application_owner: str) -> dict:
+    """
+    Get the completed results of a transcription job.
+
+    Returns:
+        dict: source_key -> result dict
+    """
+    with Session() as session:
+        results = session.execute(
+            select(TranscriptionResult).where(
+                TranscriptionResult.provider == provider,
+                TranscriptionResult.job_id == job_id,
+                TranscriptionResult.application_owner == application_owner,
+                TranscriptionResult.status == "completed"
+            )
+        ).scalars().all()
+        return {result.source_key: result_to_dict(result) for result in results}
+
+
+def claim_transcription_result(provider: str, job_id: str, key: str, application_owner: str) -> bool:
+    """
+    Reserve a transcribed file for processing, so concurrent polls of the same job compute and charge it once.
+    A claim left by a request that stopped heartbeating for PROCESSING_TIMEOUT is taken over.
+
+    Returns:
+        bool: True if this request should process the file
+    """
+    now = datetime.now()
+    statement = insert(TranscriptionResult).values(
+        provider=provider,
+        job_id=job_id,
+        source_key=key,
+        application_owner=application_owner,
+        status="processing",
+        charged_hours=0,
+        heartbeat_dt=now
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=["provider", "job_id", "source_key", "application_owner"],
+        set_={"heartbeat_dt": now},
+        where=(TranscriptionResult.status == "processing") & (TranscriptionResult.heartbeat_dt < now - PROCESSING_TIMEOUT)
+    ).returning(TranscriptionResult.sys_id)
+
+    with Session() as session:
+        claimed = session.execute(statement).first() is not None
+        session.commit()
+        return claimed
+
+
+def complete_transcription_result(provider: str, job_id: str, key: str, application_owner: str, result: dict,
+                                  confidence_threshold: Optional[float], charged_hours: float = 0) -> None:
+    """Store the computed result of a claimed file, with the quota hours charged for it."""
+    with Session() as session:
+        session.execute(
+            update(TranscriptionResult)
+            .where(
+                TranscriptionResult.provider == provider,
+                TranscriptionResult.job_id == job_id,
+                TranscriptionResult.source_key == key,
+                TranscriptionResult.application_owner == application_owner
+            )
+            .values(
+                status="completed",
+                result_json=result,
+                total_duration=result.get("total_duration"),
+                confidence_threshold=confidence_threshold,
+                charged_hours=charged_hours,
+                heartbeat_dt=datetime.now(),
+                completed_dt=datetime.now()
+            )
+        )
+        session.commit()
+
+
+def charge_transcription_results(provider: str, job_id: str, application_owner: str, results: list,
+                                 confidence_threshold: Optional[float]) -> tuple[bool, str]:
+    """
+    Complete claimed files and charge their hours to the application owner in one transaction, so a request
+    that dies in between leaves neither the charge nor the results behind. Files no longer claimed, e.g. completed
+    by a request that retook the claim after PROCESSING_TIMEOUT, are skipped and never charged twice.
+
+    Args:
+        results: (source_key, result) of each newly processed file, charged by its total_duration
+
+    Returns:
+        tuple: (is_allowed: bool, message: str), nothing is stored when the quota is not allowed
+    """
+    with Session() as session:
+        claimed = {
+            row.source_key: row for row in session.execute(
+                select(TranscriptionResult).where(
+                    TranscriptionResult.provider == provider,
+                    TranscriptionResult.job_id == job_id,
+                    TranscriptionResult.application_owner == application_owner,
+                    TranscriptionResult.source_key.in_([key for key, _ in results]),
+                    TranscriptionResult.status == "processing"
+                ).with_for_update()
+            ).scalars().all()
+        }
+        if not claimed:
+            return True, "Already charged"
+
+        charges = {key: round(result["total_duration"] / 3600, 4) for key, result in results if key in claimed}
+        is_allowed, message = charge_quota(session, application_owner, sum(charges.values()))
+        if not is_allowed:
+            session.rollback()
+            return False, message
+
+        now = datetime.now()
+        for key, result in results:
+            row = claimed.get(key)
+            if row is None:
+                continue
+            row.status = "completed"
+            row.result_json = result
+            row.total_duration = result.get("total_duration")
+            row.confidence_threshold = confidence_threshold
+            row.charged_hours = charges[key]
+            row.heartbeat_dt = now
+            row.completed_dt = now
+        session.commit()
+        return True, message
+
+
+def update_transcription_matches(provider: str, job_id: str, key: str, application_owner: str, result: dict,
+                                 confidence_threshold: Optional[float]) -> None:
+    """Replace a completed result recomputed with another confidence threshold, without touching charged_hours."""
+    with Session() as session:
+        session.execute(
+            update(TranscriptionResult)
+            .where(
+                TranscriptionResult.provider == provider,
+                TranscriptionResult.job_id == job_id,
+                TranscriptionResult.source_key == key,
+                TranscriptionResult.application_owner == application_owner,
+                TranscriptionResult.status == "completed"
+            )
+            .values(result_json=result, confidence_threshold=confidence_threshold)
+        )
+        session.commit()
+
+
+def release_transcription_result(provider: str, job_id: str, key: str, application_owner: str) -> None:
+    """Drop a claim whose processing failed or was not allowed, so a later poll retries it."""
+    with Session() as session:
+        session.execute(
+            delete(TranscriptionResult).where(
+                TranscriptionResult.provider == provider,
+                TranscriptionResult.job_id == job_id,
+                TranscriptionResult.source_key == key,
+                TranscriptionResult.application_owner == application_owner,
+                TranscriptionResult.status == "processing"
+            )
+        )
+        session.commit()
+
+
+def needs_rematch(stored: dict, confidence_threshold: Optional[float]) -> bool:
+    """A stored result is reused unless the caller asks for a different confidence threshold."""
+    return confidence_threshold is not None and stored["confidence_threshold"] != confidence_threshold
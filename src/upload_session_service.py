@@ -0,0 +1,259 @@
+import os
+import math
+import uuid
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from typing import Optional
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.orm import sessionmaker
+
+from src.models import UploadSession
+from src.db_config import get_database_url
+from src.blob_store import get_blob_store, MEDIA_CONTAINER
+from src.direct_upload_service import (
+    DIRECT_UPLOAD_EXTENSIONS, DIRECT_UPLOAD_MAX_PARTS, DIRECT_UPLOAD_CONCURRENCY, MEDIA_URL_TTL, plan_part_size
+)
+
+# Load environment variables
+load_dotenv()
+
+# An unfinished session can be resumed for this long, then its chunks are discarded
+UPLOAD_SESSION_TTL = timedelta(hours=int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24")))
+
+DATABASE_URL = get_database_url()
+
+# Create database engine
+engine = create_engine(DATABASE_URL, connect_args={'client_encoding': 'utf8'})
+Session = sessionmaker(bind=engine)
+
+
+def chunk_length(upload: UploadSession, offset: int) -> int:
+    """Bytes of the chunk at offset, the last chunk is shorter."""
+    return min(upload.chunk_size, upload.size - offset)
+
+
+def session_to_dict(upload: UploadSession, received: Optional[dict] = None) -> dict:
+    """
+    State of a session. While uploading, offset is the number of bytes received from the start of the file without
+    a gap, and missing_offsets lists the chunks still to send; chunks sent in parallel may arrive out of order.
+    """
+    result = {
+        "session_id": upload.session_id,
+        "status": upload.status,
+        "size": upload.size,
+        "chunk_size": upload.chunk_size,
+        "concurrency": DIRECT_UPLOAD_CONCURRENCY,
+        "expires_dt": upload.expires_dt.isoformat() if upload.expires_dt else None,
+    }
+    if upload.status == "completed":
+        result["offset"] = upload.size
+        result["sas_url"] = get_blob_store(upload.store).presign(upload.container, upload.blob_name, MEDIA_URL_TTL)
+    elif received is not None:
+        # Chunk offsets, a part counts as received once it has all of its bytes
+        offsets = range(0, upload.size, upload.chunk_size)
+        is_received = [received.get(offset // upload.chunk_size + 1) == chunk_length(upload, offset) for offset in offsets]
+        first_missing = is_received.index(False) if False in is_received else len(is_received)
+        result["offset"] = min(first_missing * upload.chunk_size, upload.size)
+        result["received_bytes"] = sum(chunk_length(upload, offset) for offset, done in zip(offsets, is_received) if done)
+        result["missing_offsets"] = [offset for offset, done in zip(offsets, is_received) if not done]
+    return result
+
+
+def _get_session(session, session_id: str, for_update: bool = False) -> Optional[UploadSession]:
+    query = select(UploadSession).where(UploadSession.session_id == session_id)
+    if for_update:
+        query = query.with_for_update()
+    return session.execute(query).scalar_one_or_none()
+
+
+def _expire(session, upload: UploadSession) -> None:
+    """Discard the chunks of a session that was not finished in time."""
+    try:
+        get_blob_store(upload.store).abort_multipart_upload(upload.container, upload.blob_name, upload.upload_id)
+    except Exception as e:
+        print(f"Failed to abort upload of {upload.blob_name}: {e}")
+    upload.status = "aborted"
+    session.commit()
+
+
+def expire_upload_sessions() -> int:
+    """
+    Abort the multipart uploads of sessions not finished in time, which nobody polls again. Run periodically by
+    the background scheduler; the sessions are claimed in one statement, so each is aborted by one worker.
+
+    Returns:
+        int: Number of sessions expired
+    """
+    with Session() as session:
+        expired = session.execute(
+            update(UploadSession)
+            .where(UploadSession.status == "uploading", UploadSession.expires_dt < datetime.now())
+            .values(status="aborted", updated_dt=datetime.now())
+            .returning(UploadSession.store, UploadSession.container, UploadSession.blob_name, UploadSession.upload_id)
+        ).all()
+        session.commit()
+
+    for store_name, container, blob_name, upload_id in expired:
+        try:
+            get_blob_store(store_name).abort_multipart_upload(container, blob_name, upload_id)
+        except Exception as e:
+            print(f"Failed to abort upload of {blob_name}: {e}")
+    return len(expired)
+
+
+def _set_status(session_id: str, from_status: str, **values) -> None:
+    with Session() as session:
+        session.execute(
+            update(UploadSession)
+            .where(UploadSession.session_id == session_id, UploadSession.status == from_status)
+            .values(**values)
+        )
+        session.commit()
+
+
+def create_upload_session(request):
+    """
+    Start a resumable upload of a recording.
+
+    Args:
+        request: Flask request object containing:
+            - filename: Name of the file, .mp4 or .wav
+            - size: Size of the file in bytes
+
+    Returns:
+        The session, see session_to_dict; chunks of chunk_size bytes are PUT to /upload/sessions/<session_id>?offset=
+    """
+    data = request.get_json(silent=True) or {}
+    filename = data.get("filename") or ""
+    size = data.get("size")
+
+    file_type = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if file_type not in DIRECT_UPLOAD_EXTENSIONS:
+        return {"error": "Unsupported file type. Only MP4 and WAV files are supported."}, 400
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0:  # JSON true is an int in Python
+        return {"error": "size must be a positive number of bytes"}, 400
+
+    store = get_blob_store()
+    blob_name = f"media/{uuid.uuid4()}.{file_type}"
+    upload_id = store.start_multipart_upload(MEDIA_CONTAINER, blob_name, DIRECT_UPLOAD_EXTENSIONS[file_type])
+    now = datetime.now()
+    with Session() as session:
+        upload = UploadSession(
+            session_id=uuid.uuid4().hex,
+            store=store.name,
+            container=MEDIA_CONTAINER,
+            blob_name=blob_name,
+            upload_id=upload_id,
+            filename=filename,
+            size=size,
+            chunk_size=plan_part_size(size),
+            status="uploading",
+            updated_dt=now,
+            expires_dt=now + UPLOAD_SESSION_TTL
+        )
+        session.add(upload)
+        session.commit()
+        print(f"Started upload session {upload.session_id} for {blob_name}: {size} bytes in chunks of {upload.chunk_size} bytes")
+        return session_to_dict(upload, received={})
+
+
+def get_upload_session(session_id: str):
+    """The state of a session, for a client resuming it: the chunks at missing_offsets are the ones left to send."""
+    with Session() as session:
+        upload = _get_session(session, session_id)
+        if upload is None:
+            return {"error": "Upload session not found"}, 404
+        if upload.status == "uploading" and upload.expires_dt < datetime.now():
+            _expire(session, upload)
+        if upload.status != "uploading":
+            return session_to_dict(upload)
+        store = get_blob_store(upload.store)
+        return session_to_dict(upload, received=store.list_parts(upload.container, upload.blob_name, upload.upload_id))
+
+
+def put_upload_chunk(request, session_id: str):
+    """
+    Receive one chunk of a session, streamed into its part of the upload without being buffered.
+
+    Args:
+        request: Flask request object with the chunk as body and its position as the offset query parameter;
+            offset is a multiple of chunk_size and the body is the whole chunk. A chunk sent again replaces the earlier copy
+        session_id: Session of the chunk
+
+    Returns:
+        {"offset", "length"} of the stored chunk
+    """
+    offset = request.args.get("offset", "")
+    if not offset.isdigit():
+        return {"error": "offset is required"}, 400
+    offset = int(offset)
+
+    with Session() as session:
+        upload = _get_session(session, session_id)
+        if upload is None:
+            return {"error": "Upload session not found"}, 404
+        if upload.status == "uploading" and upload.expires_dt < datetime.now():
+            _expire(session, upload)
+        if upload.status != "uploading":
+            return {"error": f"Upload session is {upload.status}"}, 409
+        if offset % upload.chunk_size or offset >= upload.size:
+            return {"error": f"offset must be a multiple of {upload.chunk_size} below {upload.size}"}, 400
+        length = chunk_length(upload, offset)
+        if request.content_length != length:
+            return {"error": f"The chunk at offset {offset} is {length} bytes"}, 400
+        store_name, container, blob_name, upload_id = upload.store, upload.container, upload.blob_name, upload.upload_id
+        part_number = offset // upload.chunk_size + 1
+
+    # Outside the database session, the chunk may take a while to arrive
+    get_blob_store(store_name).put_part(container, blob_name, upload_id, part_number, request.stream, length)
+
+    with Session() as session:
+        session.execute(update(UploadSession).where(UploadSession.session_id == session_id).values(updated_dt=datetime.now()))
+        session.commit()
+    return {"offset": offset, "length": length}
+
+
+def finalize_upload_session(session_id: str):
+    """
+    Join the chunks of a session into the recording once every chunk arrived.
+
+    Returns:
+        The completed session with the sas_url of the recording, as /upload/file returns; finalizing again returns it again
+    """
+    with Session() as session:
+        # Claimed under the row lock, so concurrent finalize calls complete the upload once
+        upload = _get_session(session, session_id, for_update=True)
+        if upload is None:
+            return {"error": "Upload session not found"}, 404
+        if upload.status == "completed":
+            return session_to_dict(upload)
+        if upload.status == "uploading" and upload.expires_dt < datetime.now():
+            _expire(session, upload)
+        if upload.status != "uploading":
+            return {"error": f"Upload session is {upload.status}"}, 409
+
+        part_count = math.ceil(upload.size / upload.chunk_size)
+        if part_count > DIRECT_UPLOAD_MAX_PARTS:
+            return {"error": "Too many chunks"}, 400
+        upload.status = "completing"
+        upload.updated_dt = datetime.now()
+        session.commit()
+        store = get_blob_store(upload.store)
+        container, blob_name, upload_id = upload.container, upload.blob_name, upload.upload_id
+
+    # Outside the row lock, listing and joining the parts of a large upload take a while
+    try:
+        with Session() as session:
+            state = session_to_dict(_get_session(session, session_id), received=store.list_parts(container, blob_name, upload_id))
+        if state["missing_offsets"]:
+            _set_status(session_id, "completing", status="uploading")
+            return {**state, "status": "uploading", "error": "Chunks are missing"}, 409
+        store.complete_multipart_upload(container, blob_name, upload_id, part_count)
+    except Exception:
+        _set_status(session_id, "completing", status="uploading")  # Finalizing again retries
+        raise
+
+    _set_status(session_id, "completing", status="completed", completed_dt=datetime.now())
+    print(f"Completed upload session {session_id}: {blob_name}")
+    with Session() as session:
+        return session_to_dict(_get_session(session, session_id))
@@ -1,4 +1,3 @@
-import requests
 import os
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify
@@ -7,8 +6,11 @@ import base64
 from pydub import AudioSegment
 from collections import defaultdict
 import uuid
+import struct
 import platform
 import mimetypes
+from typing import Optional
+from src import http_client
 
 
 # Load environment variables
@@ -17,6 +19,11 @@ load_dotenv()
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Bytes requested to read a WAV header remotely, enough for the fmt chunk and common metadata before the data chunk
+WAV_PROBE_BYTES = 64 * 1024
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
 
 def format_time(seconds):
     minutes, seconds = divmod(int(seconds), 60)
@@ -24,6 +31,82 @@ def format_time(seconds):
     return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
 
+def parse_wav_header(header: bytes, total_size: Optional[int] = None) -> Optional[dict]:
+    """
+    Read the format of a RIFF/WAVE file from its first bytes.
+
+    :param header: Leading bytes of the file, up to and including the data chunk header
+    :param total_size: Size of the whole file, for writers that leave the data chunk size unset
+    :return: {"audio_format", "channels", "sample_rate", "bits_per_sample", "duration_seconds"}, or None when the
+        bytes are not a WAV header or the data chunk starts beyond them
+    """
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        return None
+
+    wav_format = None
+    position = 12
+    while position + 8 <= len(header):
+        chunk_id = header[position:position + 4]
+        chunk_size = struct.unpack_from("<I", header, position + 4)[0]
+        body = position + 8
+
+        if chunk_id == b"fmt " and body + 16 <= len(header):
+            audio_format, channels, sample_rate, byte_rate, block_align, bits_per_sample = struct.unpack_from("<HHIIHH", header, body)
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40 and body + 26 <= len(header):
+                audio_format = struct.unpack_from("<H", header, body + 24)[0]  # First bytes of the sub format GUID
+            wav_format = {
+                "audio_format": audio_format,
+                "channels": channels,
+                "sample_rate": sample_rate,
+                "bits_per_sample": bits_per_sample,
+                "byte_rate": byte_rate,
+            }
+        elif chunk_id == b"data":
+            if wav_format is None or not wav_format["byte_rate"]:
+                return None
+            data_size = chunk_size
+            if total_size is not None and (chunk_size in (0, 0xFFFFFFFF) or body + chunk_size > total_size):
+                data_size = total_size - body  # Streamed or truncated recordings
+            return {
+                "audio_format": wav_format["audio_format"],
+                "channels": wav_format["channels"],
+                "sample_rate": wav_format["sample_rate"],
+                "bits_per_sample": wav_format["bits_per_sample"],
+                "duration_seconds": data_size / wav_format["byte_rate"],
+            }
+        position = body + chunk_size + (chunk_size & 1)  # Chunks are word aligned
+    return None
+
+
+def probe_wav_header(url: str, probe_bytes: int = WAV_PROBE_BYTES) -> Optional[dict]:
+    """
+    Read the format of a remote WAV file with a ranged GET of its first bytes, without downloading the file.
+
+    :return: See parse_wav_header, None when the URL is not a readable WAV file
+    """
+    try:
+        response = http_client.get(http_client.MEDIA, url, headers={"Range": f"bytes=0-{probe_bytes - 1}"}, stream=True)
+        with response:
+            if response.status_code not in (200, 206):
+                return None
+            total_size = None
+            content_range = response.headers.get("Content-Range", "")
+            if response.status_code == 206 and "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+                total_size = int(content_range.rsplit("/", 1)[1])
+            elif response.status_code == 200 and response.headers.get("Content-Length", "").isdigit():
+                total_size = int(response.headers["Content-Length"])  # Range ignored, only the first bytes are read
+
+            header = b""
+            for chunk in response.iter_content(chunk_size=8192):
+                header += chunk
+                if len(header) >= probe_bytes:
+                    break
+        return parse_wav_header(header[:probe_bytes], total_size)
+    except Exception as e:
+        print(f"Failed to probe {url.split('?')[0]}: {e}")
+        return None
+
+
 def mp4_to_base64(mp4_url: str):
     """
     Downloads an MP4 file from a URL, extracts the audio, converts it to WAV, and returns a base64-encoded string.
@@ -34,7 +117,7 @@ def mp4_to_base64(mp4_url: str):
         wav_path = "../uploads/temp_audio.wav"
 
         # Step 1: Download MP4
-        response = requests.get(mp4_url, stream=True)
+        response = http_client.get(http_client.MEDIA, mp4_url, stream=True)
         if response.status_code == 200:
             with open(mp4_path, "wb") as file:
                 for chunk in response.iter_content(chunk_size=1024):
@@ -116,7 +199,7 @@ def mp4_to_wav_file(mp4_url, save_dir=UPLOAD_FOLDER):
         wav_path = f"{temp_path}.wav"
 
         # Step 1: Download file
-        response = requests.get(mp4_url, stream=True)
+        response = http_client.get(http_client.MEDIA, mp4_url, stream=True)
         if response.status_code == 200:
             # Download to temporary file first
             with open(temp_path, "wb") as file:
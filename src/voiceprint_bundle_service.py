@@ -0,0 +1,365 @@
+import io
+import os
+import json
+import struct
+import zipfile
+import argparse
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from typing import Iterator, List, Optional
+import numpy as np
+from flask import send_file
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import sessionmaker
+
+from src.models import VoiceprintLibrary, EMBEDDING_DIMENSIONS, EMBEDDING_PRECISION
+from src.db_config import get_database_url
+from src.voiceprint_library_service import ACTIVE_MODEL_VERSION, embedding_to_numpy
+from src.blob_store import get_blob_store, VOICEPRINT_CONTAINER
+from src.deferred_blob_deletion_service import schedule_blob_deletion
+
+# Load environment variables
+load_dotenv()
+
+BUNDLE_FORMAT = "voiceprint-bundle"
+BUNDLE_VERSION = 1
+BUNDLE_DTYPES = {"float16": np.float16, "float32": np.float32}
+
+# Site specific metadata keys that must not travel with the bundle
+LOCAL_METADATA_KEYS = ("audio_blob", "source_sys_id")
+
+COPY_COLUMNS = ("name", "email", "department", "position", "embedding", "model_version", "metadata_json")
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+# By default ANN indexes are only dropped and rebuilt when the bundle has at least this many rows per row of the
+# table: a rebuild locks every tenant's search for the whole load, worth it for bulk loads, not for small imports
+VOICEPRINT_IMPORT_REBUILD_RATIO = float(os.getenv("VOICEPRINT_IMPORT_REBUILD_RATIO", "0.5"))
+
+DATABASE_URL = get_database_url()
+
+# Create database engine
+engine = create_engine(DATABASE_URL, connect_args={'client_encoding': 'utf8'})
+Session = sessionmaker(bind=engine)
+
+
+def export_voiceprint_bundle(application_owner: str, output, dtype: str = "float16") -> dict:
+    """
+    Write a tenant's voiceprints (active model version) as a bundle: a zip holding
+    manifest.json, embeddings.npy (N x 256 matrix) and metadata.json (one entry per matrix row).
+
+    :param application_owner: Tenant to export.
+    :param output: Path or writable binary file object.
+    :param dtype: float16 (half the size, ample for similarity matching) or float32.
+    :return: The bundle manifest.
+    """
+    if dtype not in BUNDLE_DTYPES:
+        raise ValueError(f"dtype must be one of {', '.join(BUNDLE_DTYPES)}")
+
+    owner_filter = (
+        VoiceprintLibrary.metadata_json['application_owner'].astext == application_owner,
+        VoiceprintLibrary.model_version == ACTIVE_MODEL_VERSION,
+        VoiceprintLibrary.embedding.is_not(None),
+    )
+
+    with Session() as session:
+        count = session.execute(select(func.count()).select_from(VoiceprintLibrary).where(*owner_filter)).scalar_one()
+        matrix = np.empty((count, EMBEDDING_DIMENSIONS), dtype=BUNDLE_DTYPES[dtype])
+        metadata = []
+
+        rows = session.execute(
+            select(
+                VoiceprintLibrary.name,
+                VoiceprintLibrary.email,
+                VoiceprintLibrary.department,
+                VoiceprintLibrary.position,
+                VoiceprintLibrary.metadata_json,
+                VoiceprintLibrary.embedding,
+            ).where(*owner_filter).order_by(VoiceprintLibrary.sys_id).execution_options(yield_per=5000)
+        )
+        for i, row in enumerate(rows):
+            if i >= count:
+                break  # Rows inserted after the count are left for the next export
+            matrix[i] = embedding_to_numpy(row.embedding)
+            metadata.append({
+                "name": row.name,
+                "email": row.email,
+                "department": row.department,
+                "position": row.position,
+                "metadata": {k: v for k, v in (row.metadata_json or {}).items() if k not in LOCAL_METADATA_KEYS},
+            })
+        matrix = matrix[:len(metadata)]
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "application_owner": application_owner,
+        "model_version": ACTIVE_MODEL_VERSION,
+        "dtype": dtype,
+        "dimensions": EMBEDDING_DIMENSIONS,
+        "count": len(metadata),
+        "created_dt": datetime.now().isoformat(),
+    }
+
+    # The matrix is incompressible, so store everything rather than deflate it
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED) as bundle:
+        bundle.writestr("manifest.json", json.dumps(manifest, indent=2))
+        with bundle.open("embeddings.npy", "w") as embeddings_file:
+            np.lib.format.write_array(embeddings_file, matrix, allow_pickle=False)
+        bundle.writestr("metadata.json", json.dumps(metadata, ensure_ascii=False))
+
+    return manifest
+
+
+def read_voiceprint_bundle(bundle_file) -> tuple[dict, np.ndarray, List[dict]]:
+    """Read and validate a bundle written by export_voiceprint_bundle."""
+    with zipfile.ZipFile(bundle_file, "r") as bundle:
+        manifest = json.loads(bundle.read("manifest.json"))
+        if manifest.get("format") != BUNDLE_FORMAT or manifest.get("version") != BUNDLE_VERSION:
+            raise ValueError("Not a supported voiceprint bundle")
+        with bundle.open("embeddings.npy") as embeddings_file:
+            matrix = np.lib.format.read_array(embeddings_file, allow_pickle=False)
+        metadata = json.loads(bundle.read("metadata.json"))
+
+    if matrix.shape != (manifest["count"], manifest["dimensions"]) or len(metadata) != manifest["count"]:
+        raise ValueError("Voiceprint bundle is corrupted: matrix and metadata sizes do not match the manifest")
+    if manifest["dimensions"] != EMBEDDING_DIMENSIONS:
+        raise ValueError(f"Bundle has {manifest['dimensions']}-dimension embeddings, the library expects {EMBEDDING_DIMENSIONS}")
+    return manifest, matrix, metadata
+
+
+def _copy_text_field(value: Optional[str]) -> bytes:
+    if value is None:
+        return struct.pack(">i", -1)
+    encoded = value.encode("utf-8")
+    return struct.pack(">i", len(encoded)) + encoded
+
+
+def _copy_vector_field(vector: np.ndarray) -> bytes:
+    # pgvector binary format: int16 dimensions, int16 unused, then big-endian float4 (vector) or float2 (halfvec) values
+    values = vector.astype(">f2" if EMBEDDING_PRECISION == "float16" else ">f4")
+    encoded = struct.pack(">hh", len(vector), 0) + values.tobytes()
+    return struct.pack(">i", len(encoded)) + encoded
+
+
+def _copy_jsonb_field(value: dict) -> bytes:
+    # jsonb binary format: version byte 1, then the json text
+    encoded = b"\x01" + json.dumps(value, ensure_ascii=False).encode("utf-8")
+    return struct.pack(">i", len(encoded)) + encoded
+
+
+def _iter_copy_rows(matrix: np.ndarray, metadata: List[dict], application_owner: str, model_version: str) -> Iterator[bytes]:
+    yield COPY_SIGNATURE
+    field_count = struct.pack(">h", len(COPY_COLUMNS))
+    for vector, entry in zip(matrix, metadata):
+        yield b"".join((
+            field_count,
+            _copy_text_field(entry.get("name")),
+            _copy_text_field(entry.get("email")),
+            _copy_text_field(entry.get("department")),
+            _copy_text_field(entry.get("position")),
+            _copy_vector_field(vector),
+            _copy_text_field(model_version),
+            _copy_jsonb_field({**entry.get("metadata", {}), "application_owner": application_owner}),
+        ))
+    yield struct.pack(">h", -1)
+
+
+class _IteratorReader(io.RawIOBase):
+    """Expose an iterator of byte chunks as a readable file object, for cursor.copy_expert."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _table_row_estimate(cursor) -> int:
+    """Rows of voiceprint_library from the planner statistics, counted when the table was never analyzed."""
+    cursor.execute("SELECT reltuples FROM pg_class WHERE oid = 'voiceprint_library'::regclass")
+    estimate = cursor.fetchone()[0]
+    if estimate < 0:
+        cursor.execute("SELECT count(*) FROM voiceprint_library")
+        estimate = cursor.fetchone()[0]
+    return int(estimate)
+
+
+def import_voiceprint_bundle(bundle_file, application_owner: Optional[str] = None, replace: bool = True,
+                             rebuild_indexes: Optional[bool] = None) -> dict:
+    """
+    Bulk load a bundle into voiceprint_library with binary COPY.
+
+    :param bundle_file: Path or readable binary file object.
+    :param application_owner: Tenant to import into, defaults to the tenant the bundle was exported from.
+    :param replace: Delete the tenant's existing voiceprints of the same model version first, and their enrollment audio.
+    :param rebuild_indexes: Drop ANN (hnsw/ivfflat) indexes before the load and build them once afterwards,
+                            which is much faster than maintaining them row by row but locks the table for every
+                            tenant until the import commits. None decides by VOICEPRINT_IMPORT_REBUILD_RATIO.
+    :return: Summary of the import.
+    """
+    manifest, matrix, metadata = read_voiceprint_bundle(bundle_file)
+    application_owner = application_owner or manifest["application_owner"]
+    model_version = manifest["model_version"]
+    if model_version != ACTIVE_MODEL_VERSION:
+        print(f"Warning: importing {model_version} voiceprints, search uses {ACTIVE_MODEL_VERSION}")
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        deleted_count = 0
+        orphaned_audio_blobs = []
+        if replace:
+            cursor.execute(
+                "DELETE FROM voiceprint_library WHERE metadata_json ->> 'application_owner' = %s AND model_version = %s "
+                "RETURNING metadata_json ->> 'audio_blob'",
+                (application_owner, model_version)
+            )
+            deleted_count = cursor.rowcount
+            audio_blobs = list({audio_blob for (audio_blob,) in cursor.fetchall() if audio_blob})
+            if audio_blobs:
+                # Re-embedded copies in other model versions share the enrollment audio of their source, keep theirs
+                cursor.execute(
+                    "SELECT DISTINCT metadata_json ->> 'audio_blob' FROM voiceprint_library WHERE metadata_json ->> 'audio_blob' = ANY(%s)",
+                    (audio_blobs,)
+                )
+                still_used = {audio_blob for (audio_blob,) in cursor.fetchall()}
+                orphaned_audio_blobs = [audio_blob for audio_blob in audio_blobs if audio_blob not in still_used]
+
+        if rebuild_indexes is None:
+            rebuild_indexes = len(metadata) >= VOICEPRINT_IMPORT_REBUILD_RATIO * _table_row_estimate(cursor)
+
+        ann_indexes = []
+        if rebuild_indexes:
+            cursor.execute(
+                "SELECT indexname, indexdef FROM pg_indexes "
+                "WHERE schemaname = current_schema() AND tablename = 'voiceprint_library' AND indexdef ~* 'USING (hnsw|ivfflat)'"
+            )
+            ann_indexes = cursor.fetchall()
+            for index_name, _ in ann_indexes:
+                cursor.execute(f'DROP INDEX "{index_name}"')
+
+        cursor.copy_expert(
+            f"COPY voiceprint_library ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT binary)",
+            _IteratorReader(_iter_copy_rows(matrix, metadata, application_owner, model_version))
+        )
+
+        for _, index_definition in ann_indexes:
+            cursor.execute(index_definition)
+        cursor.execute("ANALYZE voiceprint_library")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    # Deleted once the import committed, by the background scheduler
+    store_name = get_blob_store().name
+    for audio_blob in orphaned_audio_blobs:
+        try:
+            schedule_blob_deletion(store_name, audio_blob, bucket=VOICEPRINT_CONTAINER, ttl=timedelta(0))
+        except Exception as e:
+            print(f"Failed to schedule deletion of {audio_blob}: {e}")
+
+    return {
+        "application_owner": application_owner,
+        "model_version": model_version,
+        "imported_count": len(metadata),
+        "deleted_count": deleted_count,
+        "rebuilt_indexes": [index_name for index_name, _ in ann_indexes],
+    }
+
+
+def export_voiceprint_library(request):
+    """
+    Export a tenant's voiceprint library as a bundle file.
+
+    Args:
+        request: Flask request object containing:
+            - application_owner: Tenant to export
+            - dtype: (optional) float16 (default) or float32
+
+    Returns:
+        The bundle as a file download
+    """
+    data = request.get_json()
+    application_owner = data.get('application_owner')
+    dtype = data.get('dtype', 'float16')
+
+    if not application_owner:
+        return {"error": "application_owner is required"}, 400
+    if dtype not in BUNDLE_DTYPES:
+        return {"error": f"dtype must be one of {', '.join(BUNDLE_DTYPES)}"}, 400
+
+    bundle = io.BytesIO()
+    export_voiceprint_bundle(application_owner, bundle, dtype)
+    bundle.seek(0)
+    return send_file(bundle, mimetype="application/zip", as_attachment=True, download_name=f"voiceprints_{application_owner}.vpbundle")
+
+
+def import_voiceprint_library(request):
+    """
+    Import a bundle produced by the export endpoint.
+
+    Args:
+        request: Flask request object containing:
+            - bundle: (file) The bundle
+            - application_owner: (optional) Tenant to import into, defaults to the exported tenant
+            - replace: (optional) "false" to append instead of replacing the tenant's voiceprints
+
+    Returns:
+        Summary of the import
+    """
+    bundle = request.files.get("bundle")
+    application_owner = request.form.get("application_owner")
+    replace = request.form.get("replace", "true").lower() != "false"
+
+    if not bundle or bundle.filename == '':
+        return {"error": "bundle file is required"}, 400
+
+    try:
+        return import_voiceprint_bundle(bundle.stream, application_owner=application_owner, replace=replace), 201
+    except (ValueError, KeyError, zipfile.BadZipFile) as e:
+        return {"error": f"Invalid voiceprint bundle: {str(e)}"}, 400
+
+
+if __name__ == '__main__':
+    # python -m src.voiceprint_bundle_service export catomind voiceprints.vpbundle
+    # python -m src.voiceprint_bundle_service import voiceprints.vpbundle --application-owner catomind
+    parser = argparse.ArgumentParser(description="Move voiceprint libraries between deployments")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("application_owner")
+    export_parser.add_argument("output")
+    export_parser.add_argument("--dtype", choices=list(BUNDLE_DTYPES), default="float16")
+
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument("input")
+    import_parser.add_argument("--application-owner", default=None)
+    import_parser.add_argument("--append", action="store_true", help="keep the tenant's existing voiceprints")
+    index_group = import_parser.add_mutually_exclusive_group()
+    index_group.add_argument("--keep-indexes", dest="rebuild_indexes", action="store_false", default=None,
+                             help="do not drop and rebuild ANN indexes")
+    index_group.add_argument("--rebuild-indexes", dest="rebuild_indexes", action="store_true",
+                             help="drop ANN indexes for the load and rebuild them once, locking the table meanwhile")
+
+    args = parser.parse_args()
+    started = datetime.now()
+    if args.command == "export":
+        print(export_voiceprint_bundle(args.application_owner, args.output, args.dtype))
+    else:
+        print(import_voiceprint_bundle(args.input, application_owner=args.application_owner,
+                                       replace=not args.append, rebuild_indexes=args.rebuild_indexes))
+    print(f"Finished in {(datetime.now() - started).total_seconds():.2f}s")
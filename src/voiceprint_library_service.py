@@ -2,19 +2,26 @@ from resemblyzer import VoiceEncoder, preprocess_wav
 from pathlib import Path
 import numpy as np
 import os
+import asyncio
+import time
+import uuid
+from functools import lru_cache, partial
 from dotenv import load_dotenv
-from typing import List, Dict, Any
-from sqlalchemy import create_engine, Column, Integer, String, Text, TIMESTAMP, JSON
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import update, delete
+from typing import List, Dict, Any, Callable
+from sqlalchemy import create_engine, Column, Integer, String, Float, Text, TIMESTAMP, JSON, text, bindparam
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import update, delete, select
 from flask import Flask, request, jsonify
 from werkzeug.utils import secure_filename
 import librosa
 from typing import Optional, Union
 
-from src.enums import OnPremiseMode
 from src.models import VoiceprintLibrary
-from src.db_config import get_database_url
+from src.db_config import get_database_url, get_async_session, get_embedding_precision
+from src.app_owner_control_service import get_voiceprint_search_settings, async_get_voiceprint_search_settings
+from src.blob_store import get_blob_store, VOICEPRINT_CONTAINER
+from src.utilities import extract_audio_segment
 
 # Load environment variables
 load_dotenv()
@@ -31,22 +38,125 @@ DATABASE_URL = get_database_url()
 # Create database engine
 engine = create_engine(DATABASE_URL, connect_args={'client_encoding': 'utf8'})
 Session = sessionmaker(bind=engine)
-session = Session()
+# Thread local session, voiceprints are matched from concurrent transcription workers
+session = scoped_session(Session)
 
 
-def get_embedding(file_wav: Union[str, Path, np.ndarray]) -> List[float]:
+@lru_cache(maxsize=None)
+def _load_resemblyzer(weights_fpath: Optional[str] = None) -> VoiceEncoder:
+    """One VoiceEncoder per weights file, shared by the model versions that use it."""
+    return VoiceEncoder(weights_fpath=weights_fpath) if weights_fpath else VoiceEncoder()
+
+
+class ResemblyzerEncoder:
+    """Resemblyzer with fixed weights and partial window settings; each combination is its own model version."""
+
+    def __init__(self, weights_fpath: Optional[str] = None, rate: float = 1.3, min_coverage: float = 0.75):
+        self.encoder = _load_resemblyzer(weights_fpath)
+        self.rate = rate
+        self.min_coverage = min_coverage
+
+    def embed_utterance(self, wav: np.ndarray) -> np.ndarray:
+        return self.encoder.embed_utterance(wav, rate=self.rate, min_coverage=self.min_coverage)
+
+
+# Loaders of the encoders that can produce voiceprint embeddings, keyed by the model_version stored next to each embedding.
+# A loader returns an object with embed_utterance(wav) -> 256 float embedding.
+# Embeddings from different versions are not comparable, so search only ever looks at the active version.
+VOICEPRINT_ENCODERS = {
+    "resemblyzer-0.1.4": ResemblyzerEncoder,
+    # Partial windows every 250ms instead of 770ms, steadier embeddings of short enrollment clips
+    "resemblyzer-0.1.4-dense": partial(ResemblyzerEncoder, rate=4.0, min_coverage=0.5),
+}
+
+
+def register_voice_encoder(model_version: str, loader: Callable[[], Any]) -> None:
+    """Make another encoder available for new voiceprints and re-embedding jobs."""
+    VOICEPRINT_ENCODERS[model_version] = loader
+
+
+# Fine-tuned Resemblyzer weights, "<model_version>=<weights path>" separated by ";"
+for _entry in filter(None, os.getenv("VOICEPRINT_ENCODER_WEIGHTS", "").split(";")):
+    _model_version, _weights_fpath = _entry.split("=", 1)
+    register_voice_encoder(_model_version.strip(), partial(ResemblyzerEncoder, weights_fpath=_weights_fpath.strip()))
+
+ACTIVE_MODEL_VERSION = os.getenv("VOICEPRINT_MODEL_VERSION", "resemblyzer-0.1.4")
+
+# Enrollment audio is kept so embeddings can be regenerated when the encoder changes
+VOICEPRINT_AUDIO_PREFIX = "voiceprints"
+
+
+@lru_cache(maxsize=None)
+def get_voice_encoder(model_version: str = ACTIVE_MODEL_VERSION):
+    """Load the encoder for a model version once per process."""
+    if model_version not in VOICEPRINT_ENCODERS:
+        raise ValueError(f"Unknown voiceprint model version: {model_version}")
+    return VOICEPRINT_ENCODERS[model_version]()
+
+
+def compute_embedding(file_wav: Union[str, Path, np.ndarray], model_version: str = ACTIVE_MODEL_VERSION) -> List[float]:
+    """Get voiceprint embedding vector, raising on failure."""
+    wav = preprocess_wav(file_wav)
+    embed = get_voice_encoder(model_version).embed_utterance(wav)
+    return embed.tolist()
+
+
+def get_embedding(file_wav: Union[str, Path, np.ndarray], model_version: str = ACTIVE_MODEL_VERSION) -> List[float]:
     """Get voiceprint embedding vector."""
     try:
-        wav = preprocess_wav(file_wav)
-
-        encoder = VoiceEncoder()
-        embed = encoder.embed_utterance(wav)
-        np.set_printoptions(precision=3, suppress=True)
-        return embed.tolist()
+        return compute_embedding(file_wav, model_version)
     except Exception as e:
         print(f"Error getting embedding: {e}")
         return [0] * 256  # Return zero vector on error
 
+
+def embedding_to_numpy(embedding) -> np.ndarray:
+    """Stored embedding as a float32 array, whether the column is vector (ndarray) or halfvec (HalfVector)."""
+    if hasattr(embedding, "to_numpy"):
+        embedding = embedding.to_numpy()
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def store_enrollment_audio(file_path: str) -> Optional[str]:
+    """
+    Keep a copy of an enrollment clip in blob storage.
+
+    :param file_path: Path to the local .wav file.
+    :return: The blob name, or None if the upload failed.
+    """
+    blob_name = f"{VOICEPRINT_AUDIO_PREFIX}/{uuid.uuid4()}.wav"
+    try:
+        get_blob_store().put_file(VOICEPRINT_CONTAINER, blob_name, file_path)
+        return blob_name
+    except Exception as e:
+        print(f"Failed to store enrollment audio: {e}")
+        return None
+
+
+def fetch_enrollment_audio(blob_name: str, file_path: str) -> bool:
+    """
+    Download an enrollment clip stored by store_enrollment_audio.
+
+    :param blob_name: Name of the stored blob.
+    :param file_path: Local path to write the .wav file to.
+    :return: Boolean indicating whether the download was successful.
+    """
+    try:
+        get_blob_store().download(VOICEPRINT_CONTAINER, blob_name, file_path)
+        return True
+    except Exception as e:
+        print(f"An error occurred while downloading the blob: {e}")
+        return False
+
+
+def delete_enrollment_audio(blob_name: str) -> bool:
+    try:
+        get_blob_store().delete(VOICEPRINT_CONTAINER, blob_name)
+        return True
+    except Exception as e:
+        print(f"An error occurred while deleting the blob: {e}")
+        return False
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -63,11 +173,17 @@ def insert_voiceprint(request):
         return jsonify({"error": "Missing required fields: name, audio_files, and application_owner are required."}), 400
 
     try:
-        # Delete existing records with the same email and application_owner
-        delete_stmt = delete(VoiceprintLibrary).where(
+        # Delete existing records with the same email and application_owner, across all model versions
+        existing_filter = (
             VoiceprintLibrary.email == email,
             VoiceprintLibrary.metadata_json['application_owner'].astext == application_owner
         )
+        replaced_audio_blobs = {
+            metadata_json.get("audio_blob")
+            for (metadata_json,) in session.query(VoiceprintLibrary.metadata_json).filter(*existing_filter).all()
+            if metadata_json.get("audio_blob")
+        }
+        delete_stmt = delete(VoiceprintLibrary).where(*existing_filter)
         session.execute(delete_stmt)
 
         for audio_file in audio_files:
@@ -80,13 +196,18 @@ def insert_voiceprint(request):
                 try:
                     wav_np, sr = librosa.load(file_path, sr=None)  # Load audio
                     embedding = get_embedding(wav_np)
+                    metadata_json = {"application_owner": application_owner}  # Store in metadata_json
+                    audio_blob = store_enrollment_audio(file_path)
+                    if audio_blob:
+                        metadata_json["audio_blob"] = audio_blob
                     voiceprint = VoiceprintLibrary(
                         name=name,
                         email=email,
                         department=department,
                         position=position,
-                        metadata_json={"application_owner": application_owner},  # Store in metadata_json
-                        embedding=embedding
+                        metadata_json=metadata_json,
+                        embedding=embedding,
+                        model_version=ACTIVE_MODEL_VERSION
                     )
                     session.add(voiceprint)
                 except Exception as e:
@@ -97,59 +218,314 @@ def insert_voiceprint(request):
             else:
                 return jsonify({"error": f"Invalid file format for file {audio_file.filename}. Only .wav files are allowed."}), 400
         session.commit()
+
+        for audio_blob in replaced_audio_blobs:
+            delete_enrollment_audio(audio_blob)
+
         return jsonify({"message": "All voiceprints inserted successfully!"}), 201
     except Exception as e:
         session.rollback()
         return jsonify({"error": str(e)}), 500
 
-def search_voiceprint(file_wav: Union[str, Path, np.ndarray], application_owner: str):
-    """Search for the closest matching voiceprint in the database by sending a path with .wav file."""
+# Search defaults, overridable per tenant (app owner metadata_json["voiceprint_search"]) and per call
+DEFAULT_SEARCH_SETTINGS = {
+    "limit": 3,  # Matches returned
+    "confidence_threshold": 0.8,  # Minimum cosine similarity
+    "ef_search": None,  # HNSW candidate list size, pgvector default 40; higher = better recall, slower
+    "probes": None,  # IVFFlat lists probed, pgvector default 1
+    "iterative_scan": None,  # pgvector >= 0.8: off / relaxed_order / strict_order, keeps scanning when filters remove candidates
+    "exact_rerank": False,  # Re-score halfvec candidates in float32 against the query before taking the top matches
+    "rerank_candidates": 5,  # Candidates fetched per requested match when re-ranking
+}
+ITERATIVE_SCAN_MODES = ("off", "relaxed_order", "strict_order")
 
-    temp_path = file_wav
-    limit = 3
-    confidence_level = 0.8
+# The distance is computed once, in the candidate subquery, and referenced by alias afterwards.
+# Ordering the inner query by distance alone lets pgvector serve it from the HNSW/IVFFlat index;
+# the similarity threshold is applied outside so it does not stop the index scan early.
+VOICEPRINT_SEARCH_SQL = """
+SELECT sys_id, name, email, department, position, metadata_json, embedding, distance
+FROM (
+    SELECT sys_id, name, email, department, position, metadata_json, embedding,
+           embedding <=> :query_embedding AS distance
+    FROM voiceprint_library
+    WHERE embedding IS NOT NULL
+      AND metadata_json ->> 'application_owner' = :application_owner
+      AND model_version = :model_version
+    ORDER BY distance
+    LIMIT :candidate_limit
+) AS candidates
+WHERE distance <= :max_distance
+ORDER BY distance
+"""
 
-    # Validate confidence_level is between 0 and 1
-    if confidence_level < 0 or confidence_level > 1:
-        return jsonify({"error": "confidence_level must be between 0 and 1"}), 400
 
-    if not application_owner:
-        return jsonify({"error": "application_owner is required"}), 400
+def resolve_search_settings(tenant_settings: Optional[dict] = None, **overrides) -> dict:
+    """Merge search settings: call overrides (ignoring None) over tenant settings over DEFAULT_SEARCH_SETTINGS."""
+    settings = dict(DEFAULT_SEARCH_SETTINGS)
+    settings.update({k: v for k, v in (tenant_settings or {}).items() if k in DEFAULT_SEARCH_SETTINGS})
+    settings.update({k: v for k, v in overrides.items() if v is not None})
 
-    try:
-        query_embedding = get_embedding(temp_path)
-
-        similarity_score = (1 - VoiceprintLibrary.embedding.cosine_distance(query_embedding)).label("similarity")
-
-        results = (
-            session.query(VoiceprintLibrary, similarity_score)
-            .filter(VoiceprintLibrary.embedding.is_not(None))
-            .filter(VoiceprintLibrary.metadata_json['application_owner'].astext == application_owner)  # Filter by application owner in metadata_json
-            # Apply confidence level filter directly in the query
-            .filter(similarity_score >= confidence_level)
-            .order_by(VoiceprintLibrary.embedding.cosine_distance(query_embedding),similarity_score.desc())
-            .limit(limit)
-            .all()
+    settings["limit"] = int(settings["limit"])
+    settings["confidence_threshold"] = float(settings["confidence_threshold"])
+    settings["rerank_candidates"] = int(settings["rerank_candidates"])
+    # pgvector already returns the float32 cosine of a vector column, re-scoring only pays off for halfvec
+    settings["exact_rerank"] = str(settings["exact_rerank"]).lower() in ("true", "1") and get_embedding_precision() == "float16"
+    for knob in ("ef_search", "probes"):
+        if settings[knob] is not None:
+            settings[knob] = int(settings[knob])
+
+    if not 0 <= settings["confidence_threshold"] <= 1:
+        raise ValueError("confidence_threshold must be between 0 and 1")
+    if not 1 <= settings["limit"] <= 100:
+        raise ValueError("limit must be between 1 and 100")
+    if settings["ef_search"] is not None and not 1 <= settings["ef_search"] <= 1000:
+        raise ValueError("ef_search must be between 1 and 1000")
+    if settings["probes"] is not None and settings["probes"] < 1:
+        raise ValueError("probes must be at least 1")
+    if settings["iterative_scan"] is not None and settings["iterative_scan"] not in ITERATIVE_SCAN_MODES:
+        raise ValueError(f"iterative_scan must be one of {', '.join(ITERATIVE_SCAN_MODES)}")
+    return settings
+
+
+def _search_index_options(settings: dict) -> List[tuple[str, str]]:
+    """Planner settings for this search, applied with set_config(..., is_local => true) so they end with the transaction."""
+    options = []
+    if settings["ef_search"] is not None:
+        options.append(("hnsw.ef_search", str(settings["ef_search"])))
+    if settings["probes"] is not None:
+        options.append(("ivfflat.probes", str(settings["probes"])))
+    if settings["iterative_scan"] is not None:
+        options.append(("hnsw.iterative_scan", settings["iterative_scan"]))
+    return options
+
+
+def _search_statement(explain: bool = False):
+    sql = VOICEPRINT_SEARCH_SQL
+    if explain:
+        # Plain EXPLAIN plans the query without running it a second time
+        return text("EXPLAIN (FORMAT JSON) " + sql).bindparams(
+            bindparam("query_embedding", type_=VoiceprintLibrary.__table__.c.embedding.type)
         )
+    return text(sql).bindparams(
+        bindparam("query_embedding", type_=VoiceprintLibrary.__table__.c.embedding.type)
+    ).columns(
+        sys_id=Integer, name=String, email=String, department=String, position=String,
+        metadata_json=JSONB, embedding=VoiceprintLibrary.__table__.c.embedding.type, distance=Float
+    )
+
+
+def _search_params(query_embedding: List[float], application_owner: str, settings: dict) -> dict:
+    candidate_limit = settings["limit"] * settings["rerank_candidates"] if settings["exact_rerank"] else settings["limit"]
+    return {
+        "query_embedding": query_embedding,
+        "application_owner": application_owner,
+        "model_version": ACTIVE_MODEL_VERSION,
+        "candidate_limit": candidate_limit,
+        # Re-ranking applies the threshold on the exact similarity instead
+        "max_distance": 2.0 if settings["exact_rerank"] else 1 - settings["confidence_threshold"],
+    }
+
+
+def _rank_matches(rows, query_embedding: List[float], settings: dict) -> List[Dict[str, Any]]:
+    """Turn result rows into matches, re-scoring the halfvec candidates exactly in float32 when exact_rerank is set."""
+    if settings["exact_rerank"] and rows:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        candidates = np.stack([embedding_to_numpy(row.embedding) for row in rows])
+        similarities = candidates @ query / (np.linalg.norm(candidates, axis=1) * np.linalg.norm(query) + 1e-12)
+        scored = sorted(zip(rows, similarities.tolist()), key=lambda pair: pair[1], reverse=True)
+        scored = [(row, similarity) for row, similarity in scored if similarity >= settings["confidence_threshold"]]
+    else:
+        scored = [(row, 1 - row.distance) for row in rows]
+
+    return [
+        {
+            "sys_id": row.sys_id,
+            "name": row.name,
+            "email": row.email,
+            "department": row.department,
+            "position": row.position,
+            "metadata": row.metadata_json,  # Include full metadata_json in response
+            "similarity": float(similarity)
+        }
+        for row, similarity in scored[:settings["limit"]]
+    ]
+
+
+def _search_stats(settings: dict, candidate_count: int, timings: Dict[str, float], plan=None) -> dict:
+    stats = {
+        "settings": settings,
+        "model_version": ACTIVE_MODEL_VERSION,
+        "candidates": candidate_count,
+        **{f"{name}_ms": round(seconds * 1000, 2) for name, seconds in timings.items()},
+    }
+    if plan is not None:
+        stats["plan"] = plan
+    return stats
+
 
-        # Format the results
-        response = []
-        for person, similarity in results:
-            response_obj = {
-                "sys_id": person.sys_id,
-                "name": person.name,
-                "email": person.email,
-                "department": person.department,
-                "position": person.position,
-                "metadata": person.metadata_json,  # Include full metadata_json in response
-                "similarity": float(similarity)
-            }
-            response.append(response_obj)
-
-        return jsonify(response)
+def query_voiceprints(query_embedding: List[float], application_owner: str, settings: dict, explain: bool = False) -> tuple[List[Dict[str, Any]], dict]:
+    """
+    Run the voiceprint search for an embedding.
 
+    Returns:
+        tuple: (matches, stats) where stats holds the settings used, timings and, with explain, the query plan
+    """
+    started = time.perf_counter()
+    params = _search_params(query_embedding, application_owner, settings)
+    try:
+        for name, value in _search_index_options(settings):
+            session.execute(text("SELECT set_config(:name, :value, true)"), {"name": name, "value": value})
+        rows = session.execute(_search_statement(), params).all()
+        query_finished = time.perf_counter()
+        plan = session.execute(_search_statement(explain=True), params).scalar() if explain else None
+    finally:
+        session.rollback()  # Read only, ends the transaction and the local index settings with it
+
+    matches = _rank_matches(rows, query_embedding, settings)
+    finished = time.perf_counter()
+    return matches, _search_stats(settings, len(rows), {"query": query_finished - started, "rank": finished - query_finished}, plan)
+
+
+async def async_query_voiceprints(query_embedding: List[float], application_owner: str, settings: dict, explain: bool = False) -> tuple[List[Dict[str, Any]], dict]:
+    """Async version of query_voiceprints."""
+    started = time.perf_counter()
+    params = _search_params(query_embedding, application_owner, settings)
+    async with get_async_session() as async_session:
+        for name, value in _search_index_options(settings):
+            await async_session.execute(text("SELECT set_config(:name, :value, true)"), {"name": name, "value": value})
+        rows = (await async_session.execute(_search_statement(), params)).all()
+        query_finished = time.perf_counter()
+        plan = (await async_session.execute(_search_statement(explain=True), params)).scalar() if explain else None
+
+    matches = _rank_matches(rows, query_embedding, settings)
+    finished = time.perf_counter()
+    return matches, _search_stats(settings, len(rows), {"query": query_finished - started, "rank": finished - query_finished}, plan)
+
+
+def match_voiceprint_embedding(query_embedding: List[float], application_owner: str, **search_options) -> List[Dict[str, Any]]:
+    """Matches of an embedding computed earlier, e.g. one kept with a transcription result to re-match it without its audio."""
+    settings = resolve_search_settings(get_voiceprint_search_settings(application_owner), **search_options)
+    matches, _ = query_voiceprints(query_embedding, application_owner, settings)
+    return matches
+
+
+def identify_speakers(speaker_stats: dict, speaker_embeddings: dict, application_owner: str,
+                      confidence_threshold: Optional[float]) -> None:
+    """
+    Set identified_name and confidence of every speaker from the embeddings of their longest segments,
+    checked in order as the segments were cut; the last segment's match decides the name.
+    """
+    for speaker, stats in speaker_stats.items():
+        stats["identified_name"] = "unknown"
+        stats.pop("confidence", None)  # Of an earlier match with another threshold
+        for embedding in speaker_embeddings.get(speaker) or []:
+            matches = match_voiceprint_embedding(embedding, application_owner, limit=1, confidence_threshold=confidence_threshold)
+            if matches and (confidence_threshold is None or matches[0].get("similarity", 0) >= confidence_threshold):
+                stats["identified_name"] = matches[0].get("name", "unknown")
+                stats["confidence"] = matches[0].get("similarity")
+            else:
+                stats["identified_name"] = "unknown"
+
+
+def embed_speaker_segments(segments, speakers, meeting_wav_path: str, top_count: int = 3) -> dict:
+    """
+    Embeddings of the top_count longest segments of each speaker, cut from the meeting audio in order of length.
+    Kept with transcription results, so they can be matched again with identify_speakers without the media.
+    """
+    speaker_embeddings = {}
+    for speaker in speakers:
+        for i, (start, end) in enumerate(segments.top_segments(speaker, top_count)):
+            output_name = f"speaker_{speaker}_segment_{i}_{uuid.uuid4().hex}"  # Unique, files are processed concurrently
+            wav_path = os.path.join(UPLOAD_FOLDER, f"{output_name}.wav")
+            try:
+                extract_audio_segment(output_name=output_name, start_time=start, end_time=end, input_file=meeting_wav_path, clean_up_after=False)
+                speaker_embeddings.setdefault(speaker, []).append(get_embedding(wav_path))
+            finally:
+                # Clean up the temporary WAV file
+                if os.path.exists(wav_path):
+                    os.remove(wav_path)
+    return speaker_embeddings
+
+
+def rematch_stored_speakers(result: dict, application_owner: str, confidence_threshold: Optional[float]) -> Optional[dict]:
+    """
+    Speaker stats of a stored transcription result matched again from the speaker embeddings kept with it,
+    or None when it has none of the active model version and the media has to be processed again.
+    """
+    if result.get("embedding_model_version") != ACTIVE_MODEL_VERSION or "speaker_embeddings" not in result:
+        return None
+    speaker_stats = {speaker: dict(stats) for speaker, stats in result["speaker_stats"].items()}
+    identify_speakers(speaker_stats, result["speaker_embeddings"], application_owner, confidence_threshold)
+    return speaker_stats
+
+
+def find_voiceprint_matches(file_wav: Union[str, Path, np.ndarray], application_owner: str,
+                            include_stats: bool = False, explain: bool = False, **search_options):
+    """
+    Search for the closest matching voiceprints of a .wav file.
+    Settings left as None fall back to the tenant's settings, then DEFAULT_SEARCH_SETTINGS.
+    Returns the list of matches, or {"matches": [...], "stats": {...}} with include_stats; raises ValueError on invalid input.
+    """
+    if not application_owner:
+        raise ValueError("application_owner is required")
+
+    settings = resolve_search_settings(get_voiceprint_search_settings(application_owner), **search_options)
+
+    started = time.perf_counter()
+    query_embedding = get_embedding(file_wav)
+    embedding_seconds = time.perf_counter() - started
+
+    matches, stats = query_voiceprints(query_embedding, application_owner, settings, explain=explain)
+
+    if include_stats or explain:
+        stats["embedding_ms"] = round(embedding_seconds * 1000, 2)
+        stats["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return {"matches": matches, "stats": stats}
+    return matches
+
+
+def search_voiceprint(file_wav: Union[str, Path, np.ndarray], application_owner: str, limit: Optional[int] = None,
+                      confidence_threshold: Optional[float] = None, ef_search: Optional[int] = None,
+                      probes: Optional[int] = None, iterative_scan: Optional[str] = None,
+                      exact_rerank: Optional[bool] = None, include_stats: bool = False, explain: bool = False):
+    """
+    Search for the closest matching voiceprint in the database by sending a path with .wav file.
+    Returns find_voiceprint_matches as a Flask response, as the transcription services expect.
+    """
+    try:
+        return jsonify(find_voiceprint_matches(
+            file_wav, application_owner, include_stats=include_stats, explain=explain,
+            limit=limit, confidence_threshold=confidence_threshold, ef_search=ef_search, probes=probes,
+            iterative_scan=iterative_scan, exact_rerank=exact_rerank
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        return jsonify({"error": f"Search error: {str(e)}"})
+        return jsonify({"error": f"Search error: {str(e)}"}), 500
+
+async def async_search_voiceprint(file_wav: Union[str, Path, np.ndarray], application_owner: str,
+                                  include_stats: bool = False, explain: bool = False, **search_options):
+    """
+    Async version of search_voiceprint for `async def` handlers.
+    The embedding runs in a worker thread and the query on the async engine, so the event loop is never blocked.
+    Returns the matches (or matches and stats) instead of a Flask response; raises ValueError on invalid input.
+    """
+    if not application_owner:
+        raise ValueError("application_owner is required")
+
+    settings = resolve_search_settings(await async_get_voiceprint_search_settings(application_owner), **search_options)
+
+    started = time.perf_counter()
+    query_embedding = await asyncio.to_thread(get_embedding, file_wav)
+    embedding_seconds = time.perf_counter() - started
+
+    matches, stats = await async_query_voiceprints(query_embedding, application_owner, settings, explain=explain)
+
+    if include_stats or explain:
+        stats["embedding_ms"] = round(embedding_seconds * 1000, 2)
+        stats["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return {"matches": matches, "stats": stats}
+    return matches
 
 if __name__ == '__main__':
     app.run(debug=True)
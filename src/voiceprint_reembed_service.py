@@ -0,0 +1,292 @@
+import os
+import time
+import uuid
+import threading
+import argparse
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from typing import Optional
+import librosa
+from sqlalchemy import create_engine, select, update, func, or_, exists, cast, String
+from sqlalchemy.orm import sessionmaker, aliased
+
+from src.models import VoiceprintLibrary, VoiceprintReembedJob
+from src.db_config import get_database_url
+from src.voiceprint_library_service import ACTIVE_MODEL_VERSION, VOICEPRINT_ENCODERS, compute_embedding, fetch_enrollment_audio
+
+# Load environment variables
+load_dotenv()
+
+UPLOAD_FOLDER = "uploads"
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+DEFAULT_BATCH_SIZE = int(os.getenv("VOICEPRINT_REEMBED_BATCH_SIZE", "50"))
+# A running job that has not checkpointed for this long is considered dead and may be resumed by another worker
+STALE_JOB_TIMEOUT = timedelta(minutes=10)
+
+DATABASE_URL = get_database_url()
+
+# Create database engine
+engine = create_engine(DATABASE_URL, connect_args={'client_encoding': 'utf8'})
+Session = sessionmaker(bind=engine)
+
+
+def needs_reembedding(source_model_version: str, target_model_version: str):
+    """Voiceprints of source_model_version without a re-embedded copy in target_model_version yet."""
+    copy = aliased(VoiceprintLibrary)
+    return (
+        (VoiceprintLibrary.model_version == source_model_version)
+        & ~exists().where(
+            copy.metadata_json['source_sys_id'].astext == cast(VoiceprintLibrary.sys_id, String),
+            copy.model_version == target_model_version
+        )
+    )
+
+
+def job_to_dict(job: VoiceprintReembedJob) -> dict:
+    done_count = job.processed_count + job.skipped_count + job.failed_count
+    return {
+        "job_id": job.sys_id,
+        "source_model_version": job.source_model_version,
+        "target_model_version": job.target_model_version,
+        "status": job.status,
+        "batch_size": job.batch_size,
+        "checkpoint_sys_id": job.last_sys_id,
+        "total_count": job.total_count,
+        "processed_count": job.processed_count,
+        "skipped_count": job.skipped_count,
+        "failed_count": job.failed_count,
+        "progress_percentage": (done_count / job.total_count) * 100 if job.total_count > 0 else 100,
+        "elapsed_seconds": round(job.elapsed_seconds, 2),
+        "embeddings_per_second": round(job.processed_count / job.elapsed_seconds, 2) if job.elapsed_seconds > 0 else 0,
+        "error_message": job.error_message,
+        "created_dt": job.created_dt.isoformat() if job.created_dt else None,
+        "completed_dt": job.completed_dt.isoformat() if job.completed_dt else None,
+    }
+
+
+def create_or_resume_job(target_model_version: str, batch_size: Optional[int] = None) -> VoiceprintReembedJob:
+    """
+    Get the unfinished job for target_model_version, or create a new one.
+    Voiceprints are re-embedded from the currently active model version into the target version; a new job
+    after a completed one only covers voiceprints enrolled since, and those that failed before.
+    """
+    if target_model_version not in VOICEPRINT_ENCODERS:
+        raise ValueError(f"Unknown voiceprint model version: {target_model_version}")
+    if target_model_version == ACTIVE_MODEL_VERSION:
+        raise ValueError(f"{target_model_version} is already the active model version")
+
+    with Session() as session:
+        job = session.execute(
+            select(VoiceprintReembedJob).where(
+                VoiceprintReembedJob.source_model_version == ACTIVE_MODEL_VERSION,
+                VoiceprintReembedJob.target_model_version == target_model_version,
+                VoiceprintReembedJob.status != "completed"
+            ).order_by(VoiceprintReembedJob.sys_id.desc())
+        ).scalars().first()
+
+        if job is None:
+            total_count = session.execute(
+                select(func.count()).select_from(VoiceprintLibrary).where(needs_reembedding(ACTIVE_MODEL_VERSION, target_model_version))
+            ).scalar_one()
+            job = VoiceprintReembedJob(
+                source_model_version=ACTIVE_MODEL_VERSION,
+                target_model_version=target_model_version,
+                status="pending",
+                batch_size=batch_size or DEFAULT_BATCH_SIZE,
+                last_sys_id=0,
+                total_count=total_count,
+                processed_count=0,
+                skipped_count=0,
+                failed_count=0,
+                failed_sys_ids=[],
+                elapsed_seconds=0,
+            )
+            session.add(job)
+        elif batch_size:
+            job.batch_size = batch_size
+        session.commit()
+        session.refresh(job)
+        return job
+
+
+def claim_job(job_id: int) -> bool:
+    """Mark a job as running, unless another worker is already running it."""
+    with Session() as session:
+        result = session.execute(
+            update(VoiceprintReembedJob)
+            .where(
+                VoiceprintReembedJob.sys_id == job_id,
+                or_(
+                    VoiceprintReembedJob.status.in_(["pending", "failed"]),
+                    VoiceprintReembedJob.heartbeat_dt < datetime.now() - STALE_JOB_TIMEOUT
+                )
+            )
+            .values(status="running", error_message=None, heartbeat_dt=datetime.now())
+        )
+        session.commit()
+        return result.rowcount == 1
+
+
+def reembed_voiceprint(voiceprint: VoiceprintLibrary, target_model_version: str) -> Optional[VoiceprintLibrary]:
+    """
+    Re-embed one voiceprint from its stored enrollment audio.
+    Returns a copy of the row for target_model_version, or None if there is no audio to re-embed from.
+    """
+    audio_blob = (voiceprint.metadata_json or {}).get("audio_blob")
+    if not audio_blob:
+        return None
+
+    file_path = os.path.join(UPLOAD_FOLDER, f"reembed_{uuid.uuid4()}.wav")
+    try:
+        if not fetch_enrollment_audio(audio_blob, file_path):
+            raise Exception(f"Failed to download enrollment audio {audio_blob}")
+        wav_np, sr = librosa.load(file_path, sr=None)
+        embedding = compute_embedding(wav_np, target_model_version)
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    return VoiceprintLibrary(
+        name=voiceprint.name,
+        email=voiceprint.email,
+        department=voiceprint.department,
+        position=voiceprint.position,
+        metadata_json={**voiceprint.metadata_json, "source_sys_id": voiceprint.sys_id},
+        embedding=embedding,
+        model_version=target_model_version
+    )
+
+
+def run_reembed_job(job_id: int) -> None:
+    """
+    Process a claimed job batch by batch.
+    Each batch's new rows and the checkpoint are committed together, so an interrupted job
+    resumes after the last committed voiceprint without duplicating any. Voiceprints that already have a
+    target version copy are never re-embedded again; those that failed in an earlier run are retried first.
+    """
+    try:
+        with Session() as session:
+            retry_sys_ids = list(session.get(VoiceprintReembedJob, job_id).failed_sys_ids or [])
+
+        while True:
+            batch_started = time.perf_counter()
+            with Session() as session:
+                job = session.get(VoiceprintReembedJob, job_id)
+                batch_filter = needs_reembedding(job.source_model_version, job.target_model_version)
+                if retry_sys_ids:
+                    # Failures of earlier runs, before the checkpoint, which stays where it is
+                    retried, retry_sys_ids = retry_sys_ids[:job.batch_size], retry_sys_ids[job.batch_size:]
+                    batch_filter &= VoiceprintLibrary.sys_id.in_(retried)
+                else:
+                    retried = []
+                    batch_filter &= VoiceprintLibrary.sys_id > job.last_sys_id
+                voiceprints = session.execute(
+                    select(VoiceprintLibrary).where(batch_filter).order_by(VoiceprintLibrary.sys_id).limit(job.batch_size)
+                ).scalars().all()
+
+                if not voiceprints and not retried:
+                    job.status = "completed"
+                    job.completed_dt = datetime.now()
+                    job.heartbeat_dt = datetime.now()
+                    session.commit()
+                    print(f"Re-embedding job {job_id} completed: {job_to_dict(job)}")
+                    return
+
+                failed_sys_ids = [sys_id for sys_id in job.failed_sys_ids or [] if sys_id not in retried]
+                for voiceprint in voiceprints:
+                    try:
+                        new_voiceprint = reembed_voiceprint(voiceprint, job.target_model_version)
+                        if new_voiceprint is None:
+                            job.skipped_count += 1
+                        else:
+                            session.add(new_voiceprint)
+                            job.processed_count += 1
+                    except Exception as e:
+                        print(f"Failed to re-embed voiceprint {voiceprint.sys_id}: {e}")
+                        failed_sys_ids.append(voiceprint.sys_id)
+
+                job.failed_sys_ids = failed_sys_ids
+                job.failed_count = len(failed_sys_ids)
+                if not retried:
+                    job.last_sys_id = voiceprints[-1].sys_id
+                job.elapsed_seconds += time.perf_counter() - batch_started
+                job.heartbeat_dt = datetime.now()
+                session.commit()
+                print(f"Re-embedding job {job_id}: checkpoint at sys_id {job.last_sys_id}, "
+                      f"{job.processed_count}/{job.total_count} re-embedded")
+
+    except Exception as e:
+        with Session() as session:
+            session.execute(
+                update(VoiceprintReembedJob)
+                .where(VoiceprintReembedJob.sys_id == job_id)
+                .values(status="failed", error_message=str(e), heartbeat_dt=datetime.now())
+            )
+            session.commit()
+        print(f"Re-embedding job {job_id} failed: {e}")
+
+
+def start_reembed_job(target_model_version: str, batch_size: Optional[int] = None) -> dict:
+    """
+    Create or resume a re-embedding job and run it on a background thread.
+
+    Args:
+        target_model_version: Encoder version to produce embeddings for
+        batch_size: Number of voiceprints per checkpoint
+
+    Returns:
+        The job status
+    """
+    job = create_or_resume_job(target_model_version, batch_size)
+    if claim_job(job.sys_id):
+        threading.Thread(target=run_reembed_job, args=(job.sys_id,), daemon=True).start()
+    return get_reembed_job(job.sys_id)
+
+
+def get_reembed_job(job_id: int) -> Optional[dict]:
+    with Session() as session:
+        job = session.get(VoiceprintReembedJob, job_id)
+        return job_to_dict(job) if job else None
+
+
+def reembed_voiceprint_library(request):
+    """
+    Start or resume re-embedding the voiceprint library with another encoder version.
+
+    Args:
+        request: Flask request object containing:
+            - target_model_version: Encoder version to re-embed into
+            - batch_size: (optional) Number of voiceprints per checkpoint
+
+    Returns:
+        The job status
+    """
+    data = request.get_json()
+    target_model_version = data.get('target_model_version')
+    batch_size = data.get('batch_size')
+
+    if not target_model_version:
+        return {"error": "target_model_version is required"}, 400
+
+    try:
+        return start_reembed_job(target_model_version, int(batch_size) if batch_size else None), 202
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+if __name__ == '__main__':
+    # Run a re-embedding job in the foreground: python -m src.voiceprint_reembed_service <target_model_version>
+    parser = argparse.ArgumentParser(description="Re-embed the voiceprint library with another encoder version")
+    parser.add_argument("target_model_version")
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+
+    reembed_job = create_or_resume_job(args.target_model_version, args.batch_size)
+    if not claim_job(reembed_job.sys_id):
+        print(f"Re-embedding job {reembed_job.sys_id} is already running")
+    else:
+        run_reembed_job(reembed_job.sys_id)
+    print(get_reembed_job(reembed_job.sys_id))
@@ -0,0 +1,73 @@
+"""
+Local stand-in for Azure Speech's webhook callbacks, to exercise /azure_transcription/webhook without a public URL.
+Signs events with AZURE_STT_WEBHOOK_SECRET the way Azure does.
+
+    # Registration challenge
+    python -m tools.azure_webhook_sender challenge
+
+    # Completion of a transcription (the backend then asks Azure, or the URL's host, for its status and files)
+    python -m tools.azure_webhook_sender completion https://<region>.api.cognitive.microsoft.com/speechtotext/v3.2/transcriptions/<id>
+
+    # Other events
+    python -m tools.azure_webhook_sender processing <transcription url>
+"""
+import os
+import hmac
+import json
+import uuid
+import base64
+import hashlib
+import argparse
+from datetime import datetime, timezone
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EVENTS = {
+    "creation": "TranscriptionCreation",
+    "processing": "TranscriptionProcessing",
+    "completion": "TranscriptionCompletion",
+    "deletion": "TranscriptionDeletion",
+}
+
+
+def sign(body: bytes, secret: str) -> str:
+    return base64.b64encode(hmac.new(secret.encode("utf-8"), body, hashlib.sha256).digest()).decode()
+
+
+def send_challenge(webhook_url: str) -> None:
+    token = uuid.uuid4().hex
+    response = requests.post(webhook_url, params={"validationToken": token}, headers={"X-MicrosoftSpeechServices-Event": "Challenge"}, timeout=10)
+    print(f"challenge: {response.status_code}, token echoed: {response.text == token}")
+
+
+def send_event(webhook_url: str, event: str, transcription_url: str, secret: str) -> None:
+    body = json.dumps({
+        "self": transcription_url,
+        "invokedDateTime": datetime.now(timezone.utc).isoformat()
+    }).encode("utf-8")
+    response = requests.post(webhook_url, data=body, timeout=30, headers={
+        "Content-Type": "application/json",
+        "X-MicrosoftSpeechServices-Event": EVENTS[event],
+        "X-MicrosoftSpeechServices-Signature": sign(body, secret),
+    })
+    print(f"{EVENTS[event]}: {response.status_code} {response.text.strip()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Send Azure Speech style webhook callbacks to the backend")
+    parser.add_argument("event", choices=["challenge", *EVENTS])
+    parser.add_argument("transcription_url", nargs="?")
+    parser.add_argument("--webhook-url", default="http://localhost:5000/azure_transcription/webhook")
+    parser.add_argument("--secret", default=os.getenv("AZURE_STT_WEBHOOK_SECRET"))
+    args = parser.parse_args()
+
+    if args.event == "challenge":
+        send_challenge(args.webhook_url)
+    else:
+        if not args.transcription_url:
+            parser.error("transcription_url is required for events")
+        if not args.secret:
+            parser.error("--secret or AZURE_STT_WEBHOOK_SECRET is required")
+        send_event(args.webhook_url, args.event, args.transcription_url, args.secret)
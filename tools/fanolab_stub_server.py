@@ -0,0 +1,131 @@
+"""
+Local stand-in for the Fanolab speech API, to exercise submissions and chunked transcription without Fanolab.
+Implements long-running-recognize and operations polling. Operations finish after a time proportional to their audio,
+so chunked submissions of a long recording visibly finish in about the time of their longest chunk.
+
+Utterances are found by energy and tagged by their dominant frequency, numbered per operation in order of first
+appearance like Fanolab's own chunk-local speaker tags. Test recordings with a distinct tone per speaker therefore
+get consistent diarization; transcripts are placeholders.
+
+    python -m tools.fanolab_stub_server --port 5055 --realtime-factor 0.02
+    # then run the backend with FANOLAB_HOST=http://localhost:5055
+"""
+import io
+import time
+import uuid
+import argparse
+import threading
+import numpy as np
+import requests
+import soundfile
+from flask import Flask, request, jsonify
+
+FRAME_SECONDS = 0.03
+MAX_PAUSE_SECONDS = 0.6  # Voiced runs separated by shorter pauses are one utterance
+MIN_UTTERANCE_SECONDS = 0.3
+TONE_BUCKET_HZ = 50  # Dominant frequencies within this distance are the same speaker
+
+app = Flask(__name__)
+operations = {}
+operations_lock = threading.Lock()
+settings = {"realtime_factor": 0.02, "min_seconds": 2.0}
+
+
+def find_utterances(samples: np.ndarray, sample_rate: int) -> list:
+    """(start, end, dominant frequency) of each voiced run of the mono samples."""
+    frame_length = int(sample_rate * FRAME_SECONDS)
+    frame_count = len(samples) // frame_length
+    if frame_count == 0:
+        return []
+    frames = samples[:frame_count * frame_length].reshape(frame_count, frame_length)
+    energy = np.sqrt(np.mean(frames ** 2, axis=1))
+    voiced = energy > max(0.1 * np.percentile(energy, 95), 1e-4)
+
+    utterances = []
+    run_start = None
+    last_voiced = None
+    for index in np.flatnonzero(voiced):
+        if run_start is not None and (index - last_voiced) * FRAME_SECONDS > MAX_PAUSE_SECONDS:
+            utterances.append((run_start, last_voiced + 1))
+            run_start = None
+        if run_start is None:
+            run_start = index
+        last_voiced = index
+    if run_start is not None:
+        utterances.append((run_start, last_voiced + 1))
+
+    results = []
+    for first, last in utterances:
+        if (last - first) * FRAME_SECONDS < MIN_UTTERANCE_SECONDS:
+            continue
+        segment = samples[first * frame_length:last * frame_length]
+        spectrum = np.abs(np.fft.rfft(segment))
+        frequency = np.fft.rfftfreq(len(segment), 1 / sample_rate)[int(np.argmax(spectrum[1:])) + 1]
+        results.append((first * FRAME_SECONDS, last * FRAME_SECONDS, frequency))
+    return results
+
+
+def recognize(audio: bytes) -> tuple[float, list]:
+    samples, sample_rate = soundfile.read(io.BytesIO(audio), dtype="float32", always_2d=True)
+    mono = samples.mean(axis=1)
+
+    tags = {}
+    results = []
+    for start, end, frequency in find_utterances(mono, sample_rate):
+        tag = tags.setdefault(int(round(frequency / TONE_BUCKET_HZ)), len(tags) + 1)
+        results.append({"alternatives": [{
+            "transcript": f"utterance at {start:.1f}s",
+            "startTime": f"{start:.3f}s",
+            "endTime": f"{end:.3f}s",
+            "speakerTag": str(tag),
+        }]})
+    return len(mono) / sample_rate, results
+
+
+@app.route('/speech/long-running-recognize', methods=['POST'])
+def long_running_recognize():
+    data = request.get_json()
+    uri = data.get("audio", {}).get("uri")
+    if not uri:
+        return jsonify({"error": {"code": 400, "message": "audio.uri is required"}}), 400
+
+    response = requests.get(uri, timeout=300)
+    if not response.ok:
+        return jsonify({"error": {"code": 400, "message": f"Failed to read audio: {response.status_code}"}}), 400
+    try:
+        duration, results = recognize(response.content)
+    except Exception as e:
+        return jsonify({"error": {"code": 400, "message": f"Unreadable audio: {e}"}}), 400
+
+    operation_id = uuid.uuid4().hex
+    with operations_lock:
+        operations[operation_id] = {
+            "done_at": time.time() + max(settings["min_seconds"], duration * settings["realtime_factor"]),
+            "results": results,
+        }
+    print(f"{operation_id}: {duration:.1f}s of audio, {len(results)} utterances")
+    return jsonify({"name": f"operations/{operation_id}", "metadata": {}})
+
+
+@app.route('/speech/operations/<operation_id>', methods=['GET'])
+def get_operation(operation_id):
+    with operations_lock:
+        operation = operations.get(operation_id)
+    if operation is None:
+        return jsonify({"error": {"code": 404, "message": "Operation not found"}}), 404
+    if time.time() < operation["done_at"]:
+        return jsonify({"name": f"operations/{operation_id}", "done": False, "metadata": {}})
+    return jsonify({"name": f"operations/{operation_id}", "done": True, "response": {"results": operation["results"]}})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Fanolab speech API")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--realtime-factor", type=float, default=settings["realtime_factor"],
+                        help="Seconds of processing per second of audio")
+    parser.add_argument("--min-seconds", type=float, default=settings["min_seconds"])
+    args = parser.parse_args()
+
+    settings["realtime_factor"] = args.realtime_factor
+    settings["min_seconds"] = args.min_seconds
+    app.run(port=args.port, threaded=True)
@@ -0,0 +1,156 @@
+"""
+Compare float32 (pgvector vector) and float16 (halfvec) voiceprint storage before running
+migrations/003_voiceprint_halfvec.sql: ranking agreement, threshold decisions, search latency and index size.
+
+    # Synthetic speakers, numpy only
+    python -m tools.voiceprint_precision_benchmark
+
+    # Load the same embeddings into temporary vector / halfvec tables with HNSW indexes and time the searches
+    python -m tools.voiceprint_precision_benchmark --database
+
+    # Use a tenant's stored voiceprints instead of synthetic ones
+    python -m tools.voiceprint_precision_benchmark --database --application-owner catomind
+"""
+import time
+import argparse
+import numpy as np
+from sqlalchemy import create_engine
+
+from src.db_config import get_database_url
+
+DIMENSIONS = 256
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def synthetic_embeddings(speakers: int, utterances: int, noise: float, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Clustered, L2 normalised, non-negative embeddings shaped like resemblyzer's output.
+    Returns (library, queries), the queries being unseen utterances of the enrolled speakers.
+    """
+    centroids = normalize(np.abs(rng.normal(size=(speakers, DIMENSIONS))))
+    library = normalize(np.abs(np.repeat(centroids, utterances, axis=0) + rng.normal(scale=noise, size=(speakers * utterances, DIMENSIONS))))
+    queries = normalize(np.abs(centroids + rng.normal(scale=noise, size=centroids.shape)))
+    return library.astype(np.float32), queries.astype(np.float32)
+
+
+def library_embeddings(application_owner: str, noise: float, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """A tenant's stored voiceprints, queried with noisy copies of themselves."""
+    from src.voiceprint_bundle_service import export_voiceprint_bundle, read_voiceprint_bundle
+    import io
+
+    bundle = io.BytesIO()
+    export_voiceprint_bundle(application_owner, bundle, dtype="float32")
+    bundle.seek(0)
+    _, library, _ = read_voiceprint_bundle(bundle)
+    library = normalize(library.astype(np.float32))
+    queries = normalize(np.abs(library + rng.normal(scale=noise, size=library.shape)))
+    return library, queries.astype(np.float32)
+
+
+def top_k(similarities: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-similarities, axis=1)[:, :k]
+
+
+def recall_at_k(reference: np.ndarray, candidate: np.ndarray) -> float:
+    k = reference.shape[1]
+    return float(np.mean([len(set(r) & set(c)) / k for r, c in zip(reference, candidate)]))
+
+
+def report(label: str, value: str) -> None:
+    print(f"{label + ':':<28}{value}")
+
+
+def latency_summary(latencies_ms: list) -> str:
+    latencies = np.array(latencies_ms)
+    return f"mean {latencies.mean():.2f} ms, p50 {np.percentile(latencies, 50):.2f} ms, p95 {np.percentile(latencies, 95):.2f} ms"
+
+
+def compare_in_memory(library: np.ndarray, queries: np.ndarray, k: int, threshold: float) -> np.ndarray:
+    """Exact search over float32 vs float16-rounded embeddings, returns the float32 top-k as reference."""
+    exact = queries @ library.T
+    # halfvec rounds both the stored vectors and the query
+    half = normalize(queries.astype(np.float16).astype(np.float32)) @ normalize(library.astype(np.float16).astype(np.float32)).T
+
+    exact_top, half_top = top_k(exact, k), top_k(half, k)
+    exact_best, half_best = exact.max(axis=1), half.max(axis=1)
+
+    print("== Exact search, float32 vs float16 ==")
+    report("library size", f"{library.shape[0]} x {library.shape[1]}")
+    report("storage", f"{library.astype(np.float32).nbytes / 1e6:.2f} MB vs {library.astype(np.float16).nbytes / 1e6:.2f} MB")
+    report("top-1 agreement", f"{np.mean(exact_top[:, 0] == half_top[:, 0]) * 100:.2f}%")
+    report(f"recall@{k}", f"{recall_at_k(exact_top, half_top) * 100:.2f}%")
+    report("max similarity error", f"{np.abs(exact - half).max():.6f}")
+    report(f"decisions at {threshold}", f"{np.mean((exact_best >= threshold) == (half_best >= threshold)) * 100:.2f}% identical")
+    return exact_top
+
+
+def compare_in_database(library: np.ndarray, queries: np.ndarray, exact_top: np.ndarray, k: int, ef_search: int) -> None:
+    """Load the library into temporary vector and halfvec tables with HNSW indexes and time the searches."""
+    engine = create_engine(get_database_url())
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        literals = ["[" + ",".join(f"{v:.8g}" for v in row) + "]" for row in library]
+        query_literals = ["[" + ",".join(f"{v:.8g}" for v in row) + "]" for row in queries]
+
+        for type_name, ops in (("vector", "vector_cosine_ops"), ("halfvec", "halfvec_cosine_ops")):
+            table = f"voiceprint_benchmark_{type_name}"
+            cursor.execute(f"CREATE TEMP TABLE {table} (id integer PRIMARY KEY, embedding {type_name}({DIMENSIONS}))")
+            cursor.executemany(f"INSERT INTO {table} (id, embedding) VALUES (%s, %s::{type_name})", list(enumerate(literals)))
+
+            build_started = time.perf_counter()
+            cursor.execute(f"CREATE INDEX {table}_idx ON {table} USING hnsw (embedding {ops})")
+            build_seconds = time.perf_counter() - build_started
+            cursor.execute(f"ANALYZE {table}")
+            cursor.execute(f"SELECT pg_relation_size('{table}'), pg_relation_size('{table}_idx')")
+            table_bytes, index_bytes = cursor.fetchone()
+            cursor.execute(f"SET hnsw.ef_search = {int(ef_search)}")
+
+            latencies, results = [], []
+            for literal in query_literals:
+                started = time.perf_counter()
+                cursor.execute(
+                    f"SELECT id FROM {table} ORDER BY embedding <=> %s::{type_name} LIMIT %s", (literal, k)
+                )
+                results.append([row[0] for row in cursor.fetchall()])
+                latencies.append((time.perf_counter() - started) * 1000)
+
+            results = np.array([r + [-1] * (k - len(r)) for r in results])
+            print(f"== pgvector {type_name} + HNSW (ef_search={ef_search}) ==")
+            report("table / index size", f"{table_bytes / 1e6:.2f} MB / {index_bytes / 1e6:.2f} MB")
+            report("index build", f"{build_seconds:.2f} s")
+            report("query latency", f"{latency_summary(latencies)}")
+            report("top-1 vs exact float32", f"{np.mean(results[:, 0] == exact_top[:, 0]) * 100:.2f}%")
+            report(f"recall@{k} vs exact float32", f"{recall_at_k(exact_top, results) * 100:.2f}%")
+        connection.rollback()
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark float32 vs float16 voiceprint storage")
+    parser.add_argument("--speakers", type=int, default=2000)
+    parser.add_argument("--utterances", type=int, default=3, help="enrollment clips per synthetic speaker")
+    parser.add_argument("--noise", type=float, default=0.04, help="std of the per-utterance noise")
+    parser.add_argument("--application-owner", default=None, help="benchmark a tenant's stored voiceprints")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--ef-search", type=int, default=40)
+    parser.add_argument("--database", action="store_true", help="also benchmark pgvector vector vs halfvec tables")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    random_generator = np.random.default_rng(args.seed)
+    if args.application_owner:
+        library_matrix, query_matrix = library_embeddings(args.application_owner, args.noise, random_generator)
+    else:
+        library_matrix, query_matrix = synthetic_embeddings(args.speakers, args.utterances, args.noise, random_generator)
+    query_matrix = query_matrix[random_generator.permutation(len(query_matrix))[:args.queries]]
+
+    reference_top = compare_in_memory(library_matrix, query_matrix, args.k, args.threshold)
+    if args.database:
+        compare_in_database(library_matrix, query_matrix, reference_top, args.k, args.ef_search)